@@ -0,0 +1,4 @@
+"""
+Offline benchmarks of the weather monitor, run against local stand-ins of the weather APIs
+
+"""
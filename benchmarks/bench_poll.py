@@ -0,0 +1,248 @@
+"""
+Throughput benchmark of the poll loop and the Weather Provider against the local fake services
+
+    python -m benchmarks.bench_poll --locations 10 100 1000 10000 --workers 16 --latency 0.01
+
+"""
+import argparse
+import logging
+import sys
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+import weathermonitor
+from benchmarks.fake_services import FakePushgateway, FakeWeatherAPI
+from weather import factory as weatherfactory
+from weather import metrics
+from weather.fetcher import FetchEngine
+from weather.provider import WeatherProvider
+from weather.publisher import BatchPushPublisher, LocationPushPublisher, PublisherProtocol
+from weather.weathersource import OpenWeatherMapSource, WeatherBitSource, WeatherGovSource
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+SERVICES = ("weather.gov", "openweathermap", "weatherbit")
+
+
+class BenchResult(NamedTuple):
+    name: str
+    locations: int
+    # wall time of the whole run, and of the poll cycle only (without setup)
+    seconds: float
+    cycle_seconds: float
+    requests: int
+    errors: int
+    pushes: int
+    cpu_seconds: float
+    # peak resident set size of the process in MiB, None where it can't be measured
+    max_rss_mib: Optional[float]
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.cycle_seconds if self.cycle_seconds > 0 else 0.0
+
+
+def max_rss_mib() -> Optional[float]:
+    if resource is None:
+        return None
+
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def synthetic_codes(count: int, service: str) -> List[str]:
+    """count distinct location codes in the format of a weather service"""
+    if service == "weather.gov":
+        return [f"BEN/{i % 1000},{i // 1000}" for i in range(count)]
+
+    return [str(1000000 + i) for i in range(count)]
+
+
+def synthetic_locations(count: int, service: str) -> List[Tuple[str, str]]:
+    """[LOCATIONS] config entries of count distinct locations of a weather service"""
+    codes = synthetic_codes(count, service)
+
+    return [
+        (f"bench{i}", str({"name": f"Bench {i}", "service": service, "location_code": code}))
+        for i, code in enumerate(codes)
+    ]
+
+
+def register_fake_sources(base_url: str) -> None:
+    """Point the weather monitor's Weather Sources at the fake weather API"""
+    sources = {
+        "weather.gov": WeatherGovSource(api_key="bench", base_url=base_url),
+        "openweathermap": OpenWeatherMapSource(api_key="bench", base_url=base_url),
+        "weatherbit": WeatherBitSource(api_key="bench", base_url=base_url),
+    }
+
+    for name, source in sources.items():
+        weatherfactory.deregister_source(name)
+        weatherfactory.register_source(name, source)
+
+
+def _cycle_seconds() -> float:
+    return metrics.REGISTRY.get_sample_value("weathermonitor_cycle_seconds_sum") or 0.0
+
+
+def bench_poll(
+    count: int,
+    service: str,
+    weather_api: FakeWeatherAPI,
+    pushgateway: FakePushgateway,
+    workers: int = 1,
+    batch_lookups: bool = False,
+    publish_mode: str = "location",
+) -> BenchResult:
+    """One poll cycle of poll_weather_services over count locations, published to the fake
+    Pushgateway"""
+    locations = synthetic_locations(count, service)
+
+    publisher: PublisherProtocol
+    if publish_mode == "batch":
+        publisher = BatchPushPublisher(pushgateway.url)
+    else:
+        publisher = LocationPushPublisher(pushgateway.url)
+
+    weatherfactory.register_provider("default", WeatherProvider(pool_size=max(workers, 1)))
+    weather_api.reset()
+    pushgateway.reset()
+
+    cycle_before = _cycle_seconds()
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+
+    weathermonitor.poll_weather_services(
+        locations,
+        api_keys={},
+        pushgateway_url=pushgateway.url,
+        fetch_workers=workers,
+        publisher=publisher,
+        batch_lookups=batch_lookups,
+        max_cycles=1,
+    )
+
+    seconds = time.perf_counter() - start
+    weatherfactory.provider().close()  # type: ignore
+
+    return BenchResult(
+        name=f"poll {service}{' batch' if batch_lookups else ''} {publish_mode}",
+        locations=count,
+        seconds=seconds,
+        cycle_seconds=_cycle_seconds() - cycle_before,
+        requests=weather_api.requests,
+        errors=weather_api.errors,
+        pushes=pushgateway.requests,
+        cpu_seconds=time.process_time() - cpu_before,
+        max_rss_mib=max_rss_mib(),
+    )
+
+
+def bench_provider(
+    count: int, service: str, weather_api: FakeWeatherAPI, workers: int = 1
+) -> BenchResult:
+    """Lookups of count locations through the WeatherProvider alone, nothing is published"""
+    source = weatherfactory.source(service)
+    codes = synthetic_codes(count, service)
+    provider = WeatherProvider(pool_size=max(workers, 1))
+    fetch_engine = FetchEngine(max_workers=workers)
+
+    def lookup(location_code: str):
+        try:
+            return provider.temperature(source, location_code)
+        except (ConnectionRefusedError, ProcessLookupError):
+            return None
+
+    weather_api.reset()
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+
+    try:
+        fetch_engine.run([(service, lambda code=code: lookup(code)) for code in codes])
+    finally:
+        fetch_engine.shutdown()
+        provider.close()
+
+    seconds = time.perf_counter() - start
+
+    return BenchResult(
+        name=f"provider {service}",
+        locations=count,
+        seconds=seconds,
+        cycle_seconds=seconds,
+        requests=weather_api.requests,
+        errors=weather_api.errors,
+        pushes=0,
+        cpu_seconds=time.process_time() - cpu_before,
+        max_rss_mib=max_rss_mib(),
+    )
+
+
+def report(results: List[BenchResult]) -> str:
+    header = (
+        f"{'benchmark':<36} {'locations':>9} {'total s':>9} {'cycle s':>9} {'req/s':>9} "
+        f"{'requests':>8} {'errors':>6} {'pushes':>6} {'cpu s':>8} {'max rss MiB':>11}"
+    )
+    lines = [header, "-" * len(header)]
+
+    for r in results:
+        rss = f"{r.max_rss_mib:.1f}" if r.max_rss_mib is not None else "n/a"
+        lines.append(
+            f"{r.name:<36} {r.locations:>9} {r.seconds:>9.3f} {r.cycle_seconds:>9.3f} "
+            f"{r.requests_per_second:>9.1f} {r.requests:>8} {r.errors:>6} {r.pushes:>6} "
+            f"{r.cpu_seconds:>8.3f} {rss:>11}"
+        )
+
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--locations", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--service", choices=SERVICES, nargs="+", default=["weather.gov"])
+    parser.add_argument("--workers", type=int, default=16, help="fetch_workers of the poll loop")
+    parser.add_argument("--latency", type=float, default=0.0, help="upstream latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream 503s")
+    parser.add_argument("--push-latency", type=float, default=0.0)
+    parser.add_argument("--push-error-rate", type=float, default=0.0)
+    parser.add_argument("--batch-lookups", action="store_true")
+    parser.add_argument("--publish-mode", choices=("location", "batch"), default="location")
+    parser.add_argument("--only", choices=("poll", "provider"), help="run a single benchmark")
+    args = parser.parse_args(argv)
+
+    # injected errors are expected, keep their warnings out of the report
+    logging.basicConfig(level=logging.ERROR)
+
+    weather_api = FakeWeatherAPI(latency=args.latency, error_rate=args.error_rate)
+    pushgateway = FakePushgateway(latency=args.push_latency, error_rate=args.push_error_rate)
+
+    results: List[BenchResult] = []
+    with weather_api, pushgateway:
+        register_fake_sources(weather_api.url)
+
+        for service in args.service:
+            for count in args.locations:
+                if args.only in (None, "provider"):
+                    results.append(bench_provider(count, service, weather_api, args.workers))
+                if args.only in (None, "poll"):
+                    results.append(
+                        bench_poll(
+                            count,
+                            service,
+                            weather_api,
+                            pushgateway,
+                            workers=args.workers,
+                            batch_lookups=args.batch_lookups,
+                            publish_mode=args.publish_mode,
+                        )
+                    )
+
+    print(report(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Local stand-ins for the weather APIs and the Pushgateway, with latency and error injection
+
+"""
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Type
+from urllib.parse import parse_qs, urlsplit
+
+# forecast periods / entries per single location response, about the size of the real payloads
+FORECAST_LENGTH = 14
+
+
+def _temperature(code: str, low: float, high: float) -> float:
+    """Stable pseudo temperature of a location code"""
+    return round(low + (zlib.crc32(code.encode()) % 1000) / 1000 * (high - low), 2)
+
+
+def weather_gov_forecast(code: str) -> Dict:
+    periods = [
+        {
+            "number": i + 1,
+            "name": f"Period {i + 1}",
+            "isDaytime": i % 2 == 0,
+            "temperature": int(_temperature(f"{code}/{i}", 10, 95)),
+            "temperatureUnit": "F",
+            "windSpeed": "5 to 10 mph",
+            "windDirection": "SW",
+            "shortForecast": "Partly Cloudy",
+            "detailedForecast": "Partly cloudy, with a high near 80. Southwest wind 5 to 10 mph.",
+        }
+        for i in range(FORECAST_LENGTH)
+    ]
+    return {"properties": {"units": "us", "periods": periods}}
+
+
+def weather_gov_points(base_url: str, coordinates: str) -> Dict:
+    """Points answer linking coordinates to the hourly forecast of a stable pseudo gridpoint"""
+    checksum = zlib.crc32(coordinates.encode())
+    gridpoint = f"PNT/{checksum % 100},{checksum // 100 % 100}"
+
+    return {
+        "properties": {
+            "gridId": "PNT",
+            "forecast": f"{base_url}/gridpoints/{gridpoint}/forecast",
+            "forecastHourly": f"{base_url}/gridpoints/{gridpoint}/forecast/hourly",
+        }
+    }
+
+
+def openweathermap_forecast(code: str) -> Dict:
+    entries = [
+        {
+            "dt": 1660000000 + i * 10800,
+            "main": {"temp": _temperature(f"{code}/{i}", 260, 310), "humidity": 50},
+            "weather": [{"id": 800, "main": "Clear", "description": "clear sky"}],
+        }
+        for i in range(FORECAST_LENGTH)
+    ]
+    return {"cod": "200", "cnt": len(entries), "list": entries}
+
+
+def openweathermap_group(codes: List[str]) -> Dict:
+    entries = [
+        {"id": int(code), "name": f"City {code}", "main": {"temp": _temperature(code, 260, 310)}}
+        for code in codes
+    ]
+    return {"cnt": len(entries), "list": entries}
+
+
+def weatherbit_current(codes: List[str]) -> Dict:
+    entries = [
+        {"city_id": code, "city_name": f"City {code}", "temp": _temperature(code, -10, 35)}
+        for code in codes
+    ]
+    return {"count": len(entries), "data": entries}
+
+
+class FakeServer:
+    """Threaded HTTP server on a free local port, answering in the background until stopped
+
+    Every request waits latency seconds, a share error_rate of them is answered with a 503
+    """
+
+    handler: Type[BaseHTTPRequestHandler]
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        self._server.daemon_threads = True
+        self._server.fake = self  # type: ignore
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+
+    def admit(self) -> bool:
+        """Count a request and apply the injected latency, False when it has to fail"""
+        with self._lock:
+            self.requests += 1
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        return not failed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _WeatherHandler(_Handler):
+    def do_GET(self) -> None:
+        if not self.server.fake.admit():  # type: ignore
+            self.send_body(503, b'{"error": "injected failure"}')
+            return
+
+        routed = self.route()
+        if routed is None:
+            self.send_body(404, b'{"error": "not found"}')
+            return
+
+        self.send_body(200, json.dumps(routed).encode("utf-8"))
+
+    def route(self) -> Optional[Dict]:
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        path = parts.path
+
+        if path.startswith("/points/"):
+            return weather_gov_points(f"http://{self.headers['Host']}", path[len("/points/") :])
+        if path.startswith("/gridpoints/") and path.endswith("/forecast"):
+            return weather_gov_forecast(path[len("/gridpoints/") : -len("/forecast")])
+        if path.startswith("/gridpoints/") and path.endswith("/forecast/hourly"):
+            return weather_gov_forecast(path[len("/gridpoints/") : -len("/forecast/hourly")])
+        if path == "/data/2.5/forecast" and "id" in query:
+            return openweathermap_forecast(query["id"][0])
+        if path == "/data/2.5/group" and "id" in query:
+            return openweathermap_group(query["id"][0].split(","))
+        if path == "/v2.0/current" and "city_id" in query:
+            return weatherbit_current([query["city_id"][0]])
+        if path == "/v2.0/current" and "cities" in query:
+            return weatherbit_current(query["cities"][0].split(","))
+
+        return None
+
+
+class FakeWeatherAPI(FakeServer):
+    """Answers the Weather.gov, OpenWeatherMap and Weatherbit requests of the weather sources,
+    point their base_url at url"""
+
+    handler = _WeatherHandler
+
+
+class _PushgatewayHandler(_Handler):
+    def _accept(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+
+        if not self.server.fake.admit():  # type: ignore
+            self.send_body(503, b"injected failure", "text/plain")
+            return
+
+        self.server.fake.received(self.path, body)  # type: ignore
+        self.send_body(200, b"", "text/plain")
+
+    do_PUT = _accept
+    do_POST = _accept
+    do_DELETE = _accept
+
+
+class FakePushgateway(FakeServer):
+    """Accepts and discards pushes, keeping count of the pushes and bytes per grouping path"""
+
+    handler = _PushgatewayHandler
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> None:
+        super().__init__(latency, error_rate, seed)
+        self.pushes: Dict[str, Tuple[int, int]] = {}
+
+    def reset(self) -> None:
+        super().reset()
+        with self._lock:
+            self.pushes = {}
+
+    def received(self, path: str, body: bytes) -> None:
+        with self._lock:
+            count, size = self.pushes.get(path, (0, 0))
+            self.pushes[path] = (count + 1, size + len(body))
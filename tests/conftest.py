@@ -0,0 +1,12 @@
+import pytest
+import weathermonitor
+from weather import factory
+
+
+@pytest.fixture
+def sources():
+    """Registers the weather monitor's Weather Sources for the duration of a test"""
+    weathermonitor.register_sources({})
+    yield
+    for name in ("weather.gov", "openweathermap", "weatherbit"):
+        factory.deregister_source(name)
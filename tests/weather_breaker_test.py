@@ -0,0 +1,60 @@
+from weather.breaker import BreakerState, CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, clock=FakeClock())
+
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == BreakerState.CLOSED
+
+    breaker.record_success()
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+
+    assert breaker.state == BreakerState.OPEN
+    assert not breaker.allow()
+
+
+def test_half_open_probe_closes_or_reopens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=60, clock=clock)
+
+    breaker.allow()
+    breaker.record_failure()
+
+    clock.now = 60
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert breaker.allow()
+    # only one probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == BreakerState.OPEN
+
+    clock.now = 120
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.allow()
+
+
+def test_released_probe_can_be_retried():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0, clock=clock)
+
+    breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
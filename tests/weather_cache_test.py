@@ -0,0 +1,114 @@
+import pytest
+from weather.cache import ResponseCache
+from weather.provider import WeatherProvider
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+from weather.weathersource import WeatherGovSource
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+        self.history = []
+
+    def json(self):
+        return self.payload
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+
+    cache.put("src", "a", TemperatureMeasurement(1, TemperatureUnit.CELSIUS))
+    cache.put("src", "b", TemperatureMeasurement(2, TemperatureUnit.CELSIUS))
+    cache.get("src", "a")
+    cache.put("src", "c", TemperatureMeasurement(3, TemperatureUnit.CELSIUS))
+
+    assert cache.get("src", "b") is None
+    assert cache.get("src", "a") is not None and cache.get("src", "c") is not None
+
+
+def test_ttl_per_source():
+    cache = ResponseCache(default_ttl=0, ttls={"slow": 3600})
+
+    fast = cache.put("fast", "a", TemperatureMeasurement(1, TemperatureUnit.CELSIUS))
+    slow = cache.put("slow", "a", TemperatureMeasurement(1, TemperatureUnit.CELSIUS))
+
+    assert not fast.fresh()
+    assert slow.fresh()
+
+
+def test_provider_revalidates_with_etag(monkeypatch):
+    provider = WeatherProvider(cache=ResponseCache())
+    source = WeatherGovSource("abc")
+    requests_headers = []
+    period = {"temperature": 70, "temperatureUnit": "F"}
+    responses = [
+        FakeResponse(200, {"properties": {"periods": [period]}}, {"ETag": '"v1"'}),
+        FakeResponse(304),
+    ]
+
+    def fake_get(source, url, headers=None, stream=False):
+        requests_headers.append(headers)
+        return responses.pop(0)
+
+    monkeypatch.setattr(provider, "_get", fake_get)
+
+    first = provider.temperature(source, "LMK/1,1")
+    second = provider.temperature(source, "LMK/1,1")
+
+    assert requests_headers == [None, {"If-None-Match": '"v1"'}]
+    assert first.value == second.value == 70
+
+
+def test_provider_fresh_hit_skips_request(monkeypatch):
+    provider = WeatherProvider(cache=ResponseCache(default_ttl=3600))
+    source = WeatherGovSource("abc")
+    calls = []
+    period = {"temperature": 70, "temperatureUnit": "F"}
+
+    def fake_get(source, url, headers=None, stream=False):
+        calls.append(url)
+        return FakeResponse(200, {"properties": {"periods": [period]}})
+
+    monkeypatch.setattr(provider, "_get", fake_get)
+
+    provider.temperature(source, "LMK/1,1")
+    provider.temperature(source, "LMK/1,1")
+
+    assert len(calls) == 1
+
+
+def test_stale_reading_served_while_refreshed(monkeypatch):
+    cache = ResponseCache(default_ttl=0)
+    provider = WeatherProvider(cache=cache, max_staleness=3600)
+    source = WeatherGovSource("abc")
+    cache.put(source.name, "LMK/1,1", TemperatureMeasurement(60, TemperatureUnit.FAHRENHEIT))
+    period = {"temperature": 70, "temperatureUnit": "F"}
+
+    def fake_get(source, url, headers=None, stream=False):
+        return FakeResponse(200, {"properties": {"periods": [period]}})
+
+    monkeypatch.setattr(provider, "_get", fake_get)
+
+    assert provider.temperature(source, "LMK/1,1").value == 60
+    provider._refresher.shutdown(wait=True)
+    assert cache.get(source.name, "LMK/1,1").temperature.value == 70
+
+
+def test_too_stale_reading_is_refetched(monkeypatch):
+    cache = ResponseCache(default_ttl=0)
+    provider = WeatherProvider(cache=cache, max_staleness=60)
+    source = WeatherGovSource("abc")
+    entry = cache.put(
+        source.name, "LMK/1,1", TemperatureMeasurement(60, TemperatureUnit.FAHRENHEIT)
+    )
+    entry.fetched_at -= 120
+
+    def fake_get(source, url, headers=None, stream=False):
+        raise ProcessLookupError("upstream down")
+
+    monkeypatch.setattr(provider, "_get", fake_get)
+
+    with pytest.raises(ProcessLookupError):
+        provider.temperature(source, "LMK/1,1")
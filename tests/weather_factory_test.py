@@ -15,5 +15,9 @@ def test_no_dup_service():
     factory.register_source("weather.gov", WeatherGovSource("abc"))
     factory.register_source("openweathermap", OpenWeatherMapSource("abc"))
 
-    with pytest.raises(ValueError):
-        factory.register_source("openweathermap", WeatherBitSource("abc"))
+    try:
+        with pytest.raises(ValueError):
+            factory.register_source("openweathermap", WeatherBitSource("abc"))
+    finally:
+        factory.deregister_source("weather.gov")
+        factory.deregister_source("openweathermap")
@@ -0,0 +1,169 @@
+import threading
+import time
+
+import pytest
+from weather.fetcher import FetchEngine, SingleFlight
+from weather.ratelimit import RateLimiter
+
+
+def test_sequential_keeps_order():
+    engine = FetchEngine()
+
+    results = engine.run([("a", lambda i=i: i) for i in range(5)])
+
+    assert results == [0, 1, 2, 3, 4]
+
+
+def test_concurrent_keeps_order():
+    engine = FetchEngine(max_workers=4)
+
+    try:
+        results = engine.run([("a", lambda i=i: i) for i in range(20)])
+    finally:
+        engine.shutdown()
+
+    assert results == list(range(20))
+
+
+def test_concurrent_wall_time_bounded_by_slowest():
+    engine = FetchEngine(max_workers=8)
+
+    start = time.monotonic()
+    try:
+        engine.run([("a", lambda: time.sleep(0.1)) for _ in range(8)])
+    finally:
+        engine.shutdown()
+
+    assert time.monotonic() - start < 0.5
+
+
+def test_per_source_cap():
+    engine = FetchEngine(max_workers=8, max_per_source=2)
+    lock = threading.Lock()
+    in_flight = {"a": 0, "b": 0}
+    peak = {"a": 0, "b": 0}
+
+    def task(name):
+        with lock:
+            in_flight[name] += 1
+            peak[name] = max(peak[name], in_flight[name])
+        time.sleep(0.02)
+        with lock:
+            in_flight[name] -= 1
+
+    try:
+        engine.run([(name, lambda name=name: task(name)) for name in "ab" * 6])
+    finally:
+        engine.shutdown()
+
+    assert peak["a"] <= 2 and peak["b"] <= 2
+
+
+def test_per_source_cap_does_not_block_other_sources():
+    engine = FetchEngine(max_workers=4, max_per_source=1)
+    started = {}
+    lock = threading.Lock()
+    begin = time.perf_counter()
+
+    def task(name, index):
+        with lock:
+            started.setdefault(name, time.perf_counter() - begin)
+        time.sleep(0.02)
+        return index
+
+    try:
+        results = engine.run(
+            [(name, lambda name=name, i=i: task(name, i)) for i, name in enumerate("aaaaaaab")]
+        )
+    finally:
+        engine.shutdown()
+
+    assert results == list(range(8))
+    # b starts right away instead of queuing behind the whole run of a
+    assert started["b"] < 0.05
+
+
+def test_rate_limited_source_does_not_hold_up_other_sources():
+    # 10 requests a second for a, none for b
+    rate_limiter = RateLimiter(rate_per_minute=600)
+    engine = FetchEngine(max_workers=4, rate_limiters={"a": rate_limiter})
+    started = {}
+    lock = threading.Lock()
+    begin = time.perf_counter()
+
+    def task(name, index):
+        with lock:
+            started.setdefault(name, []).append(time.perf_counter() - begin)
+        if name == "a":
+            rate_limiter.acquire()
+        return index
+
+    try:
+        results = engine.run(
+            [(name, lambda name=name, i=i: task(name, i)) for i, name in enumerate("aaaaab")]
+        )
+    finally:
+        engine.shutdown()
+
+    assert results == list(range(6))
+    # b runs right away while the tokens of a are waited for outside the pool
+    assert started["b"][0] < 0.05
+    assert started["a"][-1] > 0.35
+    gaps = [later - earlier for earlier, later in zip(started["a"], started["a"][1:])]
+    assert min(gaps) > 0.08
+
+
+def test_reserved_token_goes_back_when_unused():
+    rate_limiter = RateLimiter(rate_per_minute=60)
+    engine = FetchEngine(max_workers=2, rate_limiters={"a": rate_limiter})
+
+    start = time.monotonic()
+    try:
+        # served from the cache, none of the tasks sends a request
+        engine.run([("a", lambda: None) for _ in range(5)])
+    finally:
+        engine.shutdown()
+
+    assert time.monotonic() - start < 0.5
+
+
+def test_invalid_workers():
+    with pytest.raises(ValueError):
+        FetchEngine(max_workers=0)
+
+
+def test_single_flight_shares_call():
+    flights = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return 42
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", slow)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(flights.do("key", slow)))
+    follower.start()
+    leader.join()
+    follower.join()
+
+    assert results == [42, 42]
+    assert len(calls) == 1
+
+
+def test_single_flight_shares_error():
+    flights = SingleFlight()
+
+    def fail():
+        raise ProcessLookupError("down")
+
+    with pytest.raises(ProcessLookupError):
+        flights.do("key", fail)
+
+    # a failed call is not remembered
+    assert flights.do("key", lambda: 1) == 1
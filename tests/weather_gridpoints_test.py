@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+from weather.gridpoints import GridpointCache, parse_coordinates
+
+
+@pytest.mark.parametrize(
+    "location_code, coordinates",
+    [
+        ("38.2527,-85.7585", ("38.2527", "-85.7585")),
+        (" 38.252712 , -85.75849 ", ("38.2527", "-85.7585")),
+        ("40,-105", ("40", "-105")),
+        ("LMK/50,78", None),
+        ("95,10", None),
+    ],
+)
+def test_parse_coordinates(location_code, coordinates):
+    assert parse_coordinates(location_code) == coordinates
+
+
+def test_resolutions_expire():
+    now = [1000.0]
+    cache = GridpointCache(ttl=60, clock=lambda: now[0])
+
+    cache.put("1,2", "https://example/forecast/hourly")
+    assert cache.get("1,2") == "https://example/forecast/hourly"
+
+    now[0] += 60
+    assert cache.get("1,2") is None
+
+
+def test_resolutions_survive_restart(tmp_path):
+    path = str(tmp_path / "gridpoints.json")
+
+    cache = GridpointCache(path)
+    cache.put("1,2", "https://example/a/forecast/hourly")
+    cache.put("3,4", "https://example/b/forecast/hourly")
+    cache.invalidate("3,4")
+    cache.close()
+
+    restarted = GridpointCache(path)
+    assert len(restarted) == 1
+    assert restarted.get("1,2") == "https://example/a/forecast/hourly"
+
+
+def test_resolutions_are_written_together_off_the_lookup_thread(tmp_path):
+    cache = GridpointCache(str(tmp_path / "gridpoints.json"), flush_interval=60)
+    saves = []
+    save = cache._save
+    cache._save = lambda entries: saves.append(threading.current_thread().name) or save(entries)
+
+    for i in range(100):
+        cache.put(f"{i},0", f"https://example/{i}/forecast/hourly")
+    assert saves == []
+
+    cache.close()
+    assert saves == ["weather-gridpoints"]
+    assert len(GridpointCache(str(tmp_path / "gridpoints.json"))) == 100
+
+
+def test_unreadable_file_is_ignored(tmp_path):
+    path = tmp_path / "gridpoints.json"
+    path.write_text("{not json")
+
+    assert len(GridpointCache(str(path))) == 0
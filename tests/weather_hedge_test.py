@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from weather.hedge import LatencyTracker, hedged
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def test_fast_primary_needs_no_hedge(executor):
+    calls = []
+
+    def call(name):
+        calls.append(name)
+        return name
+
+    assert hedged([lambda: call("a"), lambda: call("b")], lambda i: 5.0, executor) == (0, "a")
+    assert calls == ["a"]
+
+
+def test_slow_primary_is_hedged(executor):
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "slow"
+
+    try:
+        assert hedged([slow, lambda: "fast"], lambda i: 0.01, executor) == (1, "fast")
+    finally:
+        release.set()
+
+
+def test_failures_move_on_and_last_error_is_raised(executor):
+    def fail(message):
+        raise ProcessLookupError(message)
+
+    assert hedged([lambda: fail("a"), lambda: "b"], lambda i: 5.0, executor) == (1, "b")
+
+    with pytest.raises(ProcessLookupError, match="b"):
+        hedged([lambda: fail("a"), lambda: fail("b")], lambda i: 5.0, executor)
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(window=100, min_samples=10)
+    for i in range(5):
+        tracker.observe("src", i)
+
+    assert tracker.percentile("src", 0.9) is None
+
+    for i in range(5, 100):
+        tracker.observe("src", i)
+
+    assert tracker.percentile("src", 0.9) == 90
+
+
+def test_delay_runs_from_the_start_of_a_queued_call():
+    busy = threading.Event()
+    calls = []
+
+    def call(name):
+        calls.append(name)
+        return name
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        for _ in range(2):
+            pool.submit(busy.wait, 0.1)
+
+        # queued behind the busy workers for longer than the delay, but fast once it runs
+        assert hedged([lambda: call("a"), lambda: call("b")], lambda i: 0.02, pool) == (0, "a")
+
+    assert calls == ["a"]
@@ -0,0 +1,90 @@
+import math
+import random
+
+import pytest
+from weather.history import RingBuffer, TemperatureHistory
+from weather.readings import Reading
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+
+
+def test_ring_buffer_matches_window():
+    rng = random.Random(1)
+    buffer = RingBuffer(5)
+    values = []
+
+    for i in range(40):
+        value = rng.uniform(-20, 40)
+        values.append(value)
+        buffer.append(float(i), value)
+
+        window = values[-5:]
+        assert len(buffer) == len(window)
+        assert buffer.minimum == min(window)
+        assert buffer.maximum == max(window)
+        assert buffer.mean == pytest.approx(sum(window) / len(window))
+        if len(window) > 1:
+            assert buffer.rate() == pytest.approx((window[-1] - window[0]) / (len(window) - 1))
+
+
+def test_empty_ring_buffer():
+    buffer = RingBuffer(3)
+
+    assert math.isnan(buffer.mean) and buffer.rate() == 0.0
+    with pytest.raises(ValueError):
+        RingBuffer(0)
+
+
+def test_history_exports_aggregates():
+    now = [0.0]
+    history = TemperatureHistory(3, clock=lambda: now[0])
+
+    for value in (10, 20, 30, 40):
+        history.record(TemperatureMeasurement(value, TemperatureUnit.CELSIUS), "Home", "weatherbit")
+        now[0] += 60
+
+    def sample(name, **labels):
+        labels = {"source": "weatherbit", "location": "Home", **labels}
+        return history.registry.get_sample_value(name, labels)
+
+    assert sample("weather_temperature_window_celsius", stat="min") == 20
+    assert sample("weather_temperature_window_celsius", stat="max") == 40
+    assert sample("weather_temperature_window_fahrenheit", stat="mean") == 86
+    assert sample("weather_temperature_rate_celsius_per_second") == pytest.approx(20 / 120)
+
+    history.remove("Home", "weatherbit")
+
+    assert sample("weather_temperature_window_celsius", stat="min") is None
+    assert history.buffer("Home", "weatherbit") is None
+
+
+def test_history_records_readings_of_mixed_units():
+    history = TemperatureHistory(4)
+
+    history.record_readings(
+        [
+            Reading(50, TemperatureUnit.FAHRENHEIT, "weather.gov", "Home", 100.0),
+            Reading(283.15, TemperatureUnit.KELVIN, "weatherbit", "Home", 100.0),
+            Reading(14, TemperatureUnit.CELSIUS, "weather.gov", "Home", 160.0),
+        ]
+    )
+
+    def sample(source, stat):
+        labels = {"source": source, "location": "Home", "stat": stat}
+        return history.registry.get_sample_value("weather_temperature_window_celsius", labels)
+
+    assert (sample("weather.gov", "min"), sample("weather.gov", "max")) == (10, 14)
+    assert sample("weatherbit", "mean") == 10
+
+
+def test_history_keeps_readings_at_their_fetch_time_once():
+    history = TemperatureHistory(4, clock=lambda: 10_000.0)
+
+    # fetched, then served again from the cache, then fetched again a minute later
+    for value, fetched_at in ((10, 100.0), (10, 100.0), (16, 160.0)):
+        history.record_readings(
+            [Reading(value, TemperatureUnit.CELSIUS, "weatherbit", "Home", fetched_at)]
+        )
+
+    buffer = history.buffer("Home", "weatherbit")
+    assert len(buffer) == 2 and buffer.latest == 160.0
+    assert buffer.rate() == pytest.approx(6 / 60)
@@ -0,0 +1,73 @@
+import json
+import logging
+import logging.handlers
+import queue
+
+import pytest
+from weather import metrics
+from weather.logs import DroppingQueueHandler, start_logging
+
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger("weather.logs.test")
+    logger.propagate = False
+    yield logger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+
+def test_records_written_by_the_listener(tmp_path, logger):
+    path = tmp_path / "monitor.log"
+    listener = start_logging(str(path), level=logging.INFO, logger=logger)
+
+    logger.info("polled %d lookups", 3)
+    logger.debug("not written")
+    listener.stop()
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1 and lines[0].endswith("INFO:polled 3 lookups")
+
+
+def test_json_lines(tmp_path, logger):
+    path = tmp_path / "monitor.log"
+    listener = start_logging(str(path), json_lines=True, logger=logger)
+
+    try:
+        raise ProcessLookupError("upstream down")
+    except ProcessLookupError:
+        logger.exception("lookup of %s failed", "LMK/1,1")
+    listener.stop()
+
+    entry = json.loads(path.read_text())
+    assert entry["level"] == "ERROR"
+    assert entry["message"] == "lookup of LMK/1,1 failed"
+    assert "ProcessLookupError: upstream down" in entry["exception"]
+
+
+def test_disabled_levels_are_never_formatted(tmp_path, logger):
+    formatted = []
+
+    class Expensive:
+        def __str__(self):
+            formatted.append(True)
+            return "expensive"
+
+    listener = start_logging(str(tmp_path / "monitor.log"), level=logging.ERROR, logger=logger)
+    logger.debug("reading %s", Expensive())
+    listener.stop()
+
+    assert formatted == []
+
+
+def test_full_queue_drops_instead_of_blocking(logger):
+    before = metrics.REGISTRY.get_sample_value("weathermonitor_log_records_dropped_total") or 0
+    logger.addHandler(DroppingQueueHandler(queue.Queue(maxsize=1)))
+    logger.setLevel(logging.INFO)
+
+    logger.info("queued")
+    logger.info("dropped")
+
+    assert (
+        metrics.REGISTRY.get_sample_value("weathermonitor_log_records_dropped_total") == before + 1
+    )
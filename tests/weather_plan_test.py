@@ -0,0 +1,88 @@
+import pytest
+from weather import factory
+from weather.plan import build_poll_plan
+
+
+def test_plan_resolves_sources_and_labels(sources):
+    plan = build_poll_plan(
+        [("location1", "{'name': 'Home', 'service': 'weather.gov', 'location_code': 'LMK/50,78'}")]
+    )
+
+    location = plan.locations[0]
+    assert location.source is factory.source("weather.gov")
+    assert location.labels == ("weather.gov", "Home")
+
+
+def test_duplicate_lookups_share_a_lookup(sources):
+    plan = build_poll_plan(
+        [
+            ("l1", "{'name': 'Home', 'service': 'weather.gov', 'location_code': 'LMK/50,78'}"),
+            ("l2", "{'name': 'Office', 'service': 'weather.gov', 'location_code': 'LMK/50,78'}"),
+            ("l3", "{'name': 'Cabin', 'service': 'weather.gov', 'location_code': 'JKL/1,1'}"),
+        ]
+    )
+
+    assert len(plan.lookups) == 2
+    assert [l.name for l in plan.lookups[0].locations] == ["Home", "Office"]
+
+
+def test_batch_lookups_group_by_source(sources):
+    locations = [
+        (f"l{i}", f"{{'name': 'City {i}', 'service': 'weatherbit', 'location_code': '{i % 30}'}}")
+        for i in range(60)
+    ]
+
+    plan = build_poll_plan(locations, batch_lookups=True)
+
+    # 30 unique codes, 20 per request
+    assert len(plan.lookups) == 2
+    assert all(lookup.batch for lookup in plan.lookups)
+    assert sum(len(lookup.locations) for lookup in plan.lookups) == 60
+
+
+def test_malformed_entries_are_reported(sources):
+    with pytest.raises(ValueError) as e:
+        build_poll_plan(
+            [
+                ("bad_syntax", "{'name': 'Home'"),
+                ("missing", "{'name': 'Home', 'service': 'weather.gov'}"),
+                ("unknown", "{'name': 'Home', 'service': 'nope', 'location_code': '1'}"),
+            ]
+        )
+
+    message = str(e.value)
+    assert "bad_syntax" in message and "missing" in message and "unknown" in message
+
+
+def test_fallbacks_make_a_hedged_single_lookup(sources):
+    plan = build_poll_plan(
+        [
+            (
+                "l1",
+                "{'name': 'Home', 'service': 'weatherbit', 'location_code': '1',"
+                " 'fallbacks': [{'service': 'openweathermap', 'location_code': '2'}]}",
+            ),
+            ("l2", "{'name': 'Office', 'service': 'weatherbit', 'location_code': '1'}"),
+        ],
+        batch_lookups=True,
+    )
+
+    hedged_lookup = next(lookup for lookup in plan.lookups if lookup.alternates)
+    assert not hedged_lookup.batch
+    assert [(a.service, a.location_code) for a in hedged_lookup.alternates] == [
+        ("openweathermap", "2")
+    ]
+    assert plan.locations[0].all_labels() == (("weatherbit", "Home"), ("openweathermap", "Home"))
+
+
+def test_fallbacks_are_validated(sources):
+    with pytest.raises(ValueError, match="fallbacks"):
+        build_poll_plan(
+            [
+                (
+                    "l1",
+                    "{'name': 'Home', 'service': 'weatherbit', 'location_code': '1',"
+                    " 'fallbacks': [{'service': 'nowhere', 'location_code': '2'}]}",
+                )
+            ]
+        )
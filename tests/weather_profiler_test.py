@@ -0,0 +1,81 @@
+import json
+import threading
+
+from weather.profiler import Profiler, StackSampler
+
+
+def test_idle_profiler_records_nothing(tmp_path):
+    profiler = Profiler(output_dir=str(tmp_path), sample_interval=None)
+
+    with profiler.cycle():
+        with profiler.span("temperature", source="Weather.gov"):
+            pass
+
+    assert not profiler.active
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_requested_cycles_are_profiled(tmp_path):
+    now = [0.0]
+    profiler = Profiler(output_dir=str(tmp_path), sample_interval=None, clock=lambda: now[0])
+    profiler.request(cycles=2)
+
+    for cycle in range(3):
+        with profiler.cycle(lookups="1"):
+            with profiler.span("temperature", source="Weather.gov", location=f"LMK/{cycle},1"):
+                now[0] += 0.5 if cycle == 1 else 0.1
+            now[0] += 0.05
+        assert profiler.active == (cycle == 0)
+    profiler.wait()
+
+    (trace,) = tmp_path.glob("*.trace.json")
+    events = [event for event in json.loads(trace.read_text())["traceEvents"] if event["ph"] == "X"]
+    assert [event["name"] for event in events] == ["temperature", "cycle"] * 2
+
+    (report,) = tmp_path.glob("*.slow.txt")
+    lines = report.read_text().splitlines()
+    assert [line.split()[:2] for line in lines[1:3]] == [["cycle", "2"], ["temperature", "2"]]
+    slowest = lines[lines.index("slowest 25 calls") + 1 :]
+    assert "temperature" in slowest[1] and slowest[1].endswith("location=LMK/1,1")
+
+
+def test_reports_are_written_after_the_cycle(tmp_path, monkeypatch):
+    profiler = Profiler(output_dir=str(tmp_path), sample_interval=None)
+    writing, release = threading.Event(), threading.Event()
+
+    def slow_write(*args):
+        writing.set()
+        release.wait(5)
+
+    monkeypatch.setattr(profiler, "_write_folded", slow_write)
+    profiler.request(cycles=1)
+
+    with profiler.cycle():
+        pass
+    # the cycle is over while the reports are still being written
+    assert writing.wait(5) and list(tmp_path.glob("*.slow.txt")) == []
+
+    release.set()
+    profiler.wait()
+    assert len(list(tmp_path.glob("*.slow.txt"))) == 1
+
+
+def test_sampler_collapses_the_stacks_of_other_threads():
+    started, release = threading.Event(), threading.Event()
+
+    def polling():
+        started.set()
+        release.wait(5)
+
+    thread = threading.Thread(target=polling, name="weather-fetch")
+    thread.start()
+    started.wait(5)
+    sampler = StackSampler()
+    try:
+        sampler.sample()
+    finally:
+        release.set()
+        thread.join()
+
+    (stack,) = [stack for stack in sampler.samples if stack.startswith("weather-fetch;")]
+    assert f"{__name__}:polling" in stack.split(";")
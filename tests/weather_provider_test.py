@@ -6,8 +6,12 @@
 # sys.path.insert(0, os.path.join(path, "../"))
 
 import pytest
+import requests
 from weather import factory
-from weather.provider import WeatherProvider
+from weather.breaker import BreakerState, CircuitBreaker
+from weather.provider import NotFoundError, TooManyRequestsError, WeatherProvider
+from weather.utils import TemperatureUnit
+from weather.weathersource import OpenWeatherMapSource, WeatherGovSource
 
 
 def test_cant_have_duplicate():
@@ -26,3 +30,186 @@ def test_replace_default_no_exception():
         factory.register_provider("default", WeatherProvider())
     except Exception as e:
         pytest.fail(f"DID RAISE {e}")
+
+
+def test_session_shared_per_host():
+    provider = WeatherProvider()
+
+    first = provider.session("https://api.weather.gov/gridpoints/LMK/50,78/forecast")
+    second = provider.session("https://api.weather.gov/gridpoints/LMK/51,78/forecast")
+    other = provider.session("https://api.weatherbit.io/v2.0/current?city_id=1")
+
+    assert first is second
+    assert first is not other
+
+    provider.close()
+
+
+def test_invalid_pool_size():
+    with pytest.raises(ValueError):
+        WeatherProvider(pool_size=0)
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200, history=()):
+        self.payload = payload
+        self.status_code = status_code
+        self.history = list(history)
+
+    def json(self):
+        return self.payload
+
+
+def test_batch_lookup_chunks_requests(monkeypatch):
+    provider = WeatherProvider()
+    source = OpenWeatherMapSource("abc", max_batch_size=2)
+    urls = []
+
+    def fake_get(source, url, headers=None, stream=False):
+        urls.append(url)
+        ids = url.split("id=")[1].split("&")[0].split(",")
+        return FakeResponse({"list": [{"id": int(i), "main": {"temp": 300.123}} for i in ids]})
+
+    monkeypatch.setattr(provider, "_get", fake_get)
+
+    temperatures = provider.temperatures(source, ["1", "2", "3", "2"])
+
+    assert len(urls) == 2
+    assert set(temperatures) == {"1", "2", "3"}
+    assert temperatures["3"].unit == TemperatureUnit.KELVIN and temperatures["3"].value == 300.12
+
+
+def test_batch_lookup_falls_back_per_location(monkeypatch):
+    provider = WeatherProvider()
+    source = WeatherGovSource("abc")
+    urls = []
+
+    def fake_get(source, url, headers=None, stream=False):
+        urls.append(url)
+        period = {"temperature": 70, "temperatureUnit": "F"}
+        return FakeResponse({"properties": {"periods": [period]}})
+
+    monkeypatch.setattr(provider, "_get", fake_get)
+
+    temperatures = provider.temperatures(source, ["LMK/1,1", "LMK/2,2"])
+
+    assert len(urls) == 2
+    assert temperatures["LMK/2,2"].value == 70
+
+
+def test_open_circuit_skips_requests(monkeypatch):
+    source = WeatherGovSource("abc")
+    provider = WeatherProvider(circuit_breakers={source.name: CircuitBreaker(failure_threshold=2)})
+    calls = []
+
+    def failing_request(url, headers=None, stream=False):
+        calls.append(url)
+        raise ProcessLookupError("upstream down")
+
+    monkeypatch.setattr(provider, "_request", failing_request)
+
+    for _ in range(5):
+        with pytest.raises(ProcessLookupError):
+            provider.temperature(source, "LMK/1,1")
+
+    assert len(calls) == 2
+
+
+def test_refused_requests_leave_the_circuit_alone(monkeypatch):
+    source = WeatherGovSource("abc")
+    breaker = CircuitBreaker(failure_threshold=2)
+    provider = WeatherProvider(circuit_breakers={source.name: breaker})
+    errors = [
+        ProcessLookupError("upstream down"),
+        ConnectionRefusedError("401 bad key"),
+        TooManyRequestsError("429 slow down"),
+    ]
+
+    def refusing_request(url, headers=None, stream=False):
+        raise errors.pop(0)
+
+    monkeypatch.setattr(provider, "_request", refusing_request)
+
+    with pytest.raises(ProcessLookupError):
+        provider.temperature(source, "LMK/1,1")
+    # a refused request neither resets the failures nor adds to them
+    with pytest.raises(ConnectionRefusedError):
+        provider.temperature(source, "LMK/1,1")
+    assert breaker.state == BreakerState.CLOSED
+
+    # being throttled does
+    with pytest.raises(TooManyRequestsError):
+        provider.temperature(source, "LMK/1,1")
+    assert breaker.state == BreakerState.OPEN
+
+
+def test_coordinates_resolve_once_to_the_hourly_forecast(monkeypatch):
+    provider = WeatherProvider()
+    source = WeatherGovSource("abc", base_url="https://wx")
+    urls = []
+
+    def fake_request(url, headers=None, stream=False):
+        urls.append(url)
+        if "/points/" in url:
+            hourly = "https://wx/gridpoints/LMK/50,78/forecast/hourly"
+            return FakeResponse({"properties": {"forecastHourly": hourly}})
+
+        period = {"temperature": 70, "temperatureUnit": "F"}
+        return FakeResponse({"properties": {"periods": [period]}})
+
+    monkeypatch.setattr(provider, "_request", fake_request)
+
+    provider.temperature(source, "38.25271,-85.75849")
+    provider.temperature(source, "38.25271,-85.75849")
+
+    assert urls == [
+        "https://wx/points/38.2527,-85.7585",
+        "https://wx/gridpoints/LMK/50,78/forecast/hourly",
+        "https://wx/gridpoints/LMK/50,78/forecast/hourly",
+    ]
+
+
+@pytest.mark.parametrize("moved", ["not_found", "redirected"])
+def test_moved_forecast_is_resolved_again(monkeypatch, moved):
+    provider = WeatherProvider()
+    source = WeatherGovSource("abc", base_url="https://wx")
+    source.gridpoints.put("38.2527,-85.7585", "https://wx/gridpoints/LMK/1,1/forecast/hourly")
+    period = {"temperature": 70, "temperatureUnit": "F"}
+
+    def fake_request(url, headers=None, stream=False):
+        if moved == "not_found":
+            raise NotFoundError(url)
+        return FakeResponse({"properties": {"periods": [period]}}, history=[FakeResponse({}, 301)])
+
+    monkeypatch.setattr(provider, "_request", fake_request)
+
+    try:
+        provider.temperature(source, "38.2527,-85.7585")
+    except ConnectionRefusedError:
+        assert moved == "not_found"
+
+    assert source.resolution_url("38.2527,-85.7585") == "https://wx/points/38.2527,-85.7585"
+
+
+def test_streamed_read_failure_counts_against_the_circuit(monkeypatch):
+    source = WeatherGovSource("abc", partial_parse=True)
+    provider = WeatherProvider(circuit_breakers={source.name: CircuitBreaker(failure_threshold=1)})
+
+    class BrokenStream(FakeResponse):
+        encoding = "utf-8"
+
+        def iter_content(self, chunk_size=1):
+            yield b'{"properties": {"periods": ['
+            raise requests.exceptions.ChunkedEncodingError("connection broken mid-body")
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(
+        provider, "_request", lambda url, headers=None, stream=False: BrokenStream(None)
+    )
+
+    with pytest.raises(ProcessLookupError, match="connection broken"):
+        provider.temperature(source, "LMK/1,1")
+
+    assert provider.circuit_breakers[source.name].state == BreakerState.OPEN
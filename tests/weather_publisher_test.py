@@ -0,0 +1,180 @@
+import time
+
+import pytest
+from weather import publisher
+from weather import metrics
+from weather.publisher import AsyncPublisher, BatchPushPublisher, ExporterPublisher
+from weather.readings import Reading
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+
+
+def test_batch_single_push_per_cycle(monkeypatch):
+    pushes = []
+    monkeypatch.setattr(
+        publisher,
+        "push_to_gateway",
+        lambda **kwargs: kwargs["job"] == "weather" and pushes.append(kwargs["grouping_key"]),
+    )
+
+    batch = BatchPushPublisher("localhost:9091")
+    for i in range(50):
+        batch.record(TemperatureMeasurement(20, TemperatureUnit.CELSIUS), f"loc {i}", "weatherbit")
+    batch.publish()
+
+    assert pushes == [{"batch": "0"}]
+
+
+def test_batch_chunks_bounded(monkeypatch):
+    pushes = []
+    monkeypatch.setattr(
+        publisher,
+        "push_to_gateway",
+        lambda **kwargs: kwargs["job"] == "weather" and pushes.append(kwargs["grouping_key"]),
+    )
+
+    batch = BatchPushPublisher("localhost:9091", chunks=4)
+    for i in range(50):
+        batch.record(TemperatureMeasurement(20, TemperatureUnit.CELSIUS), f"loc {i}", "weatherbit")
+    batch.publish()
+
+    assert 0 < len(pushes) <= 4
+
+    # nothing recorded since the last publish, nothing to push
+    pushes.clear()
+    batch.publish()
+    assert pushes == []
+
+
+def test_batch_requires_url():
+    with pytest.raises(ValueError):
+        BatchPushPublisher("")
+
+
+def test_exporter_serves_latest_reading():
+    exporter = ExporterPublisher(port=0)
+
+    exporter.record(
+        TemperatureMeasurement(100, TemperatureUnit.CELSIUS), "Louisville", "weatherbit"
+    )
+    exporter.record(TemperatureMeasurement(0, TemperatureUnit.CELSIUS), "Louisville", "weatherbit")
+
+    labels = {"source": "weatherbit", "location": "Louisville"}
+    registry = exporter.registry
+    assert registry.get_sample_value("weather_temperature_celsius", labels) == 0
+    assert registry.get_sample_value("weather_temperature_fahrenheit", labels) == 32
+
+    exporter.remove("Louisville", "weatherbit")
+    assert registry.get_sample_value("weather_temperature_celsius", labels) is None
+
+
+def test_exporter_records_readings_together():
+    exporter = ExporterPublisher(port=0)
+
+    exporter.record_readings(
+        [
+            Reading(212, TemperatureUnit.FAHRENHEIT, "weather.gov", "Louisville", 100.0),
+            Reading(273.15, TemperatureUnit.KELVIN, "weatherbit", "Louisville", 100.0),
+        ]
+    )
+
+    def sample(name, source):
+        return exporter.registry.get_sample_value(
+            name, {"source": source, "location": "Louisville"}
+        )
+
+    assert sample("weather_temperature_celsius", "weather.gov") == 100
+    assert sample("weather_temperature_celsius", "weatherbit") == 0
+    assert sample("weather_temperature_fahrenheit", "weatherbit") == 32
+
+
+class RecordingPublisher:
+    def __init__(self, failures=0):
+        self.records = []
+        self.publishes = 0
+        self.failures = failures
+
+    def record(self, temperature, location_name=None, weather_service=None):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("Pushgateway unreachable")
+        self.records.append((weather_service, location_name, temperature.value))
+
+    def publish(self):
+        self.publishes += 1
+
+
+def test_async_publisher_coalesces_per_location():
+    inner = RecordingPublisher()
+    queued = AsyncPublisher(inner, flush_interval=60, flush_size=100)
+
+    for value in (1, 2, 3):
+        queued.record(TemperatureMeasurement(value, TemperatureUnit.CELSIUS), "Home", "weatherbit")
+    queued.record(TemperatureMeasurement(9, TemperatureUnit.CELSIUS), "Office", "weatherbit")
+    queued.close()
+
+    assert inner.records == [("weatherbit", "Home", 3), ("weatherbit", "Office", 9)]
+    assert inner.publishes == 1
+
+
+def test_async_publisher_drops_over_capacity():
+    inner = RecordingPublisher()
+    queued = AsyncPublisher(inner, max_pending=2, flush_interval=60, flush_size=100)
+    before = metrics.REGISTRY.get_sample_value(
+        "weathermonitor_publish_drops_total", {"reason": "overflow"}
+    )
+
+    for i in range(3):
+        queued.record(TemperatureMeasurement(i, TemperatureUnit.CELSIUS), f"loc {i}", "weatherbit")
+    queued.close()
+
+    assert [location for _, location, _ in inner.records] == ["loc 0", "loc 1"]
+    after = metrics.REGISTRY.get_sample_value(
+        "weathermonitor_publish_drops_total", {"reason": "overflow"}
+    )
+    assert after == (before or 0) + 1
+
+
+def test_async_publisher_retries_failed_flush():
+    inner = RecordingPublisher(failures=1)
+    queued = AsyncPublisher(inner, flush_interval=60, max_retry_delay=0.01)
+
+    queued.record(TemperatureMeasurement(1, TemperatureUnit.CELSIUS), "Home", "weatherbit")
+    queued.publish()
+
+    for _ in range(100):
+        if inner.records:
+            break
+        time.sleep(0.01)
+    queued.close()
+
+    assert inner.records == [("weatherbit", "Home", 1)]
+
+
+class BulkPublisher(RecordingPublisher):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def record_readings(self, readings):
+        self.batches.append(list(readings))
+
+
+def test_async_publisher_hands_over_readings_together():
+    inner = BulkPublisher()
+    queued = AsyncPublisher(inner, flush_interval=60, flush_size=100)
+
+    queued.record_readings(
+        [
+            Reading(1, TemperatureUnit.CELSIUS, "weatherbit", "Home", 100.0),
+            Reading(2, TemperatureUnit.CELSIUS, "weatherbit", "Office", 101.0),
+        ]
+    )
+    queued.close()
+
+    assert inner.records == []
+    assert inner.batches == [
+        [
+            Reading(1, TemperatureUnit.CELSIUS, "weatherbit", "Home", 100.0),
+            Reading(2, TemperatureUnit.CELSIUS, "weatherbit", "Office", 101.0),
+        ]
+    ]
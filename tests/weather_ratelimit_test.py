@@ -0,0 +1,46 @@
+import pytest
+from weather.ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_requests_are_spaced_evenly():
+    clock = FakeClock()
+    limiter = RateLimiter(rate_per_minute=60, clock=clock, sleep=clock.sleep)
+
+    times = []
+    for _ in range(5):
+        limiter.acquire()
+        times.append(clock.now)
+
+    assert times == [0, 1, 2, 3, 4]
+
+
+def test_burst_allows_initial_requests():
+    clock = FakeClock()
+    limiter = RateLimiter(rate_per_minute=60, burst=3, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        limiter.acquire()
+
+    assert clock.now == 0
+
+
+def test_daily_budget_refuses_when_spent():
+    limiter = RateLimiter(daily_budget=2)
+
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter.remaining_budget == 0
+
+    with pytest.raises(ConnectionRefusedError):
+        limiter.acquire()
@@ -0,0 +1,37 @@
+import copy
+import pickle
+
+import pytest
+from weather.readings import Reading, ReadingColumns
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+
+
+def test_measurement_is_immutable():
+    temperature = TemperatureMeasurement(20, TemperatureUnit.CELSIUS)
+
+    with pytest.raises(AttributeError):
+        temperature.value = 21
+    assert not hasattr(temperature, "__dict__")
+    assert pickle.loads(pickle.dumps(temperature)) == temperature
+    assert copy.copy(temperature) == temperature
+
+
+def test_columns_round_trip_readings():
+    readings = [
+        Reading(20.5, TemperatureUnit.CELSIUS, "weatherbit", "Home", 100.0),
+        Reading(70, TemperatureUnit.FAHRENHEIT, "weather.gov", "Office", 101.0),
+        Reading(21.5, TemperatureUnit.CELSIUS, "weatherbit", "Home", 102.0),
+    ]
+    columns = ReadingColumns(readings)
+
+    assert len(columns) == 3
+    assert list(columns) == readings
+    assert columns.labels()[2] == ("weatherbit", "Home")
+    assert columns.values(TemperatureUnit.CELSIUS) == [20.5, 21.11, 21.5]
+
+
+def test_reading_of_measurement():
+    reading = Reading.of(TemperatureMeasurement(300, TemperatureUnit.KELVIN), "src", "loc", 5.0)
+
+    assert reading.temperature == TemperatureMeasurement(300, TemperatureUnit.KELVIN)
+    assert reading.fetched_at == 5.0
@@ -0,0 +1,80 @@
+from weather.plan import Lookup
+from weather.scheduler import PollScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def lookup(service, code, interval=None):
+    return Lookup(service, None, (code,), (), False, interval)
+
+
+def test_intervals_per_lookup_and_service():
+    clock = FakeClock()
+    scheduler = PollScheduler(default_interval=900, service_intervals={"slow": 3600}, clock=clock)
+    fast = lookup("default", "a")
+    slow = lookup("slow", "b")
+    custom = lookup("slow", "c", interval=60)
+
+    scheduler.replace([fast, slow, custom])
+    due = scheduler.due()
+    assert len(due) == 3
+
+    scheduler.complete((entry, False) for entry in due)
+
+    clock.now += 60
+    assert scheduler.due() == [custom]
+
+    clock.now += 840
+    assert scheduler.due() == [fast]
+
+
+def test_backoff_grows_and_is_capped():
+    clock = FakeClock()
+    scheduler = PollScheduler(default_interval=900, max_backoff=1800, clock=clock)
+    failing = lookup("failing", "b")
+
+    scheduler.replace([failing])
+
+    retry_delays = []
+    for _ in range(4):
+        scheduler.complete((entry, True) for entry in scheduler.due())
+        retry_delays.append(scheduler.next_due() - clock.now)
+        clock.now = scheduler.next_due()
+
+    assert retry_delays == [450, 900, 1800, 1800]
+
+
+def test_backoff_only_for_failing_service():
+    clock = FakeClock()
+    scheduler = PollScheduler(default_interval=900, clock=clock)
+    healthy = lookup("healthy", "a")
+    failing = lookup("failing", "b")
+
+    scheduler.replace([healthy, failing])
+    scheduler.complete((entry, entry is failing) for entry in scheduler.due())
+
+    clock.now += 450
+    assert scheduler.due() == [failing]
+
+    clock.now += 450
+    assert scheduler.due() == [healthy]
+
+
+def test_success_resets_backoff():
+    clock = FakeClock()
+    scheduler = PollScheduler(default_interval=900, clock=clock)
+    failing = lookup("failing", "b")
+
+    scheduler.replace([failing])
+    scheduler.complete([(failing, True)])
+    scheduler.complete([(failing, True)])
+    assert scheduler.backoff(failing) == 900
+
+    scheduler.complete([(failing, False)])
+    assert scheduler.backoff(failing) == 450
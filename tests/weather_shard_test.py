@@ -0,0 +1,250 @@
+import queue
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from weather import metrics, profiler, shard
+from weather.plan import build_poll_plan
+from weather.profiler import Profiler
+from weather.publisher import AsyncPublisher
+from weather.readings import Reading
+from weather.shard import HashRing, QueuePublisher, ShardMetrics, ShardSupervisor, report_started
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+
+
+class FakePublisher:
+    def __init__(self):
+        self.records = []
+        self.removed = []
+        self.publishes = 0
+
+    def record(self, temperature, location_name=None, weather_service=None):
+        self.records.append((weather_service, location_name, temperature))
+
+    def remove(self, location_name=None, weather_service=None):
+        self.removed.append((weather_service, location_name))
+
+    def publish(self):
+        self.publishes += 1
+
+
+class BulkPublisher(FakePublisher):
+    def __init__(self):
+        super().__init__()
+        self.readings = []
+
+    def record_readings(self, readings):
+        self.readings.extend(readings)
+
+
+def test_ring_spreads_and_moves_few_lookups():
+    codes = [str(i) for i in range(2000)]
+    four = HashRing(4)
+    five = HashRing(5)
+
+    owners = [four.shard("weatherbit", code) for code in codes]
+    assert all(owners.count(shard) > 300 for shard in range(4))
+
+    # growing the ring only moves lookups onto the new shard
+    moved = [
+        code for code in codes if four.shard("weatherbit", code) != five.shard("weatherbit", code)
+    ]
+    assert all(five.shard("weatherbit", code) == 4 for code in moved)
+    assert len(moved) < len(codes) / 3
+
+
+def test_shards_partition_the_plan(sources):
+    locations = [
+        (f"l{i}", str({"name": f"Loc {i}", "service": "weatherbit", "location_code": str(i)}))
+        for i in range(50)
+    ]
+
+    shards = [build_poll_plan(locations, shard_index=i, shard_count=3) for i in range(3)]
+    keys = sorted(location.key for plan in shards for location in plan.locations)
+
+    assert keys == sorted(key for key, _ in locations)
+
+
+def test_queue_publisher_feeds_supervisor():
+    messages = queue.Queue()
+    worker = QueuePublisher(messages, shard_index=1)
+    publisher = FakePublisher()
+    supervisor = ShardSupervisor(publisher, target=lambda worker, queue: None, workers=2)
+
+    worker.record(TemperatureMeasurement(20, TemperatureUnit.CELSIUS), "Home", "weatherbit")
+    worker.remove("Office", "weatherbit")
+    worker.publish()
+    while not messages.empty():
+        supervisor.dispatch(messages.get())
+
+    assert publisher.records == [
+        ("weatherbit", "Home", TemperatureMeasurement(20, TemperatureUnit.CELSIUS))
+    ]
+    assert publisher.removed == [("weatherbit", "Office")]
+    assert publisher.publishes == 1
+
+
+def test_exporter_serves_the_metrics_forwarded_by_workers():
+    messages = queue.Queue()
+    shard_metrics = ShardMetrics()
+    supervisor = ShardSupervisor(
+        FakePublisher(), target=lambda worker, queue: None, workers=2, shard_metrics=shard_metrics
+    )
+    registry = CollectorRegistry()
+    registry.register(shard_metrics)
+
+    metrics.HEDGE_WINS.labels("weatherbit", "hedge").inc()
+    for shard_index in (3, 4):
+        QueuePublisher(messages, shard_index, forward_metrics=True).publish()
+    while not messages.empty():
+        supervisor.dispatch(messages.get())
+
+    # the supervisor's own series and the workers' are served as one family
+    exposition = generate_latest(registry).decode()
+    assert exposition.count("# TYPE weathermonitor_hedge_wins_total counter") == 1
+
+    own = {"source": "weatherbit", "rank": "hedge"}
+    wins = registry.get_sample_value("weathermonitor_hedge_wins_total", own)
+    for shard_index in (3, 4):
+        labels = {**own, "shard": str(shard_index)}
+        assert registry.get_sample_value("weathermonitor_hedge_wins_total", labels) == wins
+
+
+def test_worker_pushes_its_metrics_to_its_own_group(monkeypatch):
+    pushes = []
+    monkeypatch.setattr(shard, "push_to_gateway", lambda **kwargs: pushes.append(kwargs))
+
+    # worker 1 of the host owning shard 0, which pushes the group {"shard": "0"} itself
+    publisher = QueuePublisher(
+        queue.Queue(), 1, "pushgateway:9091", grouping_key={"shard": "0", "worker": "1"}
+    )
+    publisher.publish()
+
+    assert [(push["job"], push["grouping_key"]) for push in pushes] == [
+        ("weathermonitor", {"shard": "0", "worker": "1"})
+    ]
+
+
+def test_worker_readings_keep_their_fetch_time():
+    messages = queue.Queue()
+    publisher = BulkPublisher()
+    supervisor = ShardSupervisor(publisher, target=lambda worker, queue: None, workers=2)
+    readings = [
+        Reading(20, TemperatureUnit.CELSIUS, "weatherbit", "Home", 100.0),
+        Reading(21, TemperatureUnit.CELSIUS, "weatherbit", "Office", 101.0),
+    ]
+
+    QueuePublisher(messages, shard_index=0).record_readings(readings)
+    assert messages.qsize() == 1
+    supervisor.dispatch(messages.get())
+
+    assert publisher.readings == readings
+
+
+class FakeProcess:
+    pids = iter(range(1000, 2000))
+
+    def __init__(self, target=None, args=(), name=None):
+        self.pid = next(self.pids)
+        self.daemon = False
+        self.alive = True
+        self.exitcode = None
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return self.alive
+
+    def exit(self, exitcode):
+        self.alive = False
+        self.exitcode = exitcode
+
+
+class FakeContext:
+    Queue = queue.Queue
+    Process = FakeProcess
+
+
+def test_signals_only_reach_started_workers(monkeypatch):
+    kills = []
+    monkeypatch.setattr(shard.os, "kill", lambda pid, signum: kills.append(pid))
+    supervisor = ShardSupervisor(
+        FakePublisher(), target=lambda worker, queue: None, workers=2, context=FakeContext()
+    )
+    for worker in range(2):
+        supervisor._start(worker)
+    first, second = [process.pid for process in supervisor._processes]
+
+    messages = queue.Queue()
+    monkeypatch.setattr(shard.os, "getpid", lambda: first)
+    report_started(messages, 0)
+    # reported by a worker 1 process that exited since
+    messages.put(("started", 1, second - 1000))
+    while not messages.empty():
+        supervisor.dispatch(messages.get())
+
+    supervisor.signal_workers(10)
+
+    assert kills == [first]
+
+
+def test_workers_failing_to_start_are_restarted_less_and_less_often():
+    now = [0.0]
+    supervisor = ShardSupervisor(
+        FakePublisher(),
+        target=lambda worker, queue: None,
+        workers=1,
+        context=FakeContext(),
+        max_restart_delay=4.0,
+        clock=lambda: now[0],
+    )
+    supervisor._start(0)
+
+    restarts = []
+    for second in range(1, 20):
+        now[0] = second
+        process = supervisor._processes[0]
+        if process.alive:
+            process.exit(1)
+        supervisor._check_workers()
+        if supervisor._processes[0] is not process:
+            restarts.append(second)
+
+    # exits seen at 1, 3, 6 and 11 seconds, restarted 1, 2 and then 4 seconds later
+    assert restarts == [2, 5, 10, 15]
+
+    # a worker that had started is restarted right away, and backs off from 1 second again
+    supervisor._started[0] = True
+    supervisor._processes[0].exit(1)
+    supervisor._check_workers()
+    supervisor._processes[0].exit(1)
+    supervisor._check_workers()
+    now[0] += 1
+    supervisor._check_workers()
+
+    assert supervisor._processes[0].alive
+
+
+def test_supervisor_profiles_the_publishing_of_worker_cycles(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        profiler, "PROFILER", Profiler(output_dir=str(tmp_path), sample_interval=None)
+    )
+    profiler.PROFILER.request(cycles=2)
+    inner = BulkPublisher()
+    queued = AsyncPublisher(inner, flush_interval=60)
+    supervisor = ShardSupervisor(queued, target=lambda worker, queue: None, workers=2)
+    reading = Reading(20.0, TemperatureUnit.CELSIUS, "weatherbit", "Home", 100.0)
+
+    supervisor.dispatch(("readings", [reading]))
+    supervisor.dispatch(("publish", 0))
+
+    # flushed within the first profiled cycle, the second is still to come
+    assert inner.readings == [reading] and inner.publishes == 1
+    assert profiler.PROFILER.active
+
+    supervisor.dispatch(("publish", 1))
+    profiler.PROFILER.wait()
+    queued.close()
+
+    assert not profiler.PROFILER.active
+    assert len(list(tmp_path.glob("*.trace.json"))) == 1
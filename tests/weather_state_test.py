@@ -0,0 +1,91 @@
+import time
+
+from weather.cache import ResponseCache
+from weather.state import StateRecord, StateStore
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+
+
+def test_cache_restores_from_state_file(tmp_path):
+    path = str(tmp_path / "weathermonitor.state")
+
+    cache = ResponseCache(default_ttl=3600, store=StateStore(path))
+    cache.put("src", "a", TemperatureMeasurement(1, TemperatureUnit.CELSIUS), etag='"v1"')
+    cache.put("src", "a", TemperatureMeasurement(2, TemperatureUnit.CELSIUS), etag='"v2"')
+    cache.put("src", "b", TemperatureMeasurement(3, TemperatureUnit.KELVIN))
+    cache.store.close()
+
+    restored = ResponseCache(default_ttl=3600, store=StateStore(path))
+    records = restored.restore()
+
+    assert [(r.location_code, r.etag) for r in records] == [("a", '"v2"'), ("b", None)]
+    entry = restored.get("src", "a")
+    assert entry.temperature == TemperatureMeasurement(2, TemperatureUnit.CELSIUS)
+    assert entry.fresh() and entry.validators() == {"If-None-Match": '"v2"'}
+
+    # the load compacted the log to one line per lookup
+    with open(path, encoding="utf-8") as state_file:
+        assert len(state_file.readlines()) == 2
+
+
+def test_restore_keeps_remaining_ttl_and_skips_bad_lines(tmp_path):
+    path = str(tmp_path / "weathermonitor.state")
+    store = StateStore(path)
+    temperature = TemperatureMeasurement(70, TemperatureUnit.FAHRENHEIT)
+    store.append(StateRecord("old", "a", temperature, None, None, time.time() - 7200))
+    store.append(StateRecord("new", "a", temperature, None, None, time.time()))
+    store.close()
+    with open(path, "a", encoding="utf-8") as state_file:
+        state_file.write('{"source": "cut sho')
+
+    cache = ResponseCache(default_ttl=3600, store=StateStore(path))
+
+    assert len(cache.restore()) == 2
+    assert not cache.get("old", "a").fresh()
+    assert cache.get("new", "a").fresh()
+
+
+def test_log_is_compacted_as_it_grows(tmp_path):
+    path = str(tmp_path / "weathermonitor.state")
+    store = StateStore(path, compact_ratio=2, min_compact=4)
+    temperature = TemperatureMeasurement(1, TemperatureUnit.CELSIUS)
+
+    for i in range(20):
+        store.append(StateRecord("src", str(i % 2), temperature, None, None, float(i)))
+    store.close()
+
+    with open(path, encoding="utf-8") as state_file:
+        assert len(state_file.readlines()) < 4
+
+
+def test_evicted_lookups_are_dropped_from_the_state_file(tmp_path):
+    path = str(tmp_path / "weathermonitor.state")
+    cache = ResponseCache(max_entries=2, default_ttl=3600, store=StateStore(path))
+
+    for code in ("a", "b", "c"):
+        cache.put("src", code, TemperatureMeasurement(1, TemperatureUnit.CELSIUS))
+    cache.store.close()
+
+    records = StateStore(path).load()
+
+    assert [record.location_code for record in records] == ["b", "c"]
+    with open(path, encoding="utf-8") as state_file:
+        assert len(state_file.readlines()) == 2
+
+
+def test_updates_are_written_together_off_the_caller_thread(tmp_path, monkeypatch):
+    path = str(tmp_path / "weathermonitor.state")
+    store = StateStore(path, flush_interval=60)
+    temperature = TemperatureMeasurement(1, TemperatureUnit.CELSIUS)
+    writes = []
+
+    for i in range(10):
+        store.append(StateRecord("src", str(i % 2), temperature, None, None, float(i)))
+    assert not (tmp_path / "weathermonitor.state").exists()
+
+    monkeypatch.setattr(store, "_write", lambda pending: writes.append(dict(pending)))
+    store.close()
+
+    # a single write, with the latest record of each lookup
+    assert [sorted(record.fetched_at for record in pending.values()) for pending in writes] == [
+        [8.0, 9.0]
+    ]
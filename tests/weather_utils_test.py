@@ -5,7 +5,17 @@
 # sys.path.insert(0, path)
 # sys.path.insert(0, os.path.join(path, "../"))
 
-from weather.utils import TemperatureMeasurement, TemperatureUnit, convert_temperature
+import json
+
+import pytest
+from weather.utils import (
+    TemperatureMeasurement,
+    TemperatureUnit,
+    convert_temperature,
+    convert_temperatures,
+    decode_first_item,
+)
+from weather import utils
 
 
 def test_convert_C_to_F():
@@ -48,3 +58,64 @@ def test_convert_K_to_K():
     orig_temp = TemperatureMeasurement(100, TemperatureUnit.KELVIN)
     new_temp = convert_temperature(orig_temp, TemperatureUnit.KELVIN)
     assert new_temp.unit == TemperatureUnit.KELVIN and new_temp.value == 100
+
+
+def test_decode_first_item_split_chunks():
+    document = json.dumps(
+        {
+            "note": "periods",
+            "properties": {"periods": [{"temperature": 70, "temperatureUnit": "F"}, {"x": 1}]},
+        }
+    )
+
+    for size in (1, 5, len(document)):
+        chunks = [document[i : i + size] for i in range(0, len(document), size)]
+        assert decode_first_item(chunks, "periods") == {"temperature": 70, "temperatureUnit": "F"}
+
+
+def test_decode_first_item_stops_reading():
+    chunks = iter(['{"data": [{"temp": 21.5}, ', "this part is never read"])
+
+    assert decode_first_item(chunks, "data") == {"temp": 21.5}
+    assert next(chunks) == "this part is never read"
+
+
+def test_decode_first_item_missing():
+    with pytest.raises(ValueError):
+        decode_first_item(['{"data": []}'], "periods")
+
+
+@pytest.fixture(params=["numpy", "python"])
+def bulk_backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(utils, "np", None)
+    return request.param
+
+
+def test_convert_temperatures_matches_convert_temperature(bulk_backend):
+    values = [-40, 0, 37.5, 100, 273.15, 310.93]
+    for from_unit in TemperatureUnit:
+        for to_unit in TemperatureUnit:
+            expected = [
+                convert_temperature(TemperatureMeasurement(v, from_unit), to_unit).value
+                for v in values
+            ]
+            assert convert_temperatures(values, from_unit, to_unit) == pytest.approx(expected)
+
+
+def test_convert_temperatures_mixed_units(bulk_backend):
+    converted = convert_temperatures(
+        [100, 212, 373.15],
+        [TemperatureUnit.CELSIUS, TemperatureUnit.FAHRENHEIT, TemperatureUnit.KELVIN],
+        TemperatureUnit.CELSIUS,
+    )
+    assert converted == [100, 100, 100]
+
+
+def test_convert_temperatures_rejects_bad_input(bulk_backend):
+    with pytest.raises(ValueError):
+        convert_temperatures([1, 2], [TemperatureUnit.CELSIUS], TemperatureUnit.KELVIN)
+    with pytest.raises(ValueError):
+        convert_temperatures([1], ["C"], TemperatureUnit.KELVIN)
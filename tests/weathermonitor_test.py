@@ -0,0 +1,298 @@
+import configparser
+import json
+import time
+
+import pytest
+import weathermonitor
+from weather import factory
+from weather import metrics, profiler, publisher
+from weather.cache import ResponseCache
+from weather.fetcher import FetchEngine
+from weather.plan import build_poll_plan
+from weather.profiler import Profiler
+from weather.provider import WeatherProvider
+from weather.publisher import AsyncPublisher, BatchPushPublisher
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+
+
+class FakeProvider:
+    def __init__(self):
+        self.calls = []
+
+    def temperature(self, source, location_code):
+        self.calls.append(location_code)
+        return TemperatureMeasurement(20, TemperatureUnit.CELSIUS)
+
+    def temperatures(self, source, location_codes):
+        return {code: self.temperature(source, code) for code in location_codes}
+
+
+class FakePublisher:
+    def __init__(self):
+        self.records = []
+
+    def record(self, temperature, location_name=None, weather_service=None):
+        self.records.append((weather_service, location_name))
+
+    def publish(self):
+        pass
+
+
+def test_lookup_fans_out_to_every_location(sources):
+    plan = build_poll_plan(
+        [
+            ("l1", "{'name': 'Home', 'service': 'weather.gov', 'location_code': 'LMK/50,78'}"),
+            ("l2", "{'name': 'Office', 'service': 'weather.gov', 'location_code': 'LMK/50,78'}"),
+        ]
+    )
+    provider = FakeProvider()
+    publisher = FakePublisher()
+
+    retries = [task() for _, task in weathermonitor.poll_tasks(provider, plan.lookups, publisher)]
+
+    assert retries == [False]
+    assert provider.calls == ["LMK/50,78"]
+    assert publisher.records == [("weather.gov", "Home"), ("weather.gov", "Office")]
+
+
+def test_lookup_errors_are_counted(sources):
+    class FailingProvider(FakeProvider):
+        def temperature(self, source, location_code):
+            raise ProcessLookupError("upstream down")
+
+    plan = build_poll_plan(
+        [("l1", "{'name': 'Home', 'service': 'weatherbit', 'location_code': '1'}")]
+    )
+    labels = {"source": "weatherbit", "error": "ProcessLookupError"}
+    before = metrics.REGISTRY.get_sample_value("weathermonitor_poll_errors_total", labels) or 0
+
+    retry = weathermonitor.poll_lookup(FailingProvider(), plan.lookups[0], FakePublisher())
+
+    assert retry
+    assert (
+        metrics.REGISTRY.get_sample_value("weathermonitor_poll_errors_total", labels) == before + 1
+    )
+
+
+def test_malformed_answer_only_fails_its_lookup(sources):
+    class MalformedProvider(FakeProvider):
+        def temperature(self, source, location_code):
+            if location_code == "1":
+                raise KeyError("periods")
+            return super().temperature(source, location_code)
+
+    plan = build_poll_plan(
+        [
+            ("l1", "{'name': 'Home', 'service': 'weatherbit', 'location_code': '1'}"),
+            ("l2", "{'name': 'Office', 'service': 'weatherbit', 'location_code': '2'}"),
+        ]
+    )
+    labels = {"source": "weatherbit", "error": "KeyError"}
+    before = metrics.REGISTRY.get_sample_value("weathermonitor_poll_errors_total", labels) or 0
+    publisher = FakePublisher()
+
+    engine = FetchEngine(max_workers=2)
+    try:
+        retries = engine.run(
+            weathermonitor.poll_tasks(MalformedProvider(), plan.lookups, publisher)
+        )
+    finally:
+        engine.shutdown()
+
+    assert retries == [False, False]
+    assert publisher.records == [("weatherbit", "Office")]
+    assert (
+        metrics.REGISTRY.get_sample_value("weathermonitor_poll_errors_total", labels) == before + 1
+    )
+
+
+def test_poll_loop_stops_after_max_cycles(sources):
+    provider = FakeProvider()
+    publisher = FakePublisher()
+    factory.register_provider("default", provider)
+
+    try:
+        weathermonitor.poll_weather_services(
+            [("l1", "{'name': 'Home', 'service': 'weatherbit', 'location_code': '1'}")],
+            api_keys={},
+            pushgateway_url="localhost:9091",
+            publisher=publisher,
+            max_cycles=1,
+        )
+    finally:
+        factory.deregister_provider("default")
+        for name in ("weather.gov", "openweathermap", "weatherbit"):
+            factory.deregister_source(name)
+
+    assert provider.calls == ["1"]
+    assert publisher.records == [("weatherbit", "Home")]
+
+
+def test_warm_start_publishes_cached_readings(sources):
+    cache = ResponseCache(default_ttl=3600)
+    cache.put("Weatherbit", "1", TemperatureMeasurement(20, TemperatureUnit.CELSIUS))
+    provider = WeatherProvider(cache=cache)
+    plan = build_poll_plan(
+        [
+            ("l1", "{'name': 'Home', 'service': 'weatherbit', 'location_code': '1'}"),
+            ("l2", "{'name': 'Office', 'service': 'weatherbit', 'location_code': '2'}"),
+        ]
+    )
+    publisher = FakePublisher()
+
+    assert weathermonitor.publish_cached(provider, plan, publisher) == 1
+    assert publisher.records == [("weatherbit", "Home")]
+
+
+def test_reading_age_is_exported(sources):
+    class AgedProvider(FakeProvider):
+        def fetched_at(self, source, location_code):
+            return time.time() - 300
+
+    plan = build_poll_plan(
+        [("l1", "{'name': 'Aged', 'service': 'weatherbit', 'location_code': '1'}")]
+    )
+
+    weathermonitor.poll_lookup(AgedProvider(), plan.lookups[0], FakePublisher())
+
+    age = metrics.REGISTRY.get_sample_value(
+        "weather_reading_age_seconds", {"source": "weatherbit", "location": "Aged"}
+    )
+    assert 300 <= age < 360
+
+
+HEDGED_LOCATION = (
+    "l1",
+    "{'name': 'Home', 'service': 'weatherbit', 'location_code': '1',"
+    " 'fallbacks': [{'service': 'openweathermap', 'location_code': '2'}]}",
+)
+
+
+def test_hedged_lookup_replaces_the_series_of_the_losing_source(sources, monkeypatch):
+    monkeypatch.setattr(weathermonitor, "_hedge_winners", {})
+    winners = [1, 1, 0]
+
+    class HedgingProvider(FakeProvider):
+        def temperature_hedged(self, candidates, on_error=None):
+            return winners.pop(0), TemperatureMeasurement(21, TemperatureUnit.CELSIUS)
+
+    class RemovingPublisher(FakePublisher):
+        removed = []
+
+        def remove(self, location_name=None, weather_service=None):
+            self.removed.append((weather_service, location_name))
+
+    lookup = build_poll_plan([HEDGED_LOCATION]).lookups[0]
+    publisher = RemovingPublisher()
+    provider = HedgingProvider()
+
+    weathermonitor.poll_lookup(provider, lookup, publisher)
+    assert publisher.records == [("openweathermap", "Home")]
+    assert publisher.removed == [("weatherbit", "Home")]
+
+    weathermonitor.poll_lookup(provider, lookup, publisher)
+    assert publisher.removed == [("weatherbit", "Home")]
+
+    weathermonitor.poll_lookup(provider, lookup, publisher)
+    assert publisher.records[-1] == ("weatherbit", "Home")
+    assert publisher.removed == [("weatherbit", "Home"), ("openweathermap", "Home")]
+
+
+def test_hedged_lookup_errors_are_counted_per_source(sources):
+    class FailingProvider(FakeProvider):
+        def temperature_hedged(self, candidates, on_error=None):
+            on_error(1, ConnectionRefusedError("budget spent"))
+            error = ProcessLookupError("upstream down")
+            on_error(0, error)
+            raise error
+
+    def errors(source, error):
+        labels = {"source": source, "error": error}
+        return metrics.REGISTRY.get_sample_value("weathermonitor_poll_errors_total", labels) or 0
+
+    before = errors("weatherbit", "ProcessLookupError"), errors(
+        "openweathermap", "ConnectionRefusedError"
+    )
+    lookup = build_poll_plan([HEDGED_LOCATION]).lookups[0]
+
+    assert weathermonitor.poll_lookup(FailingProvider(), lookup, FakePublisher())
+    assert errors("weatherbit", "ProcessLookupError") == before[0] + 1
+    assert errors("openweathermap", "ConnectionRefusedError") == before[1] + 1
+
+
+def test_budgets_are_shared_out_between_hosts_and_workers():
+    config = configparser.ConfigParser()
+    config.read_dict(
+        {
+            "SETTINGS": {"shard_count": "2", "shard_workers": "3"},
+            "API_KEYS": {},
+            "RATE_LIMITS": {"weatherbit": "60"},
+            "DAILY_BUDGETS": {"weatherbit": "600"},
+        }
+    )
+
+    weathermonitor.configure_provider(config, worker=1, workers=3)
+    try:
+        (rate_limiter,) = factory.provider().rate_limiters.values()
+        assert rate_limiter.rate == 60 / 6 / 60
+        assert rate_limiter.daily_budget == 100
+    finally:
+        factory.deregister_provider("default")
+        for name in ("weather.gov", "openweathermap", "weatherbit"):
+            factory.deregister_source(name)
+
+
+def test_profiled_cycle_waits_for_the_background_publisher(sources, tmp_path, monkeypatch):
+    monkeypatch.setattr(publisher, "push_to_gateway", lambda **kwargs: time.sleep(0.05))
+    monkeypatch.setattr(
+        profiler, "PROFILER", Profiler(output_dir=str(tmp_path), sample_interval=None)
+    )
+    profiler.PROFILER.request(cycles=1)
+    queued = AsyncPublisher(BatchPushPublisher("localhost:9091"), flush_interval=60)
+    factory.register_provider("default", FakeProvider())
+
+    try:
+        weathermonitor.poll_weather_services(
+            [("l1", "{'name': 'Home', 'service': 'weatherbit', 'location_code': '1'}")],
+            api_keys={},
+            pushgateway_url="localhost:9091",
+            publisher=queued,
+            max_cycles=1,
+        )
+    finally:
+        factory.deregister_provider("default")
+    profiler.PROFILER.wait()
+
+    (trace,) = tmp_path.glob("*.trace.json")
+    events = [event for event in json.loads(trace.read_text())["traceEvents"] if event["ph"] == "X"]
+    names = [event["name"] for event in events]
+    assert "convert_temperatures" in names and "push_to_gateway" in names
+    # converted and pushed by the publisher thread, within the cycle
+    assert names[-1] == "cycle"
+
+
+@pytest.mark.parametrize(
+    "settings, locations",
+    [
+        ({"state_file": "state.jsonl"}, {"l1": "{'name': 'Home', 'service': 'weatherbit'}"}),
+        ({}, {"l1": "{'name': 'Home', 'service': 'weatherbit'}"}),
+        ({}, {"l1": "{'name': 'Home', 'service': 'nowhere', 'location_code': '1'}"}),
+    ],
+)
+def test_config_is_checked_before_shard_workers_start(sources, settings, locations):
+    config = configparser.ConfigParser()
+    config.read_dict({"SETTINGS": settings, "API_KEYS": {}, "LOCATIONS": locations})
+
+    with pytest.raises(ValueError):
+        weathermonitor.check_config(config)
+
+
+def test_sources_are_registered_once(sources):
+    registered = factory.source("weatherbit")
+
+    with pytest.raises(ValueError):
+        weathermonitor.register_sources({})
+
+    # the poll loop keeps the sources configure_provider registered
+    weathermonitor.register_sources({"weatherbit": "abc"}, skip_registered=True)
+    assert factory.source("weatherbit") is registered
@@ -0,0 +1,102 @@
+"""
+Circuit breaker guarding the requests sent to a Weather Source
+
+"""
+import threading
+import time
+from enum import Enum
+from typing import Callable
+
+
+class BreakerState(Enum):
+    """States of a CircuitBreaker, the values are exported as the breaker state metric"""
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+class CircuitBreaker:
+    """Circuit breaker for a single Weather Source
+
+    After failure_threshold consecutive failures the circuit opens and calls are refused without
+    reaching the source. Once the cooldown has passed, up to half_open_probes calls are let
+    through: a success closes the circuit again, a failure re-opens it for another cooldown.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        cooldown: float = 60.0,
+        half_open_probes: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if failure_threshold < 1:
+            raise ValueError(f"failure_threshold must be at least 1, got {failure_threshold}")
+        if half_open_probes < 1:
+            raise ValueError(f"half_open_probes must be at least 1, got {half_open_probes}")
+
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._state = BreakerState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self) -> BreakerState:
+        with self._lock:
+            self._cooled_down()
+            return self._state
+
+    def _cooled_down(self) -> None:
+        if self._state == BreakerState.OPEN and self._clock() - self._opened_at >= self.cooldown:
+            self._state = BreakerState.HALF_OPEN
+            self._probes = 0
+
+    def allow(self) -> bool:
+        """True when a call may go through to the source, every allowed call has to be followed
+        by record_success, record_failure or release"""
+        with self._lock:
+            self._cooled_down()
+
+            if self._state == BreakerState.CLOSED:
+                return True
+
+            if self._state == BreakerState.HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == BreakerState.OPEN:
+                # a late answer to a call made before the circuit opened
+                return
+
+            self._state = BreakerState.CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._state == BreakerState.OPEN:
+                return
+
+            self._failures += 1
+            if self._state == BreakerState.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = BreakerState.OPEN
+                self._opened_at = self._clock()
+                self._probes = 0
+
+    def release(self) -> None:
+        """Give back an allowed call that never reached the source"""
+        with self._lock:
+            if self._state == BreakerState.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
@@ -0,0 +1,174 @@
+"""
+Response cache for Weather Source lookups
+
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+from weather.state import StateRecord, StateStore
+from weather.utils import TemperatureMeasurement
+
+
+class CacheEntry:
+    """Extracted temperature of a lookup plus the HTTP validators to revalidate it with"""
+
+    __slots__ = ("temperature", "etag", "last_modified", "expires_at", "fetched_at")
+
+    def __init__(
+        self,
+        temperature: TemperatureMeasurement,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        expires_at: float = 0.0,
+        fetched_at: Optional[float] = None,
+    ) -> None:
+        self.temperature = temperature
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        # wall clock time (time.time()) the reading was fetched or last confirmed unchanged
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    def fresh(self, now: Optional[float] = None) -> bool:
+        return (time.monotonic() if now is None else now) < self.expires_at
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Seconds since the reading was fetched"""
+        return max((time.time() if now is None else now) - self.fetched_at, 0.0)
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers for revalidating the entry"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        return headers
+
+
+class ResponseCache:
+    """Bounded LRU cache of lookups keyed by (source name, location code)
+
+    Entries stay fresh for the TTL of their source, after that they are only kept to send
+    conditional requests with. With a StateStore every update is also written to disk, and
+    restore() reloads the entries written by a previous run.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        default_ttl: float = 0.0,
+        ttls: Optional[Dict[str, float]] = None,
+        store: Optional[StateStore] = None,
+    ) -> None:
+        if max_entries < 1:
+            raise ValueError(f"max_entries must be at least 1, got {max_entries}")
+
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls: Dict[str, float] = dict(ttls or {})
+        self.store = store
+
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl(self, source_name: str) -> float:
+        return self.ttls.get(source_name, self.default_ttl)
+
+    def get(self, source_name: str, location_code: str) -> Optional[CacheEntry]:
+        key = (source_name, location_code)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        return entry
+
+    def put(
+        self,
+        source_name: str,
+        location_code: str,
+        temperature: TemperatureMeasurement,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> CacheEntry:
+        key = (source_name, location_code)
+        entry = CacheEntry(
+            temperature=temperature,
+            etag=etag,
+            last_modified=last_modified,
+            expires_at=time.monotonic() + self.ttl(source_name),
+        )
+
+        self._insert(key, entry)
+        self._persist(source_name, location_code, entry)
+
+        return entry
+
+    def _insert(self, key: Hashable, entry: CacheEntry) -> None:
+        evicted = []
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+
+        # an evicted lookup is dropped from the state file too, so it doesn't grow without bound
+        if self.store is not None:
+            for source_name, location_code in evicted:  # type: ignore
+                self.store.remove(source_name, location_code)
+
+    def _persist(self, source_name: str, location_code: str, entry: CacheEntry) -> None:
+        if self.store is not None:
+            self.store.append(
+                StateRecord(
+                    source=source_name,
+                    location_code=location_code,
+                    temperature=entry.temperature,
+                    etag=entry.etag,
+                    last_modified=entry.last_modified,
+                    fetched_at=entry.fetched_at,
+                )
+            )
+
+    def refresh(self, source_name: str, location_code: str) -> None:
+        """Restart the TTL of an entry, after the source confirmed it is unchanged"""
+        entry = self.get(source_name, location_code)
+        if entry is not None:
+            entry.expires_at = time.monotonic() + self.ttl(source_name)
+            entry.fetched_at = time.time()
+            self._persist(source_name, location_code, entry)
+
+    def restore(self) -> List[StateRecord]:
+        """Load the entries persisted by a previous run, each keeping what is left of its TTL
+
+        Returns:
+            List[StateRecord]: the restored records, oldest first
+        """
+        if self.store is None:
+            return []
+
+        records = self.store.load()
+        wall_now = time.time()
+        now = time.monotonic()
+
+        for record in records:
+            age = max(wall_now - record.fetched_at, 0.0)
+            entry = CacheEntry(
+                temperature=record.temperature,
+                etag=record.etag,
+                last_modified=record.last_modified,
+                expires_at=now + self.ttl(record.source) - age,
+                fetched_at=record.fetched_at,
+            )
+            self._insert((record.source, record.location_code), entry)
+
+        return records
@@ -0,0 +1,236 @@
+"""
+Concurrent fetch engine to run Weather Source lookups in parallel
+
+"""
+import collections
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Counter,
+    Deque,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from weather.ratelimit import RateLimiter
+
+T = TypeVar("T")
+
+
+class FetchEngine:
+    """Fetch Engine
+
+    Runs lookup tasks on a thread pool, capping how many tasks may be in flight against any
+    single Weather Source at once. Tasks over their source's cap wait in a queue of their source,
+    not in a pool thread, so a long run of one source never holds up the tasks of another.
+    Likewise the tasks of a source with a rate limiter (keyed by the tasks' source name) are only
+    submitted once their token is due, rather than waiting for it in a pool thread.
+    With a single worker the tasks run inline on the calling thread.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        max_per_source: int = 0,
+        rate_limiters: Optional[Dict[str, RateLimiter]] = None,
+    ) -> None:
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+        if max_per_source < 0:
+            raise ValueError(f"max_per_source can not be negative, got {max_per_source}")
+
+        self.max_workers = max_workers
+        self.max_per_source = max_per_source
+        self.rate_limiters: Dict[str, RateLimiter] = {
+            source_name: rate_limiter
+            for source_name, rate_limiter in (rate_limiters or {}).items()
+            if rate_limiter.rate is not None
+        }
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if max_workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="weather-fetch"
+            )
+
+    def run(self, tasks: Iterable[Tuple[str, Callable[[], T]]]) -> List[T]:
+        """Run a set of lookup tasks and wait for all of them to complete
+
+        Args:
+            tasks (Iterable[Tuple[str, Callable[[], T]]]): pairs of (source name, task) to execute
+
+        Returns:
+            List[T]: the task results, in the order the tasks were given
+        """
+        tasks = list(tasks)
+
+        if self._executor is None:
+            return [task() for _, task in tasks]
+
+        if self.max_per_source == 0 and not self.rate_limiters:
+            futures = [self._executor.submit(task) for _, task in tasks]
+            return [future.result() for future in futures]
+
+        return self._dispatch(self._executor, tasks)
+
+    def _dispatch(
+        self, executor: ThreadPoolExecutor, tasks: List[Tuple[str, Callable[[], T]]]
+    ) -> List[T]:
+        # indexes of the tasks of each source not submitted yet, in the given order
+        queued: Dict[str, Deque[int]] = {}
+        for index, (source_name, _) in enumerate(tasks):
+            queued.setdefault(source_name, collections.deque()).append(index)
+
+        futures: List[Optional[Future]] = [None] * len(tasks)
+        remaining = len(tasks)
+        finished = threading.Event()
+        lock = threading.Lock()
+        in_flight: Counter[str] = collections.Counter()
+        # rate limited sources with a reserved token not spent yet, one at a time per source
+        reserved: Set[str] = set()
+
+        def launch(source_name: str, index: int) -> Future:
+            # called with the lock held
+            in_flight[source_name] += 1
+            task = tasks[index][1]
+
+            rate_limiter = self.rate_limiters.get(source_name)
+            if rate_limiter is None:
+                future = executor.submit(task)
+            else:
+                future = executor.submit(
+                    rate_limiter.run_reserved, task, lambda: token_spent(source_name)
+                )
+            futures[index] = future
+
+            return future
+
+        def pump(source_name: str, limit: Optional[int] = None) -> List[Future]:
+            # called with the lock held: start the tasks of the source its cap and limiter allow
+            launched: List[Future] = []
+            pending = queued[source_name]
+            rate_limiter = self.rate_limiters.get(source_name)
+
+            while pending and source_name not in reserved:
+                if limit is not None and len(launched) >= limit:
+                    break
+                if self.max_per_source and in_flight[source_name] >= self.max_per_source:
+                    break
+
+                index = pending.popleft()
+                if rate_limiter is None:
+                    launched.append(launch(source_name, index))
+                    continue
+
+                # the next token of the source is only taken once this one is spent
+                reserved.add(source_name)
+                wait = rate_limiter.reserve()
+                if wait > 0:
+                    timer = threading.Timer(wait, token_due, (source_name, index))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    launched.append(launch(source_name, index))
+
+            return launched
+
+        def watch(source_name: str, launched: List[Future]) -> None:
+            # called without the lock, a finished future runs its callback right away
+            for future in launched:
+                future.add_done_callback(lambda _: completed(source_name))
+
+        def token_due(source_name: str, index: int) -> None:
+            with lock:
+                launched = [launch(source_name, index)]
+            watch(source_name, launched)
+
+        def token_spent(source_name: str) -> None:
+            with lock:
+                reserved.discard(source_name)
+                launched = pump(source_name)
+            watch(source_name, launched)
+
+        def completed(source_name: str) -> None:
+            nonlocal remaining
+            with lock:
+                remaining -= 1
+                if remaining == 0:
+                    finished.set()
+                in_flight[source_name] -= 1
+
+                # the finished task's slot of its source goes to the next task of the same source
+                launched = pump(source_name)
+            watch(source_name, launched)
+
+        # first come first served across the sources, as the tasks were given
+        started = []
+        with lock:
+            for index, (source_name, _) in enumerate(tasks):
+                if queued[source_name] and queued[source_name][0] == index:
+                    started.extend((source_name, future) for future in pump(source_name, 1))
+        for source_name, future in started:
+            watch(source_name, [future])
+
+        if tasks:
+            finished.wait()
+
+        return [future.result() for future in futures]  # type: ignore
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into a single execution
+
+    Callers arriving while a call for their key is in flight wait for it and share its result
+    (or its exception) instead of running their own
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
@@ -0,0 +1,168 @@
+"""
+Resolution of coordinates to their Weather.gov forecast, cached on disk across restarts
+
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+# "latitude,longitude" in decimal degrees, as opposed to a "gridpoints/{office}/{x},{y}" code
+_COORDINATES = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+def _degrees(value: float) -> str:
+    # the points endpoint redirects coordinates with more than 4 decimals, + 0.0 drops a -0.0
+    text = repr(round(value, 4) + 0.0)
+    return text[:-2] if text.endswith(".0") else text
+
+
+def parse_coordinates(location_code: str) -> Optional[Tuple[str, str]]:
+    """The (latitude, longitude) of a coordinates location code, None for any other code"""
+    match = _COORDINATES.match(location_code)
+    if match is None:
+        return None
+
+    latitude, longitude = float(match.group(1)), float(match.group(2))
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        return None
+
+    return _degrees(latitude), _degrees(longitude)
+
+
+class GridpointCache:
+    """Forecast URLs resolved from coordinates, kept for ttl seconds
+
+    With a path the resolutions are saved to a JSON file, so a restarted monitor doesn't resolve
+    its locations again. The file is rewritten through a temporary file by a background thread, so
+    a lookup never waits on the disk: the resolutions and invalidations made meanwhile are written
+    together, flush_interval seconds after the first of them.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 7 * 24 * 3600,
+        clock: Callable[[], float] = time.time,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+
+        self._clock = clock
+        self._condition = threading.Condition()
+        # location code => (forecast URL, wall clock time it was resolved at)
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        # changed since the file was last written
+        self._dirty = False
+        self._closed = False
+        self._writer: Optional[threading.Thread] = None
+
+        if path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        logger = logging.getLogger(__name__)
+
+        try:
+            with open(self.path, encoding="utf-8") as cache_file:  # type: ignore
+                data = json.load(cache_file)
+
+            self._entries = {
+                str(code): (str(entry["url"]), float(entry["resolved_at"]))
+                for code, entry in data.items()
+            }
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning("ignoring unreadable gridpoint cache %s: %s", self.path, e)
+
+    def _save(self, entries: Dict[str, Tuple[str, float]]) -> None:
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as cache_file:
+            json.dump(
+                {code: {"url": url, "resolved_at": at} for code, (url, at) in entries.items()},
+                cache_file,
+            )
+            cache_file.flush()
+            os.fsync(cache_file.fileno())
+
+        os.replace(temporary, self.path)  # type: ignore
+
+    def get(self, location_code: str) -> Optional[str]:
+        """The forecast URL of a location code, None when not resolved or resolved too long ago"""
+        with self._condition:
+            entry = self._entries.get(location_code)
+
+        if entry is None or self._clock() - entry[1] >= self.ttl:
+            return None
+
+        return entry[0]
+
+    def put(self, location_code: str, url: str) -> None:
+        with self._condition:
+            self._entries[location_code] = (url, self._clock())
+            self._changed()
+
+    def invalidate(self, location_code: str) -> None:
+        with self._condition:
+            if self._entries.pop(location_code, None) is not None:
+                self._changed()
+
+    def _changed(self) -> None:
+        # called with the condition held
+        if self.path is None:
+            return
+
+        self._dirty = True
+
+        if self._writer is None and not self._closed:
+            self._writer = threading.Thread(
+                target=self._run, name="weather-gridpoints", daemon=True
+            )
+            self._writer.start()
+
+        self._condition.notify()
+
+    def _run(self) -> None:
+        logger = logging.getLogger(__name__)
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed or self._dirty)
+
+                # let the rest of the cycle's resolutions come in, only closing cuts the wait short
+                flush_at = time.monotonic() + self.flush_interval
+                while not self._closed and time.monotonic() < flush_at:
+                    self._condition.wait(flush_at - time.monotonic())
+
+                closed = self._closed
+                dirty, self._dirty = self._dirty, False
+                entries = dict(self._entries)
+
+            if dirty:
+                try:
+                    self._save(entries)
+                except OSError as e:
+                    # the resolutions are kept, the next change writes them
+                    logger.error("writing the gridpoint cache %s failed: %s", self.path, e)
+
+            if closed:
+                return
+
+    def close(self) -> None:
+        """Write what is left to write, then stop the writer"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            writer = self._writer
+
+        if writer is not None:
+            writer.join()
@@ -0,0 +1,106 @@
+"""
+Hedged lookups: asking a second Weather Source when the first one is slow to answer
+
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Latencies of the last window requests to each Weather Source, for latency percentiles"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self.window = window
+        self.min_samples = min_samples
+
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, source_name: str, seconds: float) -> None:
+        with self._lock:
+            latencies = self._latencies.get(source_name)
+            if latencies is None:
+                latencies = self._latencies[source_name] = deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def percentile(self, source_name: str, q: float) -> Optional[float]:
+        """q-quantile (0 to 1) of the source's recent latencies, None until min_samples are in"""
+        with self._lock:
+            latencies = sorted(self._latencies.get(source_name, ()))
+
+        if len(latencies) < self.min_samples:
+            return None
+
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+
+def hedged(
+    calls: Sequence[Callable[[], T]],
+    delay: Callable[[int], float],
+    executor: Executor,
+    clock: Callable[[], float] = time.monotonic,
+) -> Tuple[int, T]:
+    """Run calls until one succeeds: the next call starts once the last one started hasn't
+    answered within delay(its index) seconds, or right away when a call fails
+
+    The delay runs from the moment a call actually starts on the executor, so calls queued behind
+    a busy executor aren't mistaken for slow ones.
+    Calls still in flight when another one wins are left to finish in the background.
+
+    Returns:
+        Tuple[int, T]: index and result of the first call to succeed
+
+    Raises:
+        The exception of the last call to fail, when none succeeded
+    """
+    if not calls:
+        raise ValueError("hedged needs at least one call")
+
+    # clock() at which each call started running, written by the executor thread
+    started_at: List[Optional[float]] = [None] * len(calls)
+
+    def run(index: int) -> T:
+        started_at[index] = clock()
+        return calls[index]()
+
+    in_flight: Dict[Future, int] = {}
+    launched = 0
+    error: Optional[BaseException] = None
+    start = True
+
+    while True:
+        if start and launched < len(calls):
+            in_flight[executor.submit(run, launched)] = launched
+            launched += 1
+
+        if not in_flight:
+            raise error  # type: ignore
+
+        last = launched - 1
+        timeout = None
+        if launched < len(calls):
+            last_started = started_at[last]
+            # not running yet, look again after a full delay
+            timeout = delay(last)
+            if last_started is not None:
+                timeout = max(last_started + timeout - clock(), 0.0)
+
+        done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        # the call started last is slow, hedge with the next one
+        last_started = started_at[last]
+        start = not done and last_started is not None and clock() - last_started >= delay(last)
+
+        for future in sorted(done, key=lambda future: in_flight[future]):
+            index = in_flight.pop(future)
+            try:
+                return index, future.result()
+            except Exception as e:
+                # a failed call is replaced right away rather than after the delay
+                error = e
+                start = True
@@ -0,0 +1,289 @@
+"""
+Recent reading history per location, with rolling aggregates exported as gauges
+
+"""
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Sequence, Tuple
+
+from prometheus_client import push_to_gateway  # type: ignore
+from prometheus_client import CollectorRegistry, Gauge
+
+from weather import metrics, profiler
+from weather.publisher import LABELNAMES, NAMESPACE, PublisherProtocol, record_readings
+from weather.readings import Reading
+from weather.utils import (
+    TemperatureMeasurement,
+    TemperatureUnit,
+    convert_temperature,
+    convert_temperatures,
+)
+
+
+class RingBuffer:
+    """Fixed size window of the latest (timestamp, value) pairs
+
+    Storage is preallocated and every append is O(1) (amortized for min and max), the aggregates
+    are kept up to date as readings come in and drop out instead of rescanning the window.
+    """
+
+    __slots__ = ("size", "_values", "_times", "_next", "_count", "_sum", "_seq", "_min", "_max")
+
+    def __init__(self, size: int) -> None:
+        if size < 1:
+            raise ValueError(f"size must be at least 1, got {size}")
+
+        self.size = size
+        self._values = array("d", bytes(8 * size))
+        self._times = array("d", bytes(8 * size))
+        self._next = 0
+        self._count = 0
+        self._sum = 0.0
+        self._seq = 0
+
+        # monotonic queues of (sequence number, value), the front is the window's min / max
+        self._min: Deque[Tuple[int, float]] = deque()
+        self._max: Deque[Tuple[int, float]] = deque()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, value: float) -> None:
+        if self._count == self.size:
+            self._sum -= self._values[self._next]
+        else:
+            self._count += 1
+
+        self._values[self._next] = value
+        self._times[self._next] = timestamp
+        self._sum += value
+
+        self._next = (self._next + 1) % self.size
+        if self._next == 0:
+            # re-sum once per lap so the running sum can't drift
+            self._sum = sum(self._values[: self._count])
+
+        seq = self._seq
+        self._seq += 1
+        oldest = seq - self.size
+
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((seq, value))
+        while self._min[0][0] <= oldest:
+            self._min.popleft()
+
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((seq, value))
+        while self._max[0][0] <= oldest:
+            self._max.popleft()
+
+    @property
+    def latest(self) -> Optional[float]:
+        """Timestamp of the newest value, None while empty"""
+        return self._times[(self._next - 1) % self.size] if self._count else None
+
+    @property
+    def minimum(self) -> float:
+        return self._min[0][1] if self._count else float("nan")
+
+    @property
+    def maximum(self) -> float:
+        return self._max[0][1] if self._count else float("nan")
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self._count if self._count else float("nan")
+
+    def rate(self) -> float:
+        """Change per second between the oldest and the newest value of the window"""
+        if self._count < 2:
+            return 0.0
+
+        newest = (self._next - 1) % self.size
+        oldest = (self._next - self._count) % self.size
+        elapsed = self._times[newest] - self._times[oldest]
+
+        return (self._values[newest] - self._values[oldest]) / elapsed if elapsed > 0 else 0.0
+
+
+class TemperatureHistory:
+    """Ring buffer of the latest readings per (source, location) and their rolling min, max, mean
+    and rate of change, exported in Celsius and Fahrenheit
+
+    Readings are kept at the wall clock time they were fetched at, clock() for a bare temperature.
+    A reading fetched at the same time as the newest one kept for its location is the same reading
+    served again (from the cache, stale or restored at start), it is not added a second time.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        registry: Optional[CollectorRegistry] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        if size < 1:
+            raise ValueError(f"size must be at least 1, got {size}")
+
+        self.size = size
+        self.registry = registry if registry is not None else CollectorRegistry()
+        self.clock = clock
+
+        self._buffers: Dict[Tuple[Optional[str], Optional[str]], RingBuffer] = {}
+        self._lock = threading.Lock()
+
+        self._window = {
+            unit: Gauge(
+                name="temperature_window",
+                documentation=f"Min, max and mean of the last {size} temperature readings",
+                labelnames=LABELNAMES + ["stat"],
+                unit=unit,
+                registry=self.registry,
+                namespace=NAMESPACE,
+            )
+            for unit in ("celsius", "fahrenheit")
+        }
+        self._rate = {
+            unit: Gauge(
+                name="temperature_rate",
+                documentation=f"Temperature change per second over the last {size} readings",
+                labelnames=LABELNAMES,
+                unit=f"{unit}_per_second",
+                registry=self.registry,
+                namespace=NAMESPACE,
+            )
+            for unit in ("celsius", "fahrenheit")
+        }
+
+    def buffer(
+        self, location_name: Optional[str] = None, weather_service: Optional[str] = None
+    ) -> Optional[RingBuffer]:
+        return self._buffers.get((weather_service, location_name))
+
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        celsius = convert_temperature(temperature, TemperatureUnit.CELSIUS).value
+        self._append(location_name, weather_service, self.clock(), celsius)
+
+    def record_readings(self, readings: Sequence[Reading]) -> None:
+        """Record many readings, converted to Celsius together"""
+        with profiler.span("convert_temperatures", readings=str(len(readings))):
+            celsius = convert_temperatures(
+                [reading.value for reading in readings],
+                [reading.unit for reading in readings],
+                TemperatureUnit.CELSIUS,
+            )
+
+        for reading, value in zip(readings, celsius):
+            self._append(reading.location, reading.source, reading.fetched_at, value)
+
+    def _append(
+        self,
+        location_name: Optional[str],
+        weather_service: Optional[str],
+        timestamp: float,
+        celsius: float,
+    ) -> None:
+        with self._lock:
+            buffer = self._buffers.get((weather_service, location_name))
+            if buffer is None:
+                buffer = self._buffers[(weather_service, location_name)] = RingBuffer(self.size)
+            elif buffer.latest == timestamp:
+                return
+
+            buffer.append(timestamp, celsius)
+            stats = (buffer.minimum, buffer.maximum, buffer.mean)
+            rate = buffer.rate()
+
+        for stat, value in zip(("min", "max", "mean"), stats):
+            self._window["celsius"].labels(weather_service, location_name, stat).set(value)
+            self._window["fahrenheit"].labels(weather_service, location_name, stat).set(
+                value * 1.8 + 32
+            )
+        self._rate["celsius"].labels(weather_service, location_name).set(rate)
+        self._rate["fahrenheit"].labels(weather_service, location_name).set(rate * 1.8)
+
+    def remove(
+        self, location_name: Optional[str] = None, weather_service: Optional[str] = None
+    ) -> None:
+        with self._lock:
+            self._buffers.pop((weather_service, location_name), None)
+
+        for gauge in self._window.values():
+            for stat in ("min", "max", "mean"):
+                try:
+                    gauge.remove(weather_service, location_name, stat)
+                except KeyError:
+                    pass
+        for gauge in self._rate.values():
+            try:
+                gauge.remove(weather_service, location_name)
+            except KeyError:
+                pass
+
+
+class HistoryPublisher:
+    """Feeds every reading to a TemperatureHistory on its way to another publisher
+
+    With a Pushgateway URL the history gauges are pushed on each publish, as job weather_history,
+    otherwise they are expected to be served from a registry the history is registered with.
+    """
+
+    def __init__(
+        self,
+        publisher: PublisherProtocol,
+        history: TemperatureHistory,
+        pushgateway_url: Optional[str] = None,
+        job: str = "weather_history",
+        grouping_key: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.publisher = publisher
+        self.history = history
+        self.pushgateway_url = pushgateway_url
+        self.job = job
+        self.grouping_key: Dict[str, str] = dict(grouping_key or {})
+
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        self.history.record(temperature, location_name, weather_service)
+        self.publisher.record(
+            temperature=temperature, location_name=location_name, weather_service=weather_service
+        )
+
+    def record_readings(self, readings: Sequence[Reading]) -> None:
+        self.history.record_readings(readings)
+        record_readings(self.publisher, readings)
+
+    def remove(
+        self, location_name: Optional[str] = None, weather_service: Optional[str] = None
+    ) -> None:
+        self.history.remove(location_name, weather_service)
+
+        remove = getattr(self.publisher, "remove", None)
+        if remove is not None:
+            remove(location_name=location_name, weather_service=weather_service)
+
+    def publish(self) -> None:
+        if self.pushgateway_url:
+            with metrics.PUSH_LATENCY.labels(self.job).time(), profiler.span(
+                "push_to_gateway", job=self.job
+            ):
+                push_to_gateway(
+                    gateway=self.pushgateway_url,
+                    job=self.job,
+                    registry=self.history.registry,
+                    grouping_key=self.grouping_key,
+                )
+
+        self.publisher.publish()
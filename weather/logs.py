@@ -0,0 +1,99 @@
+"""
+Logging through a queue, written to file by a background thread so log I/O never holds up a lookup
+
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+from weather import metrics
+
+LOG_FORMAT = "%(asctime)s %(levelname)s:%(message)s"
+DATE_FORMAT = "%Y-%m-%d %I:%M:%S %p"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler dropping the records a full queue has no room for, rather than blocking
+
+    Only the message is merged with its arguments on the logging thread, the formatting and any
+    exception traceback are left to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPS.inc()
+
+
+def start_logging(
+    path: str,
+    level: int = logging.WARNING,
+    json_lines: bool = False,
+    max_bytes: int = 0,
+    backup_count: int = 5,
+    queue_size: int = 10000,
+    logger: Optional[logging.Logger] = None,
+) -> logging.handlers.QueueListener:
+    """Send the records of logger (the root logger by default) to a file through a queue
+
+    The calling thread only puts the record on the queue, a listener thread formats and writes it.
+    With max_bytes the file is rotated once it grows past that size, keeping backup_count files.
+    Stop the returned listener to write out the queued records.
+    """
+    if logger is None:
+        logger = logging.getLogger()
+
+    file_handler: logging.Handler
+    if max_bytes > 0:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        file_handler = logging.FileHandler(path, encoding="utf-8")
+
+    if json_lines:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+
+    records: queue.Queue = queue.Queue(maxsize=queue_size)
+    listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    logger.addHandler(DroppingQueueHandler(records))
+    logger.setLevel(level)
+
+    listener.start()
+
+    return listener
@@ -0,0 +1,129 @@
+"""
+Self-metrics of the weather monitor, exported alongside the weather readings
+
+"""
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+NAMESPACE = "weathermonitor"
+
+# registry holding the monitor's own metrics, pushed or served next to the weather gauges
+REGISTRY = CollectorRegistry()
+
+CACHE_REQUESTS = Counter(
+    name="cache_requests",
+    documentation="Response cache lookups by result (hit, miss, revalidated, stale)",
+    labelnames=["source", "result"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+BUDGET_REMAINING = Gauge(
+    name="source_budget_remaining",
+    documentation="Requests left in today's (UTC) budget of a weather source",
+    labelnames=["source"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+BREAKER_STATE = Gauge(
+    name="circuit_breaker_state",
+    documentation="Circuit breaker state of a weather source (0 closed, 1 open, 2 half-open)",
+    labelnames=["source"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+UPSTREAM_LATENCY = Histogram(
+    name="upstream_request_seconds",
+    documentation="Latency of the HTTP requests sent to a weather source",
+    labelnames=["source"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+PARSE_LATENCY = Histogram(
+    name="parse_seconds",
+    documentation="Time spent extracting temperatures from a weather source response, including "
+    "reading the body of a streamed (partial_parse) response",
+    labelnames=["source"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+PUSH_LATENCY = Histogram(
+    name="push_seconds",
+    documentation="Latency of the pushes to the Pushgateway",
+    labelnames=["job"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+CYCLE_DURATION = Histogram(
+    name="cycle_seconds",
+    documentation="Duration of a poll cycle: running the due lookups and publishing their readings",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900, 1800),
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+POLL_ERRORS = Counter(
+    name="poll_errors",
+    documentation="Lookups of the poll loop that did not produce a reading, by error",
+    labelnames=["source", "error"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+BACKGROUND_REFRESHES = Counter(
+    name="background_refreshes",
+    documentation="Background refreshes of stale readings served from the cache, by result",
+    labelnames=["source", "result"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+READING_AGE = Gauge(
+    name="reading_age_seconds",
+    documentation="Seconds since the last published reading of a location was fetched",
+    labelnames=["source", "location"],
+    namespace="weather",
+    registry=REGISTRY,
+)
+
+PUBLISH_QUEUE_DEPTH = Gauge(
+    name="publish_queue_depth",
+    documentation="Readings waiting in the publish queue",
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+PUBLISH_DROPS = Counter(
+    name="publish_drops",
+    documentation="Readings dropped from the publish queue, by reason (coalesced, overflow)",
+    labelnames=["reason"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+PUBLISH_FAILURES = Counter(
+    name="publish_failures",
+    documentation="Failed flushes of the publish queue, retried with a backoff",
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+HEDGE_WINS = Counter(
+    name="hedge_wins",
+    documentation="Hedged lookups by the source that answered first (rank primary or hedge)",
+    labelnames=["source", "rank"],
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
+
+LOG_DROPS = Counter(
+    name="log_records_dropped",
+    documentation="Log records dropped because the log queue was full",
+    namespace=NAMESPACE,
+    registry=REGISTRY,
+)
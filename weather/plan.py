@@ -0,0 +1,237 @@
+"""
+Poll plan: the [LOCATIONS] config parsed and validated once into immutable lookup records
+
+"""
+import ast
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from weather import factory as weatherfactory
+from weather.shard import hash_ring
+from weather.weathersource import BatchWeatherSourceProtocol, WeatherSourceProtocol
+
+REQUIRED_FIELDS = ("name", "service", "location_code")
+
+
+class Alternate(NamedTuple):
+    """Another (service, location_code) of a location, asked when its primary is slow to answer"""
+
+    service: str
+    location_code: str
+    source: WeatherSourceProtocol
+
+
+class PlannedLocation(NamedTuple):
+    """A validated [LOCATIONS] entry with its Weather Source resolved"""
+
+    key: str
+    name: str
+    service: str
+    location_code: str
+    source: WeatherSourceProtocol
+    # Prometheus label values (source, location) of the location's readings
+    labels: Tuple[str, str]
+    # poll interval in seconds, None to use the interval of the service
+    interval: Optional[float] = None
+    # fallback sources of a hedged location, in order
+    alternates: Tuple[Alternate, ...] = ()
+
+    def all_labels(self) -> Tuple[Tuple[str, str], ...]:
+        """Label values of every source the location's readings may come from"""
+        return (self.labels,) + tuple(
+            (alternate.service, self.name) for alternate in self.alternates
+        )
+
+
+class Lookup(NamedTuple):
+    """One unit of upstream work: a single location lookup or a multi-location batch request
+
+    Every location sharing a looked up location_code is listed, so the reading is fanned out to all
+    """
+
+    service: str
+    source: WeatherSourceProtocol
+    location_codes: Tuple[str, ...]
+    locations: Tuple[PlannedLocation, ...]
+    batch: bool
+    # shortest poll interval of the locations in seconds, None to use the interval of the service
+    interval: Optional[float] = None
+    # hedged single lookups only: the sources to fall back to when the primary is slow
+    alternates: Tuple[Alternate, ...] = ()
+
+
+class PollPlan(NamedTuple):
+    locations: Tuple[PlannedLocation, ...]
+    lookups: Tuple[Lookup, ...]
+
+
+def parse_location(key: str, location_info: str) -> PlannedLocation:
+    """Parse and validate a single [LOCATIONS] entry
+
+    Raises:
+        ValueError: If the entry is malformed or refers to an unknown weather service
+    """
+    try:
+        location = ast.literal_eval(location_info)
+    except (ValueError, SyntaxError) as e:
+        raise ValueError(f'[LOCATIONS] "{key}" is not a valid dictionary: {e}') from e
+
+    if not isinstance(location, dict):
+        raise ValueError(f'[LOCATIONS] "{key}" is not a dictionary: {location_info}')
+
+    missing = [field for field in REQUIRED_FIELDS if not location.get(field)]
+    if missing:
+        raise ValueError(f'[LOCATIONS] "{key}" is missing {", ".join(missing)}')
+
+    name = str(location["name"])
+    service = str(location["service"])
+    location_code = str(location["location_code"])
+
+    try:
+        source = weatherfactory.source(service)
+    except ValueError as e:
+        raise ValueError(f'[LOCATIONS] "{key}": {e}') from e
+
+    interval = None
+    if location.get("interval_minutes") is not None:
+        try:
+            interval = float(location["interval_minutes"]) * 60
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'[LOCATIONS] "{key}" interval_minutes is not a number') from e
+
+        if interval <= 0:
+            raise ValueError(f'[LOCATIONS] "{key}" interval_minutes must be positive')
+
+    alternates = []
+    fallbacks = location.get("fallbacks") or []
+    if not isinstance(fallbacks, (list, tuple)):
+        raise ValueError(f'[LOCATIONS] "{key}" fallbacks is not a list')
+
+    for fallback in fallbacks:
+        if not isinstance(fallback, dict) or not all(
+            fallback.get(field) for field in ("service", "location_code")
+        ):
+            raise ValueError(
+                f'[LOCATIONS] "{key}" fallbacks need a service and a location_code: {fallback}'
+            )
+
+        try:
+            fallback_source = weatherfactory.source(str(fallback["service"]))
+        except ValueError as e:
+            raise ValueError(f'[LOCATIONS] "{key}" fallbacks: {e}') from e
+
+        alternates.append(
+            Alternate(
+                service=str(fallback["service"]),
+                location_code=str(fallback["location_code"]),
+                source=fallback_source,
+            )
+        )
+
+    return PlannedLocation(
+        key=key,
+        name=name,
+        service=service,
+        location_code=location_code,
+        source=source,
+        labels=(service, name),
+        interval=interval,
+        alternates=tuple(alternates),
+    )
+
+
+def _shortest_interval(locations: Iterable[PlannedLocation]) -> Optional[float]:
+    intervals = [location.interval for location in locations if location.interval is not None]
+    return min(intervals) if intervals else None
+
+
+def build_poll_plan(
+    locations: Iterable[Tuple[str, str]],
+    batch_lookups: bool = False,
+    shard_index: int = 0,
+    shard_count: int = 1,
+) -> PollPlan:
+    """Build the poll plan of the [LOCATIONS] config entries
+
+    Entries sharing the same service and location_code become a single lookup.
+    With batch_lookups, the locations of services supporting multi-location requests are
+    grouped into as few lookups as their batch size allows.
+    With more than one shard, the plan only holds the locations the consistent hash ring
+    assigns to shard_index, every entry is still validated.
+
+    Raises:
+        ValueError: listing every malformed [LOCATIONS] entry, or for a shard out of range
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard_index {shard_index} out of range for {shard_count} shards")
+
+    planned: List[PlannedLocation] = []
+    errors: List[str] = []
+
+    for key, location_info in locations:
+        try:
+            planned.append(parse_location(key, location_info))
+        except ValueError as e:
+            errors.append(str(e))
+
+    if errors:
+        raise ValueError("Invalid [LOCATIONS] config:\n" + "\n".join(errors))
+
+    if shard_count > 1:
+        ring = hash_ring(shard_count)
+        planned = [
+            location
+            for location in planned
+            if ring.shard(location.service, location.location_code) == shard_index
+        ]
+
+    singles: Dict[Tuple[str, str, Tuple[Alternate, ...]], List[PlannedLocation]] = {}
+    batches: Dict[str, Dict[str, List[PlannedLocation]]] = {}
+
+    for location in planned:
+        # hedged locations are always looked up on their own
+        if (
+            batch_lookups
+            and not location.alternates
+            and isinstance(location.source, BatchWeatherSourceProtocol)
+        ):
+            batches.setdefault(location.service, {}).setdefault(location.location_code, []).append(
+                location
+            )
+        else:
+            singles.setdefault(
+                (location.service, location.location_code, location.alternates), []
+            ).append(location)
+
+    lookups: List[Lookup] = [
+        Lookup(
+            service=service,
+            source=same_lookup[0].source,
+            location_codes=(location_code,),
+            locations=tuple(same_lookup),
+            batch=False,
+            interval=_shortest_interval(same_lookup),
+            alternates=alternates,
+        )
+        for (service, location_code, alternates), same_lookup in singles.items()
+    ]
+
+    for service, by_code in batches.items():
+        source = weatherfactory.source(service)
+        batch_size = max(source.max_batch_size, 1)  # type: ignore
+        codes = list(by_code)
+
+        for i in range(0, len(codes), batch_size):
+            batch_codes = tuple(codes[i : i + batch_size])
+            batch_locations = tuple(location for code in batch_codes for location in by_code[code])
+            lookups.append(
+                Lookup(
+                    service=service,
+                    source=source,
+                    location_codes=batch_codes,
+                    locations=batch_locations,
+                    batch=True,
+                    interval=_shortest_interval(batch_locations),
+                )
+            )
+
+    return PollPlan(locations=tuple(planned), lookups=tuple(lookups))
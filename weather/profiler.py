@@ -0,0 +1,333 @@
+"""
+On-demand profiling of the poll cycles: timed spans, a sampling profiler and their reports
+
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Callable, ContextManager, Counter, Dict, Iterator, List, NamedTuple, Optional
+
+# shared by every span while the profiler is idle, so an idle span costs a single call
+_IDLE = contextlib.nullcontext()
+
+
+class Span(NamedTuple):
+    """A timed section of a profiled cycle"""
+
+    name: str
+    thread: int
+    # perf_counter seconds
+    start: float
+    duration: float
+    labels: Dict[str, str]
+
+
+class _TimedSpan:
+    __slots__ = ("profiler", "name", "labels", "start")
+
+    def __init__(self, profiler: "Profiler", name: str, labels: Dict[str, str]) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = self.profiler.clock()
+
+    def __exit__(self, *exc_info) -> None:
+        self.profiler.record(self.name, self.start, self.profiler.clock() - self.start, self.labels)
+
+
+def _frame_name(frame: FrameType) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}".replace(";", ":")
+
+
+class StackSampler:
+    """Samples the stacks of every other thread each interval seconds, in a thread of its own
+
+    The samples are counted per collapsed stack, root frame first, as read by flamegraph.pl and
+    speedscope. The root of every stack is the name of its thread.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        if interval <= 0:
+            raise ValueError(f"interval must be positive, got {interval}")
+
+        self.interval = interval
+        self.samples: Counter[str] = collections.Counter()
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="weather-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter[str]:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        return self.samples
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+
+            stack: List[str] = []
+            current: Optional[FrameType] = frame
+            while current is not None:
+                stack.append(_frame_name(current))
+                current = current.f_back
+
+            stack.append(names.get(ident, str(ident)).replace(";", ":").replace(" ", "_"))
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+class Profiler:
+    """Profiles the next cycles of the poll loop once requested, from a signal or the config
+
+    While profiling, the spans of each cycle are recorded and, with a sample_interval, the stacks
+    of the monitor's threads are sampled. Once the requested cycles ran, output_dir receives:
+
+    * {prefix}.trace.json: the spans, in the Chrome trace event format (Perfetto, chrome://tracing)
+    * {prefix}.folded: the sampled stacks collapsed for flamegraph.pl or speedscope
+    * {prefix}.slow.txt: the time spent per span name, and the slowest calls
+
+    The reports are written by a thread of their own, outside of the last profiled cycle. An idle
+    profiler only costs a single call per span.
+    """
+
+    def __init__(
+        self,
+        output_dir: str = "profiles",
+        cycles: int = 1,
+        sample_interval: Optional[float] = 0.005,
+        slow_calls: int = 25,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.output_dir = output_dir
+        self.cycles = cycles
+        self.sample_interval = sample_interval
+        self.slow_calls = slow_calls
+        self.clock = clock
+
+        # read by every span, only written by the poll loop thread
+        self.active = False
+
+        self._requested = 0
+        self._remaining = 0
+        self._started = 0.0
+        self._started_at = 0.0
+        self._spans: List[Span] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[StackSampler] = None
+        self._writer: Optional[threading.Thread] = None
+
+    def configure(
+        self,
+        output_dir: str = "profiles",
+        cycles: int = 1,
+        sample_interval: Optional[float] = 0.005,
+        slow_calls: int = 25,
+    ) -> None:
+        if cycles < 1:
+            raise ValueError(f"cycles must be at least 1, got {cycles}")
+
+        self.output_dir = output_dir
+        self.cycles = cycles
+        self.sample_interval = sample_interval
+        self.slow_calls = slow_calls
+
+    def request(self, cycles: Optional[int] = None) -> None:
+        """Profile the next cycles (the configured number by default), safe to call from a
+        signal handler"""
+        self._requested = cycles if cycles is not None else self.cycles
+
+    def handle_signal(self, signum: int, frame: Optional[FrameType]) -> None:
+        """Signal handler requesting a profile of the next cycles"""
+        self.request()
+
+    def span(self, name: str, **labels: str) -> ContextManager[None]:
+        """Time a section of the cycle being profiled, a no-op while the profiler is idle"""
+        if not self.active:
+            return _IDLE
+
+        return _TimedSpan(self, name, labels)
+
+    def record(self, name: str, start: float, duration: float, labels: Dict[str, str]) -> None:
+        thread = threading.current_thread()
+
+        with self._lock:
+            self._spans.append(Span(name, thread.ident or 0, start, duration, labels))
+            self._threads[thread.ident or 0] = thread.name
+
+    @contextlib.contextmanager
+    def cycle(self, **labels: str) -> Iterator[None]:
+        """Wrap a poll cycle, profiling starts at the first cycle after a request"""
+        if not self.active and self._requested:
+            self._start()
+
+        if not self.active:
+            yield
+            return
+
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record("cycle", start, self.clock() - start, labels)
+
+            self._remaining -= 1
+            if self._remaining <= 0:
+                self._finish()
+
+    def _start(self) -> None:
+        self._remaining = self._requested
+        self._requested = 0
+
+        with self._lock:
+            self._spans = []
+            self._threads = {}
+
+        self._started = self.clock()
+        self._started_at = time.time()
+
+        if self.sample_interval:
+            self._sampler = StackSampler(self.sample_interval)
+            self._sampler.start()
+
+        self.active = True
+
+    def _finish(self) -> str:
+        """Stop profiling and start writing the reports, returns their path prefix"""
+        self.active = False
+
+        samples: Counter[str] = collections.Counter()
+        if self._sampler is not None:
+            samples = self._sampler.stop()
+            self._sampler = None
+
+        with self._lock:
+            spans, self._spans = self._spans, []
+            threads, self._threads = self._threads, {}
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started_at))
+        prefix = os.path.join(self.output_dir, f"weathermonitor-{stamp}-{os.getpid()}")
+
+        self._writer = threading.Thread(
+            target=self._write,
+            args=(prefix, self._started, spans, threads, samples),
+            name="weather-profiler-writer",
+            daemon=True,
+        )
+        self._writer.start()
+
+        return prefix
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait for the reports of the last profile to be written"""
+        if self._writer is not None:
+            self._writer.join(timeout)
+
+    def _write(
+        self,
+        prefix: str,
+        started: float,
+        spans: List[Span],
+        threads: Dict[int, str],
+        samples: Counter[str],
+    ) -> None:
+        logger = logging.getLogger(__name__)
+
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._write_trace(f"{prefix}.trace.json", started, spans, threads)
+            self._write_folded(f"{prefix}.folded", samples)
+            self._write_slow_report(f"{prefix}.slow.txt", spans)
+        except OSError as e:
+            logger.error("writing the profile %s failed: %s", prefix, e)
+            return
+
+        logger.warning(
+            "profiled %d spans and %d samples to %s", len(spans), sum(samples.values()), prefix
+        )
+
+    @staticmethod
+    def _write_trace(path: str, started: float, spans: List[Span], threads: Dict[int, str]) -> None:
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        ]
+        events.extend(
+            {
+                "name": span.name,
+                "cat": "weathermonitor",
+                "ph": "X",
+                "ts": round((span.start - started) * 1e6, 1),
+                "dur": round(span.duration * 1e6, 1),
+                "pid": pid,
+                "tid": span.thread,
+                "args": span.labels,
+            }
+            for span in spans
+        )
+
+        with open(path, "w", encoding="utf-8") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+    @staticmethod
+    def _write_folded(path: str, samples: Counter[str]) -> None:
+        with open(path, "w", encoding="utf-8") as folded_file:
+            for stack, count in samples.most_common():
+                folded_file.write(f"{stack} {count}\n")
+
+    def _write_slow_report(self, path: str, spans: List[Span]) -> None:
+        by_name: Dict[str, List[float]] = {}
+        for span in spans:
+            by_name.setdefault(span.name, []).append(span.duration)
+
+        lines = [
+            f"{'span':<24} {'calls':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}",
+        ]
+        for name, durations in sorted(by_name.items(), key=lambda item: -sum(item[1])):
+            lines.append(
+                f"{name:<24} {len(durations):>8} {sum(durations):>10.3f}"
+                f" {sum(durations) / len(durations) * 1000:>10.2f} {max(durations) * 1000:>10.2f}"
+            )
+
+        lines.extend(["", f"slowest {self.slow_calls} calls"])
+        for span in sorted(spans, key=lambda span: -span.duration)[: self.slow_calls]:
+            labels = " ".join(f"{key}={value}" for key, value in span.labels.items())
+            lines.append(f"{span.duration * 1000:>10.2f} ms  {span.name:<24} {labels}".rstrip())
+
+        with open(path, "w", encoding="utf-8") as report_file:
+            report_file.write("\n".join(lines) + "\n")
+
+
+# profiler of this process, spans anywhere in the monitor report to it
+PROFILER = Profiler()
+
+
+def span(name: str, **labels: str) -> ContextManager[None]:
+    """Time a section of the cycle being profiled by the process profiler"""
+    return PROFILER.span(name, **labels)
@@ -1,9 +1,45 @@
-from typing import Protocol
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional, Protocol, Sequence, Set, Tuple
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from weather import metrics, profiler
+from weather.breaker import CircuitBreaker
+from weather.cache import CacheEntry, ResponseCache
+from weather.fetcher import SingleFlight
+from weather.hedge import LatencyTracker, hedged
+from weather.ratelimit import RateLimiter
 from weather.utils import TemperatureMeasurement, TemperatureUnit, convert_temperature
-from weather.weathersource import WeatherSourceProtocol
+from weather.weathersource import (
+    BatchWeatherSourceProtocol,
+    ResolvingWeatherSourceProtocol,
+    WeatherSourceProtocol,
+)
+
+# redirects after which a resolved location code has to be resolved again
+PERMANENT_REDIRECTS = (301, 308)
+
+# transport failures, also raised while the body of a streamed response is read
+TRANSPORT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+
+
+class NotFoundError(ConnectionRefusedError):
+    """A 404 answer of a Weather Source"""
+
+
+class TooManyRequestsError(ConnectionRefusedError):
+    """A 429 answer of a Weather Source, asking to slow down"""
 
 
 class WeatherProviderProtocol(Protocol):
@@ -12,13 +48,111 @@ class WeatherProviderProtocol(Protocol):
     ) -> TemperatureMeasurement:
         ...
 
+    def temperatures(
+        self, source: WeatherSourceProtocol, location_codes: List[str]
+    ) -> Dict[str, TemperatureMeasurement]:
+        ...
+
+    def temperature_hedged(
+        self,
+        candidates: Sequence[Tuple[WeatherSourceProtocol, str]],
+        on_error: Optional[Callable[[int, BaseException], None]] = None,
+    ) -> Tuple[int, TemperatureMeasurement]:
+        ...
+
 
 class WeatherProvider:
     """Weather Provider
 
     Processing provider to use various WeatherSourceProtocol sources to retrieve and use weather information
+
+    Lookups share one keep-alive session per source host, so connection setup is paid once per host.
+    With a ResponseCache, fresh lookups are answered from memory and stale ones are revalidated
+    with conditional requests. With a max_staleness, stale readings younger than that are served
+    right away and refreshed in the background. Hedged lookups ask a further source when the
+    first one is slower than usual. Rate limiters and circuit breakers, keyed by
+    Weather Source name, guard every request sent to their source
     """
 
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: Optional[float] = 5.0,
+        read_timeout: Optional[float] = 30.0,
+        cache: Optional[ResponseCache] = None,
+        rate_limiters: Optional[Dict[str, RateLimiter]] = None,
+        circuit_breakers: Optional[Dict[str, CircuitBreaker]] = None,
+        max_staleness: float = 0.0,
+        refresh_workers: int = 2,
+        hedge_percentile: float = 0.95,
+        hedge_delay: float = 1.0,
+        hedge_workers: int = 8,
+    ) -> None:
+        if pool_size < 1:
+            raise ValueError(f"pool_size must be at least 1, got {pool_size}")
+
+        self.pool_size = pool_size
+        self.timeout: Tuple[Optional[float], Optional[float]] = (connect_timeout, read_timeout)
+        self.cache = cache
+        self.rate_limiters: Dict[str, RateLimiter] = dict(rate_limiters or {})
+        self.circuit_breakers: Dict[str, CircuitBreaker] = dict(circuit_breakers or {})
+
+        for source_name, rate_limiter in self.rate_limiters.items():
+            if rate_limiter.daily_budget is not None:
+                metrics.BUDGET_REMAINING.labels(source_name).set(rate_limiter.daily_budget)
+
+        for source_name, breaker in self.circuit_breakers.items():
+            metrics.BREAKER_STATE.labels(source_name).set(breaker.state.value)
+
+        # seconds past its fetch a cached reading is still served while being refreshed, 0 for never
+        self.max_staleness = max_staleness
+        self.refresh_workers = refresh_workers
+
+        # hedged lookups ask their next source past this percentile of the source's latencies
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.hedge_workers = hedge_workers
+        self.latencies = LatencyTracker()
+        self._hedger: Optional[ThreadPoolExecutor] = None
+
+        self._flights = SingleFlight()
+        self._served_at: Dict[Tuple[str, str], float] = {}
+
+        self._refresher: Optional[ThreadPoolExecutor] = None
+        self._refreshing: Set[Hashable] = set()
+        self._refresh_lock = threading.Lock()
+
+        self._sessions: Dict[str, requests.Session] = {}
+        self._sessions_lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        """Pooled session for the scheme and host of the given URL"""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+
+        with self._sessions_lock:
+            session = self._sessions.get(host)
+            if session is None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session = requests.Session()
+                session.mount(f"{host}/", adapter)
+                self._sessions[host] = session
+
+        return session
+
+    def close(self) -> None:
+        with self._refresh_lock:
+            for executor in (self._refresher, self._hedger):
+                if executor is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+            self._refresher = None
+            self._hedger = None
+
+        with self._sessions_lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
     def temperature(
         self, source: WeatherSourceProtocol, location_code: str
     ) -> TemperatureMeasurement:
@@ -26,13 +160,377 @@ class WeatherProvider:
         if source is None:
             raise AttributeError("Weather Source must be provided")
 
+        # concurrent lookups of the same location share a single request
+        with profiler.span("temperature", source=source.name, location=location_code):
+            temperature = self._flights.do(
+                (source.name, location_code), lambda: self._temperature(source, location_code)
+            )
+
+        return temperature
+
+    def _temperature(
+        self, source: WeatherSourceProtocol, location_code: str
+    ) -> TemperatureMeasurement:
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.get(source.name, location_code)
+
+            if entry is not None and entry.fresh():
+                metrics.CACHE_REQUESTS.labels(source.name, "hit").inc()
+                self._served(source, location_code, entry.fetched_at)
+                return entry.temperature
+
+            if self._servable(entry):
+                # serve the last known good reading now, the next lookup gets the refreshed one
+                metrics.CACHE_REQUESTS.labels(source.name, "stale").inc()
+                stale = entry
+                self._refresh_in_background(
+                    source,
+                    (source.name, location_code),
+                    lambda: self._fetch(source, location_code, stale),
+                )
+                self._served(source, location_code, entry.fetched_at)  # type: ignore
+                return entry.temperature  # type: ignore
+
+        temperature = self._fetch(source, location_code, entry)
+        self._served(source, location_code, time.time())
+
+        return temperature
+
+    def _fetch(
+        self, source: WeatherSourceProtocol, location_code: str, entry: Optional[CacheEntry]
+    ) -> TemperatureMeasurement:
+        resolving = isinstance(source, ResolvingWeatherSourceProtocol)
+        if resolving:
+            self._resolve(source, location_code)  # type: ignore
+
         # retrieve the formatted URL for the Weather Source
         weather_url = source.formatted_url(location_code=location_code)
 
-        result = requests.get(weather_url)
+        # partial parsing sources read the body as a stream, only as far as they need
+        stream = getattr(source, "partial_parse", False)
+
+        try:
+            result = self._get(
+                source,
+                weather_url,
+                entry.validators() if entry is not None else None,
+                stream=stream,
+            )
+        except NotFoundError:
+            # the resolved URL is gone, the next lookup resolves the location code again
+            if resolving:
+                source.invalidate(location_code)  # type: ignore
+            raise
+
+        if resolving and any(r.status_code in PERMANENT_REDIRECTS for r in result.history):
+            source.invalidate(location_code)  # type: ignore
+
+        if self.cache is not None:
+            if entry is not None and result.status_code == 304:
+                metrics.CACHE_REQUESTS.labels(source.name, "revalidated").inc()
+                self.cache.refresh(source.name, location_code)
+                return entry.temperature
+
+            metrics.CACHE_REQUESTS.labels(source.name, "miss").inc()
+
+        # parse out the temperature value from the overall results, a streamed body is read here
+        try:
+            with metrics.PARSE_LATENCY.labels(source.name).time(), profiler.span(
+                "extract_temperature", source=source.name
+            ):
+                temperature = source.extract_temperature(result)
+        except TRANSPORT_ERRORS as e:
+            self._record_failure(source)
+            raise ProcessLookupError(f"Error reading {weather_url} \nResult: {e}") from e
+        finally:
+            if stream:
+                result.close()
+
+        temperature = TemperatureMeasurement(round(temperature.value, 2), temperature.unit)
+
+        if self.cache is not None:
+            self.cache.put(
+                source.name,
+                location_code,
+                temperature,
+                etag=result.headers.get("ETag"),
+                last_modified=result.headers.get("Last-Modified"),
+            )
+
+        return temperature
+
+    def temperatures(
+        self, source: WeatherSourceProtocol, location_codes: List[str]
+    ) -> Dict[str, TemperatureMeasurement]:
+        """Temperatures for several locations of one Weather Source
+
+        Sources implementing BatchWeatherSourceProtocol are asked in as few requests as their batch
+        size allows, any other source falls back to one request per location.
+        Locations missing from a batch response are left out of the result.
+        """
+        if source is None:
+            raise AttributeError("Weather Source must be provided")
+
+        # drop duplicates but keep the configured order
+        codes = list(dict.fromkeys(location_codes))
+
+        if not isinstance(source, BatchWeatherSourceProtocol):
+            return {code: self.temperature(source, code) for code in codes}
+
+        temperatures: Dict[str, TemperatureMeasurement] = {}
+
+        if self.cache is not None:
+            # batch responses can't be revalidated, only fresh entries are reused
+            missing = []
+            stale = []
+            for code in codes:
+                entry = self.cache.get(source.name, code)
+                if entry is not None and entry.fresh():
+                    metrics.CACHE_REQUESTS.labels(source.name, "hit").inc()
+                elif self._servable(entry):
+                    metrics.CACHE_REQUESTS.labels(source.name, "stale").inc()
+                    stale.append(code)
+                else:
+                    metrics.CACHE_REQUESTS.labels(source.name, "miss").inc()
+                    missing.append(code)
+                    continue
+
+                temperatures[code] = entry.temperature  # type: ignore
+                self._served(source, code, entry.fetched_at)  # type: ignore
+            codes = missing
+
+            if stale:
+                self._refresh_in_background(
+                    source, (source.name, tuple(stale)), lambda: self._fetch_batch(source, stale)
+                )
+
+        fetched = self._fetch_batch(source, codes)
+        fetched_at = time.time()
+        for code, temperature in fetched.items():
+            temperatures[code] = temperature
+            self._served(source, code, fetched_at)
+
+        return temperatures
+
+    def _fetch_batch(
+        self, source: WeatherSourceProtocol, codes: List[str]
+    ) -> Dict[str, TemperatureMeasurement]:
+        temperatures: Dict[str, TemperatureMeasurement] = {}
+
+        batch_size = max(source.max_batch_size, 1)  # type: ignore
+        for i in range(0, len(codes), batch_size):
+            batch = codes[i : i + batch_size]
+            with profiler.span("temperatures", source=source.name, locations=str(len(batch))):
+                weather_url = source.formatted_batch_url(batch)  # type: ignore
+
+                result = self._get(source, weather_url)
+
+                with metrics.PARSE_LATENCY.labels(source.name).time(), profiler.span(
+                    "extract_temperatures", source=source.name
+                ):
+                    extracted = source.extract_temperatures(result)  # type: ignore
+
+                for code, temperature in extracted.items():
+                    temperature = TemperatureMeasurement(
+                        round(temperature.value, 2), temperature.unit
+                    )
+                    temperatures[code] = temperature
+
+                    if self.cache is not None:
+                        self.cache.put(source.name, code, temperature)
+
+        return temperatures
+
+    def temperature_hedged(
+        self,
+        candidates: Sequence[Tuple[WeatherSourceProtocol, str]],
+        on_error: Optional[Callable[[int, BaseException], None]] = None,
+    ) -> Tuple[int, TemperatureMeasurement]:
+        """Temperature of a location available from several Weather Sources
+
+        The first candidate is asked first, the next one only once the previous one has taken
+        longer than the hedge_percentile of its source's recent latencies (hedge_delay until
+        enough requests were seen), or has failed. The first answer wins.
+        on_error is called with the index and the exception of every candidate that fails.
+
+        Returns:
+            Tuple[int, TemperatureMeasurement]: index of the winning candidate and its temperature
+        """
+        if not candidates:
+            raise AttributeError("At least one Weather Source must be provided")
+
+        def attempt(index: int) -> TemperatureMeasurement:
+            try:
+                return self.temperature(*candidates[index])
+            except Exception as e:
+                if on_error is not None:
+                    on_error(index, e)
+                raise
+
+        if len(candidates) == 1:
+            return 0, attempt(0)
+
+        with self._refresh_lock:
+            if self._hedger is None:
+                self._hedger = ThreadPoolExecutor(
+                    max_workers=self.hedge_workers, thread_name_prefix="weather-hedge"
+                )
+
+        def delay(index: int) -> float:
+            threshold = self.latencies.percentile(candidates[index][0].name, self.hedge_percentile)
+            return self.hedge_delay if threshold is None else threshold
+
+        winner, temperature = hedged(
+            [functools.partial(attempt, index) for index in range(len(candidates))],
+            delay,
+            self._hedger,
+        )
+        metrics.HEDGE_WINS.labels(
+            candidates[winner][0].name, "primary" if winner == 0 else "hedge"
+        ).inc()
+
+        return winner, temperature
+
+    def fetched_at(self, source: WeatherSourceProtocol, location_code: str) -> Optional[float]:
+        """Wall clock time the last reading returned for the location was fetched at"""
+        return self._served_at.get((source.name, location_code))
+
+    def _served(self, source: WeatherSourceProtocol, location_code: str, fetched_at: float) -> None:
+        self._served_at[(source.name, location_code)] = fetched_at
+
+    def _servable(self, entry: Optional[CacheEntry]) -> bool:
+        """True for a cached reading young enough to be served while it is refreshed"""
+        return entry is not None and self.max_staleness > 0 and entry.age() <= self.max_staleness
+
+    def _refresh_in_background(
+        self, source: WeatherSourceProtocol, key: Hashable, refresh: Callable[[], object]
+    ) -> None:
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(
+                    max_workers=self.refresh_workers, thread_name_prefix="weather-refresh"
+                )
+
+        self._refresher.submit(self._run_refresh, source.name, key, refresh)
+
+    def _run_refresh(self, source_name: str, key: Hashable, refresh: Callable[[], object]) -> None:
+        logger = logging.getLogger(__name__)
+
+        try:
+            refresh()
+            metrics.BACKGROUND_REFRESHES.labels(source_name, "ok").inc()
+        except Exception as e:
+            # nobody waits on a background refresh, its failure is only logged and counted
+            metrics.BACKGROUND_REFRESHES.labels(source_name, "error").inc()
+            logger.warning("background refresh of %s failed: %s: %s", key, type(e).__name__, e)
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(key)
+
+    def _resolve(self, source: ResolvingWeatherSourceProtocol, location_code: str) -> None:
+        """Resolve a location code of the source unless it already is"""
+        resolution_url = source.resolution_url(location_code)
+        if resolution_url is None:
+            return
+
+        source.resolve(location_code, self._get(source, resolution_url))
+
+    def _get(
+        self,
+        source: WeatherSourceProtocol,
+        weather_url: str,
+        headers: Optional[Dict[str, str]] = None,
+        stream: bool = False,
+    ) -> requests.Response:
+        breaker = self.circuit_breakers.get(source.name)
+        if breaker is not None:
+            allowed = breaker.allow()
+            metrics.BREAKER_STATE.labels(source.name).set(breaker.state.value)
+            if not allowed:
+                raise ProcessLookupError(f"Circuit open for {source.name}, skipped {weather_url}")
+
+        rate_limiter = self.rate_limiters.get(source.name)
+        if rate_limiter is not None:
+            try:
+                rate_limiter.acquire()
+            except ConnectionRefusedError:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            finally:
+                if rate_limiter.daily_budget is not None:
+                    metrics.BUDGET_REMAINING.labels(source.name).set(
+                        rate_limiter.remaining_budget  # type: ignore
+                    )
+
+        if breaker is None:
+            return self._timed_request(source, weather_url, headers, stream)
+
+        # an unreachable, failing (5xx) or throttling (429) source counts against its circuit, the
+        # other refusals (4xx) are about the request and leave the circuit as it was
+        try:
+            result = self._timed_request(source, weather_url, headers, stream)
+        except (ProcessLookupError, TooManyRequestsError):
+            breaker.record_failure()
+            raise
+        except Exception:
+            breaker.release()
+            raise
+        else:
+            breaker.record_success()
+        finally:
+            metrics.BREAKER_STATE.labels(source.name).set(breaker.state.value)
+
+        return result
+
+    def _record_failure(self, source: WeatherSourceProtocol) -> None:
+        """Count a failure of the source against its circuit, outside of _get"""
+        breaker = self.circuit_breakers.get(source.name)
+        if breaker is not None:
+            breaker.record_failure()
+            metrics.BREAKER_STATE.labels(source.name).set(breaker.state.value)
+
+    def _timed_request(
+        self,
+        source: WeatherSourceProtocol,
+        weather_url: str,
+        headers: Optional[Dict[str, str]] = None,
+        stream: bool = False,
+    ) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            with profiler.span("request", source=source.name):
+                return self._request(weather_url, headers, stream)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.UPSTREAM_LATENCY.labels(source.name).observe(elapsed)
+            self.latencies.observe(source.name, elapsed)
+
+    def _request(
+        self, weather_url: str, headers: Optional[Dict[str, str]] = None, stream: bool = False
+    ) -> requests.Response:
+        try:
+            result = self.session(weather_url).get(
+                weather_url, headers=headers, timeout=self.timeout, stream=stream
+            )
+        except TRANSPORT_ERRORS as e:
+            raise ProcessLookupError(f"Error accessing {weather_url} \nResult: {e}") from e
+
+        # nothing will be read from the body of an unchanged or failed streamed response
+        if stream and result.status_code not in range(200, 300):
+            result.close()
 
         # Eval the resonse for issues
-        if result.status_code in range(400, 499):
+        if result.status_code == 404:
+            raise NotFoundError(f"Error accessing {weather_url} \nResult: {result}")
+        elif result.status_code == 429:
+            raise TooManyRequestsError(f"Error accessing {weather_url} \nResult: {result}")
+        elif result.status_code in range(400, 499):
             raise ConnectionRefusedError(f"Error accessing {weather_url} \nResult: {result}")
         elif result.status_code in range(500, 599):
             raise ProcessLookupError(f"Error accessing {weather_url} \nResult: {result}")
@@ -40,12 +538,7 @@ class WeatherProvider:
         elif result.status_code not in range(200, 399):
             raise ValueError(f"Unable to process result code: {result.status_code}")
 
-        # parse out the temperature value from the overall results
-        temperature = source.extract_temperature(result)
-
-        temperature.value = round(temperature.value, 2)
-
-        return temperature
+        return result
 
     def temperature_celsius(
         self, source: WeatherSourceProtocol, location_code: str
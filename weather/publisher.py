@@ -0,0 +1,556 @@
+"""
+Publishers sending temperature readings on to Prometheus
+
+"""
+import logging
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+from prometheus_client import push_to_gateway  # type: ignore
+from prometheus_client import CollectorRegistry, Gauge, start_http_server
+
+from weather import metrics, profiler
+from weather.readings import Reading, ReadingColumns
+from weather.utils import TemperatureMeasurement, TemperatureUnit, convert_temperature
+
+NAMESPACE = "weather"
+METRIC = "temperature"
+DESCRIPTION = "Temperature reading from weather service"
+LABELNAMES = ["source", "location"]
+
+
+class PublisherProtocol(Protocol):
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        ...
+
+    def publish(self) -> None:
+        ...
+
+
+def record_readings(publisher: PublisherProtocol, readings: Sequence[Reading]) -> None:
+    """Record readings with the publisher, all at once where it has a record_readings method"""
+    bulk = getattr(publisher, "record_readings", None)
+    if bulk is not None:
+        bulk(readings)
+        return
+
+    for reading in readings:
+        publisher.record(
+            temperature=reading.temperature,
+            location_name=reading.location,
+            weather_service=reading.source,
+        )
+
+
+def publish_cycle(publisher: PublisherProtocol) -> None:
+    """Publish the readings of a cycle
+
+    While a profile is running, a publisher with a flush method (AsyncPublisher) is waited for, so
+    the conversion and the pushes of the cycle's readings are part of the profiled cycle.
+    """
+    flush = getattr(publisher, "flush", None)
+    if flush is not None and profiler.PROFILER.active:
+        flush()
+    else:
+        publisher.publish()
+
+
+def prometheus_temperature(
+    registry: CollectorRegistry,
+    temperature: TemperatureMeasurement,
+    location_name: Optional[str] = None,
+    weather_service: Optional[str] = None,
+) -> CollectorRegistry:
+
+    gc = Gauge(
+        name=METRIC,
+        documentation=DESCRIPTION,
+        labelnames=LABELNAMES,
+        unit="celsius",
+        registry=registry,
+        namespace=NAMESPACE,
+    )
+
+    gc.labels(weather_service, location_name).set(
+        convert_temperature(orig_temperature=temperature, to_unit=TemperatureUnit.CELSIUS).value
+    )
+
+    gf = Gauge(
+        name=METRIC,
+        documentation=DESCRIPTION,
+        labelnames=LABELNAMES,
+        unit="fahrenheit",
+        registry=registry,
+        namespace=NAMESPACE,
+    )
+
+    gf.labels(weather_service, location_name).set(
+        convert_temperature(orig_temperature=temperature, to_unit=TemperatureUnit.FAHRENHEIT).value
+    )
+
+    return registry
+
+
+def push_temperature(
+    pushgateway_url: str,
+    temperature: TemperatureMeasurement,
+    location_name: Optional[str] = None,
+    weather_service: Optional[str] = None,
+) -> None:
+    registry = CollectorRegistry()
+
+    if pushgateway_url is None or pushgateway_url == "":
+        raise ValueError("Missing Pushgateway URL")
+
+    registry = prometheus_temperature(
+        registry,
+        temperature=temperature,
+        location_name=location_name,
+        weather_service=weather_service,
+    )
+
+    with metrics.PUSH_LATENCY.labels("weather").time(), profiler.span(
+        "push_to_gateway", job="weather"
+    ):
+        push_to_gateway(
+            gateway=pushgateway_url,
+            job="weather",
+            registry=registry,
+            grouping_key={"source": weather_service, "location": location_name},
+        )
+
+
+def push_monitor_metrics(
+    pushgateway_url: str, grouping_key: Optional[Dict[str, str]] = None
+) -> None:
+    """Push the weather monitor's own metrics, in a group of their own"""
+    with metrics.PUSH_LATENCY.labels("weathermonitor").time(), profiler.span(
+        "push_to_gateway", job="weathermonitor"
+    ):
+        push_to_gateway(
+            gateway=pushgateway_url,
+            job="weathermonitor",
+            registry=metrics.REGISTRY,
+            grouping_key=grouping_key,
+        )
+
+
+class TemperatureGauges:
+    """Long lived weather_temperature gauges bound to a single CollectorRegistry
+
+    Each reading only updates the labelled children, so nothing is re-registered per location
+    """
+
+    def __init__(self, registry: Optional[CollectorRegistry] = None) -> None:
+        self.registry = registry if registry is not None else CollectorRegistry()
+
+        self._celsius = Gauge(
+            name=METRIC,
+            documentation=DESCRIPTION,
+            labelnames=LABELNAMES,
+            unit="celsius",
+            registry=self.registry,
+            namespace=NAMESPACE,
+        )
+        self._fahrenheit = Gauge(
+            name=METRIC,
+            documentation=DESCRIPTION,
+            labelnames=LABELNAMES,
+            unit="fahrenheit",
+            registry=self.registry,
+            namespace=NAMESPACE,
+        )
+
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        with profiler.span("convert_temperature", unit=temperature.unit.value):
+            celsius = convert_temperature(temperature, TemperatureUnit.CELSIUS).value
+            fahrenheit = convert_temperature(temperature, TemperatureUnit.FAHRENHEIT).value
+
+        self._celsius.labels(weather_service, location_name).set(celsius)
+        self._fahrenheit.labels(weather_service, location_name).set(fahrenheit)
+
+    def record_readings(self, readings: Sequence[Reading]) -> None:
+        """Record many readings, converted together in one pass per unit"""
+        columns = ReadingColumns(readings)
+
+        with profiler.span("convert_temperatures", readings=str(len(columns))):
+            celsius = columns.values(TemperatureUnit.CELSIUS)
+            fahrenheit = columns.values(TemperatureUnit.FAHRENHEIT)
+
+        for (weather_service, location_name), c, f in zip(columns.labels(), celsius, fahrenheit):
+            self._celsius.labels(weather_service, location_name).set(c)
+            self._fahrenheit.labels(weather_service, location_name).set(f)
+
+    def remove(
+        self, location_name: Optional[str] = None, weather_service: Optional[str] = None
+    ) -> None:
+        for gauge in (self._celsius, self._fahrenheit):
+            try:
+                gauge.remove(weather_service, location_name)
+            except KeyError:
+                pass
+
+
+class LocationPushPublisher:
+    """Pushes every reading to the Pushgateway as soon as it is recorded, one group per location"""
+
+    def __init__(self, pushgateway_url: str, grouping_key: Optional[Dict[str, str]] = None) -> None:
+        if pushgateway_url is None or pushgateway_url == "":
+            raise ValueError("Missing Pushgateway URL")
+
+        self.pushgateway_url = pushgateway_url
+        # extra grouping labels of the monitor metrics, to tell apart monitors sharing a Pushgateway
+        self.grouping_key: Dict[str, str] = dict(grouping_key or {})
+
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        push_temperature(
+            pushgateway_url=self.pushgateway_url,
+            temperature=temperature,
+            location_name=location_name,
+            weather_service=weather_service,
+        )
+
+    def publish(self) -> None:
+        push_monitor_metrics(self.pushgateway_url, self.grouping_key)
+
+
+class BatchPushPublisher:
+    """Collects a cycle of readings and pushes them to the Pushgateway in a fixed number of requests
+
+    Locations are spread over the chunks by a stable hash of their labels, so each location always
+    lands in the same Pushgateway group and a push never drops another chunk's readings
+    """
+
+    def __init__(
+        self,
+        pushgateway_url: str,
+        chunks: int = 1,
+        job: str = "weather",
+        grouping_key: Optional[Dict[str, str]] = None,
+    ) -> None:
+        if pushgateway_url is None or pushgateway_url == "":
+            raise ValueError("Missing Pushgateway URL")
+        if chunks < 1:
+            raise ValueError(f"chunks must be at least 1, got {chunks}")
+
+        self.pushgateway_url = pushgateway_url
+        self.job = job
+        # extra grouping labels, to tell apart monitors sharing a Pushgateway
+        self.grouping_key: Dict[str, str] = dict(grouping_key or {})
+
+        self._chunks: List[TemperatureGauges] = [TemperatureGauges() for _ in range(chunks)]
+        self._dirty = [False] * chunks
+        self._lock = threading.Lock()
+
+    def _chunk(self, location_name: Optional[str], weather_service: Optional[str]) -> int:
+        key = f"{weather_service}\0{location_name}".encode("utf-8")
+        return zlib.crc32(key) % len(self._chunks)
+
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        chunk = self._chunk(location_name, weather_service)
+        self._chunks[chunk].record(temperature, location_name, weather_service)
+
+        with self._lock:
+            self._dirty[chunk] = True
+
+    def record_readings(self, readings: Sequence[Reading]) -> None:
+        by_chunk: Dict[int, List[Reading]] = {}
+        for reading in readings:
+            by_chunk.setdefault(self._chunk(reading.location, reading.source), []).append(reading)
+
+        for chunk, chunk_readings in by_chunk.items():
+            self._chunks[chunk].record_readings(chunk_readings)
+
+        with self._lock:
+            for chunk in by_chunk:
+                self._dirty[chunk] = True
+
+    def remove(
+        self, location_name: Optional[str] = None, weather_service: Optional[str] = None
+    ) -> None:
+        chunk = self._chunk(location_name, weather_service)
+        self._chunks[chunk].remove(location_name, weather_service)
+
+        with self._lock:
+            self._dirty[chunk] = True
+
+    def publish(self) -> None:
+        with self._lock:
+            dirty = [i for i, changed in enumerate(self._dirty) if changed]
+            self._dirty = [False] * len(self._chunks)
+
+        for i, chunk in enumerate(dirty):
+            try:
+                with metrics.PUSH_LATENCY.labels(self.job).time(), profiler.span(
+                    "push_to_gateway", job=self.job
+                ):
+                    push_to_gateway(
+                        gateway=self.pushgateway_url,
+                        job=self.job,
+                        registry=self._chunks[chunk].registry,
+                        grouping_key={**self.grouping_key, "batch": str(chunk)},
+                    )
+            except Exception:
+                # keep the unsent chunks queued for the next publish
+                with self._lock:
+                    for unsent in dirty[i:]:
+                        self._dirty[unsent] = True
+                raise
+
+        push_monitor_metrics(self.pushgateway_url, self.grouping_key)
+
+
+class ExporterPublisher:
+    """Serves the latest readings on a /metrics endpoint for Prometheus to scrape
+
+    Scrapes only read the in-memory gauges fed by the poll loop, they never reach a weather source.
+    The monitor's own metrics are served from monitor_metrics, metrics.REGISTRY by default.
+    """
+
+    def __init__(
+        self,
+        port: int,
+        address: str = "0.0.0.0",
+        registry: Optional[CollectorRegistry] = None,
+        monitor_metrics: Any = None,
+    ) -> None:
+        self.port = port
+        self.address = address
+
+        self._gauges = TemperatureGauges(registry)
+        self._gauges.registry.register(
+            monitor_metrics if monitor_metrics is not None else metrics.REGISTRY
+        )
+        self._started = False
+
+    @property
+    def registry(self) -> CollectorRegistry:
+        return self._gauges.registry
+
+    def start(self) -> None:
+        if not self._started:
+            start_http_server(self.port, addr=self.address, registry=self.registry)
+            self._started = True
+
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        self._gauges.record(temperature, location_name, weather_service)
+
+    def record_readings(self, readings: Sequence[Reading]) -> None:
+        self._gauges.record_readings(readings)
+
+    def remove(
+        self, location_name: Optional[str] = None, weather_service: Optional[str] = None
+    ) -> None:
+        self._gauges.remove(location_name, weather_service)
+
+    def publish(self) -> None:
+        pass
+
+
+class AsyncPublisher:
+    """Bounded background stage between the poll loop and a publisher that does network I/O
+
+    Readings are queued per (source, location), a newer reading replaces the one still waiting.
+    A worker thread hands them to the wrapped publisher once flush_size are waiting,
+    flush_interval seconds have passed or publish is called. Failed flushes are retried with an
+    exponential backoff up to max_retry_delay seconds, so neither a slow nor an unreachable
+    Pushgateway holds up the lookups.
+    """
+
+    def __init__(
+        self,
+        publisher: PublisherProtocol,
+        max_pending: int = 10000,
+        flush_interval: float = 1.0,
+        flush_size: int = 500,
+        max_retry_delay: float = 60.0,
+    ) -> None:
+        if max_pending < 1:
+            raise ValueError(f"max_pending must be at least 1, got {max_pending}")
+
+        self.publisher = publisher
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_retry_delay = max_retry_delay
+
+        # (source, location) -> reading to record, None to remove the location
+        self._pending: Dict[Tuple[Optional[str], Optional[str]], Optional[Reading]] = {}
+        self._publish_due = False
+        self._closed = False
+        self._condition = threading.Condition()
+        # flush calls so far, and how many of them the worker is done with
+        self._flush_requests = 0
+        self._flushes_done = 0
+        self._flushed = threading.Condition()
+
+        self._worker = threading.Thread(target=self._run, name="weather-publisher", daemon=True)
+        self._worker.start()
+
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        reading = Reading.of(temperature, weather_service, location_name)  # type: ignore
+        self.record_readings([reading])
+
+    def record_readings(self, readings: Sequence[Reading]) -> None:
+        with self._condition:
+            for reading in readings:
+                key = (reading.source, reading.location)
+                if key in self._pending:
+                    metrics.PUBLISH_DROPS.labels("coalesced").inc()
+                elif len(self._pending) >= self.max_pending:
+                    metrics.PUBLISH_DROPS.labels("overflow").inc()
+                    continue
+
+                self._pending[key] = reading
+
+            metrics.PUBLISH_QUEUE_DEPTH.set(len(self._pending))
+
+            if len(self._pending) >= self.flush_size:
+                self._condition.notify()
+
+    def remove(
+        self, location_name: Optional[str] = None, weather_service: Optional[str] = None
+    ) -> None:
+        with self._condition:
+            # removals are never dropped, they may go over max_pending
+            self._pending[(weather_service, location_name)] = None
+            metrics.PUBLISH_QUEUE_DEPTH.set(len(self._pending))
+
+    def publish(self) -> None:
+        """Ask for a flush, without waiting for it"""
+        with self._condition:
+            self._publish_due = True
+            self._condition.notify()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Ask for a flush and wait for it, returns False if it is not done within timeout
+
+        A failed flush counts as done, its readings are retried after the backoff.
+        """
+        with self._condition:
+            self._flush_requests += 1
+            request = self._flush_requests
+            self._publish_due = True
+            self._condition.notify()
+
+        with self._flushed:
+            return self._flushed.wait_for(lambda: self._flushes_done >= request, timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Flush what is queued, then stop the worker"""
+        with self._condition:
+            self._closed = True
+            self._publish_due = True
+            self._condition.notify()
+
+        self._worker.join(timeout)
+
+    def _run(self) -> None:
+        logger = logging.getLogger(__name__)
+        retry_delay = 0.0
+
+        while True:
+            with self._condition:
+                if retry_delay > 0:
+                    # back off, only closing cuts the wait short
+                    retry_at = time.monotonic() + retry_delay
+                    while not self._closed and time.monotonic() < retry_at:
+                        self._condition.wait(retry_at - time.monotonic())
+                elif not self._flush_ready():
+                    self._condition.wait(self.flush_interval)
+
+                closed = self._closed
+                flush_requests = self._flush_requests
+                pending = self._pending
+                self._pending = {}
+                publish_due = self._publish_due or bool(pending)
+                self._publish_due = False
+                metrics.PUBLISH_QUEUE_DEPTH.set(0)
+
+            if publish_due:
+                try:
+                    self._flush(pending)
+                    retry_delay = 0.0
+                except Exception as e:
+                    metrics.PUBLISH_FAILURES.inc()
+                    retry_delay = min(max(retry_delay * 2, 1.0), self.max_retry_delay)
+                    logger.warning("publish failed, retrying in %s seconds: %s", retry_delay, e)
+
+                with self._flushed:
+                    self._flushes_done = flush_requests
+                    self._flushed.notify_all()
+
+            if closed:
+                return
+
+    def _flush_ready(self) -> bool:
+        return self._closed or self._publish_due or len(self._pending) >= self.flush_size
+
+    def _flush(self, pending: Dict[Tuple[Optional[str], Optional[str]], Optional[Reading]]) -> None:
+        items = [(key, reading) for key, reading in pending.items() if reading is None]
+
+        remove = getattr(self.publisher, "remove", None)
+        for i, ((weather_service, location_name), _) in enumerate(items):
+            try:
+                if remove is not None:
+                    remove(location_name=location_name, weather_service=weather_service)
+            except Exception:
+                self._requeue(items[i:])
+                raise
+
+        # the readings are handed over together, for the publisher to convert them in bulk
+        items = [(key, reading) for key, reading in pending.items() if reading is not None]
+        try:
+            record_readings(self.publisher, [reading for _, reading in items])  # type: ignore
+        except Exception:
+            self._requeue(items)
+            raise
+
+        try:
+            self.publisher.publish()
+        except Exception:
+            with self._condition:
+                self._publish_due = True
+            raise
+
+    def _requeue(
+        self, items: List[Tuple[Tuple[Optional[str], Optional[str]], Optional[Reading]]]
+    ) -> None:
+        """Put back the readings of a failed flush, unless a newer one came in meanwhile"""
+        with self._condition:
+            for key, reading in items:
+                self._pending.setdefault(key, reading)
+            self._publish_due = True
+            metrics.PUBLISH_QUEUE_DEPTH.set(len(self._pending))
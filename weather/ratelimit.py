@@ -0,0 +1,134 @@
+"""
+Rate limiting of the requests sent to a Weather Source
+
+"""
+import datetime
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class RateLimiter:
+    """Token bucket limiting the request rate to a Weather Source, with an optional daily budget
+
+    Requests over the rate wait for their token rather than failing, which spaces them evenly
+    instead of sending them in bursts. Once the daily budget (UTC day) is spent, requests are
+    refused until the next day. Without a rate only the daily budget is enforced.
+
+    A scheduler can take a request's token ahead with reserve(), wait for it without holding a
+    thread, and then run the request with run_reserved() so its acquire() doesn't wait again.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: Optional[float] = None,
+        burst: float = 1.0,
+        daily_budget: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate_per_minute is not None and rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute must be positive, got {rate_per_minute}")
+        if burst < 1:
+            raise ValueError(f"burst must be at least 1, got {burst}")
+
+        self.rate = rate_per_minute / 60 if rate_per_minute is not None else None
+        self.burst = burst
+        self.daily_budget = daily_budget
+
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        self._tokens = burst
+        self._updated = clock()
+        # callback of the token reserved for the task running on this thread, see run_reserved
+        self._reserved = threading.local()
+
+        self._day = self._today()
+        self._used_today = 0
+
+    @staticmethod
+    def _today() -> datetime.date:
+        return datetime.datetime.now(datetime.timezone.utc).date()
+
+    @property
+    def remaining_budget(self) -> Optional[int]:
+        """Requests left in today's budget, None without a daily budget"""
+        if self.daily_budget is None:
+            return None
+
+        with self._lock:
+            if self._day != self._today():
+                return self.daily_budget
+
+            return max(self.daily_budget - self._used_today, 0)
+
+    def acquire(self) -> None:
+        """Wait until a request may be sent
+
+        Raises:
+            ConnectionRefusedError: If the daily budget is spent
+        """
+        with self._lock:
+            today = self._today()
+            if self._day != today:
+                self._day = today
+                self._used_today = 0
+
+            if self.daily_budget is not None and self._used_today >= self.daily_budget:
+                raise ConnectionRefusedError(
+                    f"Daily budget of {self.daily_budget} requests spent,"
+                    " refusing until tomorrow (UTC)"
+                )
+            self._used_today += 1
+
+            spent = getattr(self._reserved, "spent", None)
+            self._reserved.spent = None
+            if spent is None:
+                if self.rate is None:
+                    return
+                wait = self._take(self.rate)
+
+        if spent is not None:
+            # the token was taken by reserve() before the task was started
+            spent()
+        elif wait > 0:
+            self._sleep(wait)
+
+    def _take(self, rate: float) -> float:
+        # called with the lock held: take a token, returns the seconds until it is due
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+
+        # reserve the token now, concurrent callers queue up behind it
+        self._tokens -= 1
+        return -self._tokens / rate if self._tokens < 0 else 0.0
+
+    def reserve(self) -> float:
+        """Take the token of a request to be run later with run_reserved, returns the seconds
+        until the token is due (0 without a rate)"""
+        if self.rate is None:
+            return 0.0
+
+        with self._lock:
+            return self._take(self.rate)
+
+    def run_reserved(self, task: Callable[[], T], spent: Callable[[], None]) -> T:
+        """Run task, its first acquire() on this thread uses the token taken by reserve()
+
+        spent is called once the token is used, or given back because task sent no request
+        """
+        self._reserved.spent = spent
+        try:
+            return task()
+        finally:
+            unused = self._reserved.spent
+            self._reserved.spent = None
+            if unused is not None:
+                with self._lock:
+                    self._tokens = min(self.burst, self._tokens + 1)
+                unused()
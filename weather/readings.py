@@ -0,0 +1,114 @@
+"""
+Reading records: temperatures tagged with where and when they were fetched
+
+"""
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from weather.utils import TemperatureMeasurement, TemperatureUnit, convert_temperatures
+
+_UNITS: Tuple[TemperatureUnit, ...] = tuple(TemperatureUnit)
+_UNIT_CODES: Dict[TemperatureUnit, int] = {unit: i for i, unit in enumerate(_UNITS)}
+
+
+class Reading(NamedTuple):
+    """A single temperature reading of a location"""
+
+    value: float
+    unit: TemperatureUnit
+    # Prometheus label values of the reading
+    source: str
+    location: str
+    # wall clock time (time.time()) the reading was fetched at
+    fetched_at: float
+
+    @classmethod
+    def of(
+        cls,
+        temperature: TemperatureMeasurement,
+        source: str,
+        location: str,
+        fetched_at: Optional[float] = None,
+    ) -> "Reading":
+        return cls(
+            temperature.value,
+            temperature.unit,
+            source,
+            location,
+            time.time() if fetched_at is None else fetched_at,
+        )
+
+    @property
+    def temperature(self) -> TemperatureMeasurement:
+        return TemperatureMeasurement(self.value, self.unit)
+
+
+class ReadingColumns:
+    """Many readings stored column by column in typed arrays
+
+    Values, units and fetch times take a few bytes per reading instead of an object each, the
+    (source, location) labels are kept once in a table and referenced by index.
+    """
+
+    __slots__ = ("_values", "_units", "_labels", "_fetched_at", "_label_table", "_label_index")
+
+    def __init__(self, readings: Iterable[Reading] = ()) -> None:
+        self._values = array("d")
+        self._units = array("B")
+        self._labels = array("I")
+        self._fetched_at = array("d")
+
+        self._label_table: List[Tuple[str, str]] = []
+        self._label_index: Dict[Tuple[str, str], int] = {}
+
+        self.extend(readings)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __getitem__(self, index: int) -> Reading:
+        source, location = self._label_table[self._labels[index]]
+
+        return Reading(
+            self._values[index],
+            _UNITS[self._units[index]],
+            source,
+            location,
+            self._fetched_at[index],
+        )
+
+    def __iter__(self) -> Iterator[Reading]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, reading: Reading) -> None:
+        labels = (reading.source, reading.location)
+        label = self._label_index.get(labels)
+        if label is None:
+            label = self._label_index[labels] = len(self._label_table)
+            self._label_table.append(labels)
+
+        self._values.append(reading.value)
+        self._units.append(_UNIT_CODES[reading.unit])
+        self._labels.append(label)
+        self._fetched_at.append(reading.fetched_at)
+
+    def extend(self, readings: Iterable[Reading]) -> None:
+        for reading in readings:
+            self.append(reading)
+
+    def values(self, to_unit: Optional[TemperatureUnit] = None, decimals: int = 2) -> List[float]:
+        """Every reading's value, converted to to_unit in one bulk conversion when given"""
+        if to_unit is None:
+            return self._values.tolist()
+
+        units = [_UNITS[code] for code in self._units]
+        return convert_temperatures(self._values, units, to_unit, decimals)
+
+    def labels(self) -> List[Tuple[str, str]]:
+        """Every reading's (source, location) labels"""
+        return [self._label_table[label] for label in self._labels]
+
+    def fetched_at(self) -> List[float]:
+        return self._fetched_at.tolist()
@@ -0,0 +1,112 @@
+"""
+Scheduler deciding when each lookup of the poll plan is due
+
+"""
+import heapq
+import itertools
+import random
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from weather.plan import Lookup
+
+
+class PollScheduler:
+    """Priority queue of poll plan lookups ordered by their next due time
+
+    Each lookup runs on its own interval: its locations' interval, else the interval of its
+    service, else the default. A random jitter spreads the lookups so they don't all fire at once.
+    Failing services are retried with an exponential backoff that only applies to that service.
+    """
+
+    def __init__(
+        self,
+        default_interval: float,
+        service_intervals: Optional[Dict[str, float]] = None,
+        jitter: float = 0.0,
+        max_backoff: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if default_interval <= 0:
+            raise ValueError(f"default_interval must be positive, got {default_interval}")
+        if jitter < 0:
+            raise ValueError(f"jitter can not be negative, got {jitter}")
+
+        self.default_interval = default_interval
+        self.service_intervals: Dict[str, float] = dict(service_intervals or {})
+        self.jitter = jitter
+        self.max_backoff = max_backoff if max_backoff is not None else default_interval * 4
+        self.clock = clock
+
+        self._queue: List[Tuple[float, int, Lookup]] = []
+        self._sequence = itertools.count()
+        # consecutive failed rounds per service
+        self._failures: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def interval(self, lookup: Lookup) -> float:
+        if lookup.interval is not None:
+            return lookup.interval
+
+        return self.service_intervals.get(lookup.service, self.default_interval)
+
+    def backoff(self, lookup: Lookup) -> float:
+        """Delay before retrying a lookup of a failing service
+
+        Starts at half the lookup's interval and doubles with every consecutive failed round
+        """
+        failures = max(self._failures.get(lookup.service, 1), 1)
+        delay = self.interval(lookup) / 2 * 2 ** (failures - 1)
+
+        return min(delay, max(self.max_backoff, self.interval(lookup) / 2))
+
+    def _push(self, lookup: Lookup, due: float) -> None:
+        heapq.heappush(self._queue, (due, next(self._sequence), lookup))
+
+    def _jitter(self) -> float:
+        return random.uniform(0, self.jitter) if self.jitter > 0 else 0.0
+
+    def replace(self, lookups: Iterable[Lookup]) -> None:
+        """Schedule a new set of lookups, all due now (plus jitter)"""
+        now = self.clock()
+
+        self._queue = []
+        for lookup in lookups:
+            self._push(lookup, now + self._jitter())
+
+    def due(self) -> List[Lookup]:
+        """Remove and return every lookup whose due time has passed"""
+        now = self.clock()
+
+        lookups = []
+        while self._queue and self._queue[0][0] <= now:
+            lookups.append(heapq.heappop(self._queue)[2])
+
+        return lookups
+
+    def next_due(self) -> Optional[float]:
+        return self._queue[0][0] if self._queue else None
+
+    def complete(self, outcomes: Iterable[Tuple[Lookup, bool]]) -> None:
+        """Reschedule a round of lookups
+
+        Args:
+            outcomes (Iterable[Tuple[Lookup, bool]]): each lookup run, paired with True when its
+                service asked for a retry
+        """
+        outcomes = list(outcomes)
+
+        # a service counts one failed round, however many of its lookups failed
+        failed_services = {lookup.service for lookup, retry in outcomes if retry}
+        for service in {lookup.service for lookup, _ in outcomes}:
+            if service in failed_services:
+                self._failures[service] = self._failures.get(service, 0) + 1
+            else:
+                self._failures.pop(service, None)
+
+        now = self.clock()
+        for lookup, retry in outcomes:
+            delay = self.backoff(lookup) if retry else self.interval(lookup)
+            self._push(lookup, now + delay + self._jitter())
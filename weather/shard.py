@@ -0,0 +1,329 @@
+"""
+Sharding of the poll plan over worker processes and hosts
+
+"""
+import bisect
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from prometheus_client import push_to_gateway  # type: ignore
+from prometheus_client.metrics_core import Metric  # type: ignore
+
+from weather import metrics, profiler
+from weather.publisher import PublisherProtocol, publish_cycle, record_readings
+from weather.readings import Reading
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+
+
+def _hash(key: str) -> int:
+    # stable across processes and hosts, unlike hash()
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping (service, location_code) lookups onto shard_count shards
+
+    Each shard owns replicas points of the ring, so lookups spread evenly and changing the
+    number of shards only moves the lookups of the shards added or removed.
+    """
+
+    def __init__(self, shard_count: int, replicas: int = 64) -> None:
+        if shard_count < 1:
+            raise ValueError(f"shard_count must be at least 1, got {shard_count}")
+
+        self.shard_count = shard_count
+
+        points = sorted(
+            (_hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(shard_count)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard(self, service: str, location_code: str) -> int:
+        if self.shard_count == 1:
+            return 0
+
+        i = bisect.bisect(self._points, _hash(f"{service}\0{location_code}"))
+        return self._shards[i % len(self._shards)]
+
+
+@functools.lru_cache(maxsize=8)
+def hash_ring(shard_count: int) -> HashRing:
+    return HashRing(shard_count)
+
+
+class ShardMetrics:
+    """Collector serving this process's monitor metrics along with those of its shard workers
+
+    The workers' metrics are the ones they last forwarded, labelled with their shard.
+    """
+
+    def __init__(self, registry: Any = None) -> None:
+        self.registry = registry if registry is not None else metrics.REGISTRY
+
+        self._lock = threading.Lock()
+        # shard index => metric families last collected by its worker
+        self._shards: Dict[int, List[Metric]] = {}
+
+    def update(self, shard_index: int, families: List[Metric]) -> None:
+        with self._lock:
+            self._shards[shard_index] = families
+
+    def collect(self) -> Iterator[Metric]:
+        families: Dict[str, Metric] = {}
+        for family in self.registry.collect():
+            families[family.name] = family
+
+        with self._lock:
+            shards = sorted(self._shards.items())
+
+        for shard_index, shard_families in shards:
+            for family in shard_families:
+                merged = families.get(family.name)
+                if merged is None:
+                    merged = Metric(family.name, family.documentation, family.type, family.unit)
+                    families[family.name] = merged
+
+                merged.samples.extend(
+                    sample._replace(labels={**sample.labels, "shard": str(shard_index)})
+                    for sample in family.samples
+                )
+
+        return iter(families.values())
+
+
+class QueuePublisher:
+    """Worker side of a sharded monitor: hands the readings to the supervisor's publisher
+
+    With a Pushgateway URL, publish also pushes the worker's own monitor metrics, grouped by
+    grouping_key ({"shard": shard_index} by default). With forward_metrics they are handed to the
+    supervisor instead, to be served by its exporter.
+    """
+
+    def __init__(
+        self,
+        queue: Any,
+        shard_index: int,
+        pushgateway_url: Optional[str] = None,
+        forward_metrics: bool = False,
+        grouping_key: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.queue = queue
+        self.shard_index = shard_index
+        self.pushgateway_url = pushgateway_url
+        self.forward_metrics = forward_metrics
+        self.grouping_key: Dict[str, str] = (
+            dict(grouping_key) if grouping_key is not None else {"shard": str(shard_index)}
+        )
+
+    def record(
+        self,
+        temperature: TemperatureMeasurement,
+        location_name: Optional[str] = None,
+        weather_service: Optional[str] = None,
+    ) -> None:
+        self.queue.put(
+            ("record", weather_service, location_name, temperature.value, temperature.unit.value)
+        )
+
+    def record_readings(self, readings: Sequence[Reading]) -> None:
+        # a lookup's readings travel together, in a single message
+        self.queue.put(("readings", list(readings)))
+
+    def remove(
+        self, location_name: Optional[str] = None, weather_service: Optional[str] = None
+    ) -> None:
+        self.queue.put(("remove", weather_service, location_name))
+
+    def publish(self) -> None:
+        self.queue.put(("publish", self.shard_index))
+
+        if self.forward_metrics:
+            self.queue.put(("metrics", self.shard_index, list(metrics.REGISTRY.collect())))
+
+        if self.pushgateway_url:
+            with metrics.PUSH_LATENCY.labels("weathermonitor").time(), profiler.span(
+                "push_to_gateway", job="weathermonitor"
+            ):
+                push_to_gateway(
+                    gateway=self.pushgateway_url,
+                    job="weathermonitor",
+                    registry=metrics.REGISTRY,
+                    grouping_key=self.grouping_key,
+                )
+
+
+def report_started(queue: Any, worker: int) -> None:
+    """Tell the supervisor a worker installed its signal handlers"""
+    queue.put(("started", worker, os.getpid()))
+
+
+class ShardSupervisor:
+    """Runs one poll loop worker process per shard and merges their readings into one publisher
+
+    target is called in each worker process with the worker's index and the queue to give to its
+    QueuePublisher. Workers that exit are started again, right away if they had called
+    report_started, otherwise after a delay doubling up to max_restart_delay seconds, a worker
+    failing on its config would else be restarted every second. The metrics the workers forward
+    are kept by shard_metrics. Signals are only passed on to the workers that called
+    report_started, a worker still starting would be killed by a signal it has no handler for yet.
+    """
+
+    def __init__(
+        self,
+        publisher: PublisherProtocol,
+        target: Callable[[int, Any], None],
+        workers: int,
+        context: Any = None,
+        shard_metrics: Optional[ShardMetrics] = None,
+        max_restart_delay: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+
+        self.publisher = publisher
+        self.target = target
+        self.workers = workers
+        self.shard_metrics = shard_metrics
+        self.max_restart_delay = max_restart_delay
+        self.clock = clock
+
+        # spawned workers don't inherit the supervisor's threads and open sockets
+        self._context = context if context is not None else multiprocessing.get_context("spawn")
+        self.queue = self._context.Queue()
+        self._processes: List[Any] = [None] * workers
+        self._started = [False] * workers
+        # delay before restarting a worker that exited before it started, and when that is due
+        self._restart_delays = [0.0] * workers
+        self._restart_at: List[Optional[float]] = [None] * workers
+
+    def _start(self, worker: int) -> None:
+        process = self._context.Process(
+            target=self.target, args=(worker, self.queue), name=f"weathermonitor-shard-{worker}"
+        )
+        process.daemon = True
+        self._started[worker] = False
+        process.start()
+        self._processes[worker] = process
+
+    def _check_workers(self) -> None:
+        logger = logging.getLogger(__name__)
+        now = self.clock()
+
+        for worker, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+
+            if self._restart_at[worker] is None:
+                if self._started[worker]:
+                    self._restart_delays[worker] = 0.0
+                    logger.error(
+                        "shard worker %d exited with %s, restarting it", worker, process.exitcode
+                    )
+                else:
+                    self._restart_delays[worker] = min(
+                        max(self._restart_delays[worker] * 2, 1.0), self.max_restart_delay
+                    )
+                    logger.error(
+                        "shard worker %d exited with %s before it started, restarting it in %.0f s",
+                        worker,
+                        process.exitcode,
+                        self._restart_delays[worker],
+                    )
+                self._restart_at[worker] = now + self._restart_delays[worker]
+
+            if now >= self._restart_at[worker]:  # type: ignore
+                self._restart_at[worker] = None
+                self._start(worker)
+
+    def dispatch(self, message: Tuple) -> None:
+        """Apply a worker message to the publisher"""
+        kind = message[0]
+
+        if kind == "record":
+            _, weather_service, location_name, value, unit = message
+            self.publisher.record(
+                temperature=TemperatureMeasurement(value, TemperatureUnit(unit)),
+                location_name=location_name,
+                weather_service=weather_service,
+            )
+        elif kind == "readings":
+            record_readings(self.publisher, message[1])
+        elif kind == "remove":
+            remove = getattr(self.publisher, "remove", None)
+            if remove is not None:
+                remove(location_name=message[2], weather_service=message[1])
+        elif kind == "publish":
+            # a profiled cycle of the supervisor is the publishing of one worker's cycle
+            with profiler.PROFILER.cycle(shard=str(message[1])):
+                publish_cycle(self.publisher)
+        elif kind == "started":
+            # a report of a worker that exited since is left out
+            _, worker, pid = message
+            process = self._processes[worker]
+            if process is not None and process.pid == pid:
+                self._started[worker] = True
+        elif kind == "metrics":
+            if self.shard_metrics is not None:
+                self.shard_metrics.update(message[1], message[2])
+
+    def signal_workers(self, signum: int) -> None:
+        logger = logging.getLogger(__name__)
+
+        for worker, process in enumerate(self._processes):
+            if not self._started[worker]:
+                logger.warning(
+                    "shard worker %d is still starting, not sending it %s", worker, signum
+                )
+            elif process is not None and process.is_alive() and process.pid is not None:
+                os.kill(process.pid, signum)
+
+    def run(self, reload: Optional[threading.Event] = None) -> None:
+        """Start the workers and publish their readings, until interrupted
+
+        Args:
+            reload (Optional[threading.Event]): when set, the workers are asked to reload their
+                locations with SIGHUP
+        """
+        for worker in range(self.workers):
+            self._start(worker)
+
+        next_check = time.monotonic() + 1.0
+        try:
+            while True:
+                if reload is not None and reload.is_set():
+                    reload.clear()
+                    if hasattr(signal, "SIGHUP"):
+                        self.signal_workers(signal.SIGHUP)
+
+                if time.monotonic() >= next_check:
+                    self._check_workers()
+                    next_check = time.monotonic() + 1.0
+
+                try:
+                    message = self.queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+
+                self.dispatch(message)
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=5)
@@ -0,0 +1,221 @@
+"""
+On-disk state of the response cache, so a restarted monitor starts warm
+
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import IO, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from weather.utils import TemperatureMeasurement, TemperatureUnit
+
+
+class StateRecord(NamedTuple):
+    """Latest reading of a lookup with the HTTP validators to revalidate it with"""
+
+    source: str
+    location_code: str
+    temperature: TemperatureMeasurement
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # wall clock time (time.time()) the reading was fetched or last revalidated at
+    fetched_at: float
+
+
+def _encode(record: StateRecord) -> str:
+    return json.dumps(
+        {
+            "source": record.source,
+            "code": record.location_code,
+            "value": record.temperature.value,
+            "unit": record.temperature.unit.value,
+            "etag": record.etag,
+            "last_modified": record.last_modified,
+            "fetched_at": record.fetched_at,
+        },
+        separators=(",", ":"),
+    )
+
+
+def _encode_removal(key: Tuple[str, str]) -> str:
+    return json.dumps({"source": key[0], "code": key[1], "removed": True}, separators=(",", ":"))
+
+
+def _decode(line: str) -> Union[StateRecord, Tuple[str, str]]:
+    """The record of a line, or the (source, location code) of a removed lookup"""
+    data = json.loads(line)
+    if data.get("removed"):
+        return (str(data["source"]), str(data["code"]))
+
+    return StateRecord(
+        source=data["source"],
+        location_code=data["code"],
+        temperature=TemperatureMeasurement(data["value"], TemperatureUnit(data["unit"])),
+        etag=data.get("etag"),
+        last_modified=data.get("last_modified"),
+        fetched_at=float(data["fetched_at"]),
+    )
+
+
+class StateStore:
+    """Append-only JSON lines log of StateRecords, the last record of a lookup wins
+
+    Updates are written by a background thread, so the lookups never wait on the disk: the
+    records appended meanwhile are written together, flush_interval seconds after the first of
+    them, the latest one per lookup only. Once the log holds compact_ratio times more lines than
+    lookups (and at least min_compact lines) it is rewritten with only the latest records,
+    through a temporary file so a crash never leaves a partial state file behind. Removed lookups
+    are left out of the next compaction.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compact_ratio: float = 4.0,
+        min_compact: int = 1024,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.min_compact = min_compact
+        self.flush_interval = flush_interval
+
+        self._records: Dict[Tuple[str, str], StateRecord] = {}
+        # lookup => record left to write, None for a removal left to write
+        self._pending: Dict[Tuple[str, str], Optional[StateRecord]] = {}
+        self._lines = 0
+        self._file: Optional[IO[str]] = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+
+    def load(self) -> List[StateRecord]:
+        """Read the state file, oldest record first, and compact it
+
+        Lines that can't be decoded, like one cut short by a crash, are skipped
+        """
+        logger = logging.getLogger(__name__)
+
+        with self._condition:
+            self._records = {}
+            try:
+                with open(self.path, encoding="utf-8") as state_file:
+                    for number, line in enumerate(state_file, start=1):
+                        try:
+                            record = _decode(line)
+                        except (ValueError, KeyError, TypeError) as e:
+                            logger.warning(
+                                "skipping unreadable line %d of %s: %s", number, self.path, e
+                            )
+                            continue
+
+                        if isinstance(record, StateRecord):
+                            self._records[(record.source, record.location_code)] = record
+                        else:
+                            self._records.pop(record, None)
+            except FileNotFoundError:
+                pass
+
+            self._compact(list(self._records.values()))
+
+            return sorted(self._records.values(), key=lambda record: record.fetched_at)
+
+    def append(self, record: StateRecord) -> None:
+        key = (record.source, record.location_code)
+
+        with self._condition:
+            self._records[key] = record
+            self._queue(key, record)
+
+    def remove(self, source: str, location_code: str) -> None:
+        """Forget a lookup, like one evicted from the cache"""
+        key = (source, location_code)
+
+        with self._condition:
+            if self._records.pop(key, None) is not None:
+                self._queue(key, None)
+
+    def _queue(self, key: Tuple[str, str], record: Optional[StateRecord]) -> None:
+        # called with the condition held
+        self._pending[key] = record
+
+        if self._writer is None and not self._closed:
+            self._writer = threading.Thread(target=self._run, name="weather-state", daemon=True)
+            self._writer.start()
+
+        self._condition.notify()
+
+    def _run(self) -> None:
+        logger = logging.getLogger(__name__)
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed or bool(self._pending))
+
+                # let the rest of the cycle's updates come in, only closing cuts the wait short
+                flush_at = time.monotonic() + self.flush_interval
+                while not self._closed and time.monotonic() < flush_at:
+                    self._condition.wait(flush_at - time.monotonic())
+
+                closed = self._closed
+                pending, self._pending = self._pending, {}
+                compact = self._lines + len(pending) >= max(
+                    self.min_compact, len(self._records) * self.compact_ratio
+                )
+                records = list(self._records.values()) if compact else []
+
+            try:
+                if compact:
+                    self._compact(records)
+                elif pending:
+                    self._write(pending)
+            except OSError as e:
+                # the records are kept, the next compaction writes them
+                logger.error("writing the state file %s failed: %s", self.path, e)
+
+            if closed:
+                return
+
+    def _write(self, pending: Dict[Tuple[str, str], Optional[StateRecord]]) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+
+        self._file.write(
+            "".join(
+                (_encode(record) if record is not None else _encode_removal(key)) + "\n"
+                for key, record in pending.items()
+            )
+        )
+        self._file.flush()
+        self._lines += len(pending)
+
+    def _compact(self, records: List[StateRecord]) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as state_file:
+            for record in records:
+                state_file.write(_encode(record) + "\n")
+            state_file.flush()
+            os.fsync(state_file.fileno())
+
+        os.replace(temporary, self.path)
+        self._lines = len(records)
+
+    def close(self) -> None:
+        """Write what is left to write, then stop the writer"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            writer = self._writer
+
+        if writer is not None:
+            writer.join()
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -3,9 +3,17 @@ Utility objects for use with Weather functionality
 
 """
 
+import codecs
+import json
+import re
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # the bulk conversions fall back to plain Python
+    np = None  # type: ignore
 
 
 class TemperatureUnit(Enum):
@@ -16,14 +24,44 @@ class TemperatureUnit(Enum):
     KELVIN = "K"
 
 
-@dataclass
+@dataclass(frozen=True)
 class TemperatureMeasurement:
+    """An immutable temperature reading, safe to share between the cache and its callers"""
+
+    __slots__ = ("value", "unit")
+
     value: float
     unit: TemperatureUnit
 
     def __repr__(self) -> str:
         return f"{self.value} {self.unit.value}"
 
+    def __reduce__(self):
+        # frozen slots can't be restored by the default pickle/copy protocol
+        return (TemperatureMeasurement, (self.value, self.unit))
+
+
+# value_to = value_from * scale + offset, per (from unit, to unit) pair
+_AFFINE: Dict[Tuple[TemperatureUnit, TemperatureUnit], Tuple[float, float]] = {
+    (TemperatureUnit.FAHRENHEIT, TemperatureUnit.CELSIUS): (1 / 1.8, -32 / 1.8),
+    (TemperatureUnit.KELVIN, TemperatureUnit.CELSIUS): (1.0, -273.15),
+    (TemperatureUnit.KELVIN, TemperatureUnit.FAHRENHEIT): (1.8, -459.67),
+    (TemperatureUnit.CELSIUS, TemperatureUnit.FAHRENHEIT): (1.8, 32.0),
+    (TemperatureUnit.FAHRENHEIT, TemperatureUnit.KELVIN): (1 / 1.8, 459.67 / 1.8),
+    (TemperatureUnit.CELSIUS, TemperatureUnit.KELVIN): (1.0, 273.15),
+}
+for _unit in TemperatureUnit:
+    _AFFINE[(_unit, _unit)] = (1.0, 0.0)
+
+_ALLOWED = frozenset(TemperatureUnit)
+
+_UNIT_INDEX: Dict[TemperatureUnit, int] = {unit: i for i, unit in enumerate(TemperatureUnit)}
+
+if np is not None:
+    # scale and offset tables indexed by [from unit index, to unit index]
+    _SCALES = np.array([[_AFFINE[(f, t)][0] for t in TemperatureUnit] for f in TemperatureUnit])
+    _OFFSETS = np.array([[_AFFINE[(f, t)][1] for t in TemperatureUnit] for f in TemperatureUnit])
+
 
 def convert_temperature(
     orig_temperature: TemperatureMeasurement, to_unit: TemperatureUnit
@@ -31,56 +69,159 @@ def convert_temperature(
     """Convert temperatures between two units of measure
 
     Args:
-        temperature (float): Temperature to be converted
-        from_unit (TemperatureUnit): Conversion from unit of measure (Enum from TemperatureUnit)
-        to_unit (TemperatureUnit): Conversion from unit of measure (Enum from TemperatureUnit)
+        orig_temperature (TemperatureMeasurement): Temperature to be converted
+        to_unit (TemperatureUnit): Conversion to unit of measure (Enum from TemperatureUnit)
 
     Raises:
         ValueError: If an invalid/unknown temperature unit is provided for conversion
 
     Returns:
-        float: The converted temerature value in the to_unit unit of measure
+        TemperatureMeasurement: The converted temperature, rounded to 2 decimals
     """
-    allowed: List[TemperatureUnit] = []
-    for entry in TemperatureUnit:
-        allowed.append(entry)
-
-    if orig_temperature.unit not in allowed or to_unit not in allowed:
+    if orig_temperature.unit not in _ALLOWED or to_unit not in _ALLOWED:
         raise ValueError(
-            f'Illegal temperature conversion value: "{orig_temperature.unit}" -> "{to_unit}" Please use {allowed}'
+            f'Illegal temperature conversion value: "{orig_temperature.unit}" -> "{to_unit}" Please use {list(TemperatureUnit)}'
         )
 
-    # nothign to do
+    # nothing to do
     if to_unit == orig_temperature.unit:
         return orig_temperature
 
-    temperature = TemperatureMeasurement(unit=to_unit, value=-99999999)
+    scale, offset = _AFFINE[(orig_temperature.unit, to_unit)]
 
-    if to_unit == TemperatureUnit.CELSIUS:
-        if orig_temperature.unit == TemperatureUnit.FAHRENHEIT:
-            temperature.value = (orig_temperature.value - 32) / 1.8
-        elif orig_temperature.unit == TemperatureUnit.KELVIN:
-            temperature.value = orig_temperature.value - 273.15
-        else:
-            raise ValueError(f"Unable to convert {temperature.unit} to {to_unit}")
-    elif to_unit == TemperatureUnit.FAHRENHEIT:
-        if orig_temperature.unit == TemperatureUnit.KELVIN:
-            temperature.value = (orig_temperature.value * 1.8) - 459.67
-        elif orig_temperature.unit == TemperatureUnit.CELSIUS:
-            temperature.value = (orig_temperature.value * 1.8) + 32
-        else:
-            raise ValueError(f"Unable to convert {orig_temperature.value} to {to_unit}")
-    elif to_unit == TemperatureUnit.KELVIN:
-        if orig_temperature.unit == TemperatureUnit.FAHRENHEIT:
-            temperature.value = (orig_temperature.value + 459.67) / 1.8
-        elif orig_temperature.unit == TemperatureUnit.CELSIUS:
-            temperature.value = orig_temperature.value + 273.15
+    return TemperatureMeasurement(
+        value=round(orig_temperature.value * scale + offset, 2), unit=to_unit
+    )
+
+
+def convert_temperatures(
+    values: Sequence[float],
+    units: Union[TemperatureUnit, Sequence[TemperatureUnit]],
+    to_unit: TemperatureUnit,
+    decimals: Optional[int] = 2,
+) -> List[float]:
+    """Convert a batch of temperature values at once
+
+    Uses NumPy when it is installed, plain Python otherwise.
+
+    Args:
+        values (Sequence[float]): Temperature values to be converted
+        units (TemperatureUnit | Sequence[TemperatureUnit]): Unit of all the values, or the unit
+            of each value
+        to_unit (TemperatureUnit): Conversion to unit of measure
+        decimals (Optional[int]): Decimals to round the converted values to, None to not round
+
+    Raises:
+        ValueError: If an unknown unit is provided, or units and values differ in length
+
+    Returns:
+        List[float]: The converted values, in the order of values
+    """
+    if to_unit not in _ALLOWED:
+        raise ValueError(f'Illegal temperature conversion unit: "{to_unit}"')
+
+    single_unit = isinstance(units, TemperatureUnit)
+    if not single_unit and len(units) != len(values):  # type: ignore
+        raise ValueError(f"Got {len(units)} units for {len(values)} values")  # type: ignore
+
+    try:
+        if np is not None:
+            return _convert_numpy(values, units, to_unit, decimals)
+
+        if single_unit:
+            scale, offset = _AFFINE[(units, to_unit)]  # type: ignore
+            converted = [value * scale + offset for value in values]
         else:
-            raise ValueError(f"Unable to convert {temperature.unit} to {to_unit}")
+            coefficients = [_AFFINE[(unit, to_unit)] for unit in units]  # type: ignore
+            converted = [value * c[0] + c[1] for value, c in zip(values, coefficients)]
+    except KeyError as e:
+        raise ValueError(f"Illegal temperature conversion unit: {e}") from e
+
+    if decimals is None:
+        return converted
+
+    return [round(value, decimals) for value in converted]
+
+
+def _convert_numpy(
+    values: Sequence[float],
+    units: Union[TemperatureUnit, Sequence[TemperatureUnit]],
+    to_unit: TemperatureUnit,
+    decimals: Optional[int],
+) -> List[float]:
+    array = np.asarray(values, dtype=np.float64)
+    to_index = _UNIT_INDEX[to_unit]
+
+    if isinstance(units, TemperatureUnit):
+        from_index: Any = _UNIT_INDEX[units]
+    else:
+        from_index = np.fromiter(
+            (_UNIT_INDEX[unit] for unit in units), dtype=np.intp, count=len(units)
+        )
+
+    converted = array * _SCALES[from_index, to_index] + _OFFSETS[from_index, to_index]
+    if decimals is not None:
+        converted = np.round(converted, decimals)
+
+    return converted.tolist()
+
+
+def response_text_chunks(result: Any, chunk_size: int = 4096) -> Iterator[str]:
+    """Incrementally decoded text of a (streamed) requests.Response body"""
+    decoder = codecs.getincrementaldecoder(result.encoding or "utf-8")(errors="replace")
 
-    temperature.value = round(temperature.value, 2)
+    for chunk in result.iter_content(chunk_size=chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
 
-    return temperature
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def decode_first_item(chunks: Iterable[str], key: str) -> Any:
+    """Decode only the first item of the first JSON array stored under key
+
+    Reads the document chunk by chunk and stops as soon as that item is complete, so the rest of
+    the document is neither read nor decoded. The item has to be a JSON object or array.
+
+    Args:
+        chunks (Iterable[str]): the JSON document, in order, as one or more text chunks
+        key (str): name of the object member holding the array
+
+    Raises:
+        ValueError: If the document ends before the first item of the array is complete
+
+    Returns:
+        Any: the decoded first item of the array
+    """
+    array_start = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[\s*')
+    decoder = json.JSONDecoder()
+
+    buffer = ""
+    item_start = -1
+
+    for chunk in chunks:
+        # only rescan the tail of what was already searched, in case the key was split
+        search_from = max(0, len(buffer) - len(key) - 64)
+        buffer += chunk
+
+        if item_start < 0:
+            match = array_start.search(buffer, search_from)
+            # the key or the start of its first item may still be split over the next chunk
+            if match is None or match.end() == len(buffer):
+                continue
+            item_start = match.end()
+
+        try:
+            item, _ = decoder.raw_decode(buffer, item_start)
+            return item
+        except json.JSONDecodeError:
+            # the first item is not complete yet
+            continue
+
+    raise ValueError(f'Unable to find the first item of "{key}" in the document')
 
 
 def main():
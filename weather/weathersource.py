@@ -2,11 +2,17 @@
 Weather Services implementing WeatherServiceProtocol functionality to gather weather data
 """
 
-from typing import Protocol
+from typing import Dict, List, Optional, Protocol, runtime_checkable
 
 import requests
 
-from weather.utils import TemperatureMeasurement, TemperatureUnit
+from weather.gridpoints import GridpointCache, parse_coordinates
+from weather.utils import (
+    TemperatureMeasurement,
+    TemperatureUnit,
+    decode_first_item,
+    response_text_chunks,
+)
 
 
 class WeatherSourceProtocol(Protocol):
@@ -14,6 +20,10 @@ class WeatherSourceProtocol(Protocol):
     def name(self) -> str:
         ...
 
+    @property
+    def partial_parse(self) -> bool:
+        ...
+
     def formatted_url(self, location_code: str) -> str:
         ...
 
@@ -21,14 +31,60 @@ class WeatherSourceProtocol(Protocol):
         ...
 
 
+@runtime_checkable
+class BatchWeatherSourceProtocol(WeatherSourceProtocol, Protocol):
+    """Optional extension for Weather Sources able to look up several locations in one request"""
+
+    @property
+    def max_batch_size(self) -> int:
+        ...
+
+    def formatted_batch_url(self, location_codes: List[str]) -> str:
+        ...
+
+    def extract_temperatures(self, result: requests.Response) -> Dict[str, TemperatureMeasurement]:
+        ...
+
+
+@runtime_checkable
+class ResolvingWeatherSourceProtocol(WeatherSourceProtocol, Protocol):
+    """Optional extension for Weather Sources whose location codes have to be resolved, through a
+    request of their own, into the URL they are looked up at"""
+
+    def resolution_url(self, location_code: str) -> Optional[str]:
+        """URL resolving the location code, None when it is resolved or needs no resolving"""
+        ...
+
+    def resolve(self, location_code: str, result: requests.Response) -> None:
+        ...
+
+    def invalidate(self, location_code: str) -> None:
+        """Forget the resolution of a location code, it is resolved again on its next lookup"""
+        ...
+
+
 class WeatherGovSource:
     """Weather service class for Weather.gov
 
-    implementation of the WeatherService protocol"""
+    implementation of the WeatherService protocol
 
-    def __init__(self, api_key: str) -> None:
+    Location codes are either a gridpoint "{office}/{x},{y}" or coordinates
+    "{latitude},{longitude}". Coordinates are resolved once through the points endpoint into their
+    hourly forecast URL, kept in the gridpoints cache"""
+
+    def __init__(
+        self,
+        api_key: str,
+        partial_parse: bool = False,
+        base_url: str = "https://api.weather.gov",
+        gridpoints: Optional[GridpointCache] = None,
+    ) -> None:
         self._name = "Weather.gov"
-        self._url_pattern: str = "https://api.weather.gov/gridpoints/{location_code}/forecast"
+        self._url_pattern: str = base_url + "/gridpoints/{location_code}/forecast"
+        self._points_url_pattern: str = base_url + "/points/{latitude},{longitude}"
+        self._partial_parse = partial_parse
+
+        self.gridpoints = gridpoints if gridpoints is not None else GridpointCache()
 
         # dont really need the API Key, but storing for future just in case
         self.api_key = api_key
@@ -37,12 +93,53 @@ class WeatherGovSource:
     def name(self) -> str:
         return self._name
 
+    @property
+    def partial_parse(self) -> bool:
+        return self._partial_parse
+
     def formatted_url(self, location_code: str) -> str:
-        return self._url_pattern.format(location_code=location_code)
+        coordinates = parse_coordinates(location_code)
+        if coordinates is None:
+            return self._url_pattern.format(location_code=location_code)
+
+        url = self.gridpoints.get(",".join(coordinates))
+        if url is None:
+            raise ValueError(f"Coordinates {location_code} are not resolved, see resolution_url")
+
+        return url
+
+    def resolution_url(self, location_code: str) -> Optional[str]:
+        coordinates = parse_coordinates(location_code)
+        if coordinates is None or self.gridpoints.get(",".join(coordinates)) is not None:
+            return None
+
+        latitude, longitude = coordinates
+        return self._points_url_pattern.format(latitude=latitude, longitude=longitude)
+
+    def resolve(self, location_code: str, result: requests.Response) -> None:
+        coordinates = parse_coordinates(location_code)
+        if coordinates is None:
+            return
+
+        url = result.json()["properties"].get("forecastHourly")
+        if not url:
+            raise ConnectionRefusedError(f"No hourly forecast for the coordinates {location_code}")
+
+        self.gridpoints.put(",".join(coordinates), url)
+
+    def invalidate(self, location_code: str) -> None:
+        coordinates = parse_coordinates(location_code)
+        if coordinates is not None:
+            self.gridpoints.invalidate(",".join(coordinates))
 
     def extract_temperature(self, result: requests.Response) -> TemperatureMeasurement:
-        temperature = result.json()["properties"]["periods"][0]["temperature"]
-        temp_unit = result.json()["properties"]["periods"][0]["temperatureUnit"]
+        if self._partial_parse:
+            period = decode_first_item(response_text_chunks(result), "periods")
+        else:
+            period = result.json()["properties"]["periods"][0]
+
+        temperature = period["temperature"]
+        temp_unit = period["temperatureUnit"]
 
         if temp_unit == "F":
             temperatureUnit = TemperatureUnit.FAHRENHEIT
@@ -61,11 +158,21 @@ class OpenWeatherMapSource:
 
     implementation of the WeatherService protocol"""
 
-    def __init__(self, api_key: str) -> None:
+    def __init__(
+        self,
+        api_key: str,
+        max_batch_size: int = 20,
+        partial_parse: bool = False,
+        base_url: str = "http://api.openweathermap.org",
+    ) -> None:
         self._name = "OpenWeatherMap"
-        self._url_pattern: str = (
-            "http://api.openweathermap.org/data/2.5/forecast?id={location_code}&appid={api_key}"
+        self._url_pattern: str = base_url + "/data/2.5/forecast?id={location_code}&appid={api_key}"
+        # the group endpoint takes up to 20 city IDs per call
+        self._batch_url_pattern: str = (
+            base_url + "/data/2.5/group?id={location_codes}&appid={api_key}"
         )
+        self._max_batch_size = max_batch_size
+        self._partial_parse = partial_parse
 
         self.api_key = api_key
 
@@ -73,26 +180,59 @@ class OpenWeatherMapSource:
     def name(self) -> str:
         return self._name
 
+    @property
+    def partial_parse(self) -> bool:
+        return self._partial_parse
+
     def formatted_url(self, location_code: str) -> str:
         return self._url_pattern.format(location_code=location_code, api_key=self.api_key)
 
     def extract_temperature(self, result: requests.Response) -> TemperatureMeasurement:
-        temperature = result.json()["list"][0]["main"]["temp"]
+        if self._partial_parse:
+            forecast = decode_first_item(response_text_chunks(result), "list")
+        else:
+            forecast = result.json()["list"][0]
+
+        temperature = forecast["main"]["temp"]
         temperatureUnit = TemperatureUnit.KELVIN
 
         return TemperatureMeasurement(temperature, temperatureUnit)
 
+    @property
+    def max_batch_size(self) -> int:
+        return self._max_batch_size
+
+    def formatted_batch_url(self, location_codes: List[str]) -> str:
+        return self._batch_url_pattern.format(
+            location_codes=",".join(location_codes), api_key=self.api_key
+        )
+
+    def extract_temperatures(self, result: requests.Response) -> Dict[str, TemperatureMeasurement]:
+        return {
+            str(entry["id"]): TemperatureMeasurement(entry["main"]["temp"], TemperatureUnit.KELVIN)
+            for entry in result.json()["list"]
+        }
+
 
 class WeatherBitSource:
     """Weather service class for Weatherbit
 
     implementation of the WeatherService protocol"""
 
-    def __init__(self, api_key: str) -> None:
+    def __init__(
+        self,
+        api_key: str,
+        max_batch_size: int = 20,
+        partial_parse: bool = False,
+        base_url: str = "https://api.weatherbit.io",
+    ) -> None:
         self._name = "Weatherbit"
-        self._url_pattern: str = (
-            "https://api.weatherbit.io/v2.0/current?city_id={location_code}&key={api_key}"
+        self._url_pattern: str = base_url + "/v2.0/current?city_id={location_code}&key={api_key}"
+        self._batch_url_pattern: str = (
+            base_url + "/v2.0/current?cities={location_codes}&key={api_key}"
         )
+        self._max_batch_size = max_batch_size
+        self._partial_parse = partial_parse
 
         self.api_key = api_key
 
@@ -100,11 +240,35 @@ class WeatherBitSource:
     def name(self) -> str:
         return self._name
 
+    @property
+    def partial_parse(self) -> bool:
+        return self._partial_parse
+
     def formatted_url(self, location_code: str) -> str:
         return self._url_pattern.format(location_code=location_code, api_key=self.api_key)
 
     def extract_temperature(self, result: requests.Response) -> TemperatureMeasurement:
-        temperature = result.json()["data"][0]["temp"]
+        if self._partial_parse:
+            current = decode_first_item(response_text_chunks(result), "data")
+        else:
+            current = result.json()["data"][0]
+
+        temperature = current["temp"]
         temperatureUnit = TemperatureUnit.CELSIUS
 
         return TemperatureMeasurement(temperature, temperatureUnit)
+
+    @property
+    def max_batch_size(self) -> int:
+        return self._max_batch_size
+
+    def formatted_batch_url(self, location_codes: List[str]) -> str:
+        return self._batch_url_pattern.format(
+            location_codes=",".join(location_codes), api_key=self.api_key
+        )
+
+    def extract_temperatures(self, result: requests.Response) -> Dict[str, TemperatureMeasurement]:
+        return {
+            str(entry["city_id"]): TemperatureMeasurement(entry["temp"], TemperatureUnit.CELSIUS)
+            for entry in result.json()["data"]
+        }
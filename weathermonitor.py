@@ -1,99 +1,323 @@
 """_summary_
 
 """
-import ast
+import atexit
 import configparser
+import functools
 import logging
+import logging.handlers
+import signal
+import threading
 import time
-from typing import Dict, List, Optional, Tuple
-
-from prometheus_client import push_to_gateway  # type: ignore
-from prometheus_client import CollectorRegistry, Gauge
+from types import FrameType
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 from weather import factory as weatherfactory
-from weather.utils import TemperatureMeasurement, TemperatureUnit, convert_temperature
+from weather import metrics, profiler
+from weather.breaker import CircuitBreaker
+from weather.cache import ResponseCache
+from weather.fetcher import FetchEngine
+from weather.gridpoints import GridpointCache
+from weather.history import HistoryPublisher, TemperatureHistory
+from weather.logs import start_logging
+from weather.plan import Lookup, PlannedLocation, PollPlan, build_poll_plan
+from weather.provider import WeatherProvider, WeatherProviderProtocol
+from weather.publisher import (
+    AsyncPublisher,
+    BatchPushPublisher,
+    ExporterPublisher,
+    LocationPushPublisher,
+    PublisherProtocol,
+    publish_cycle,
+    record_readings,
+)
+from weather.publisher import prometheus_temperature, push_temperature  # noqa: F401
+from weather.ratelimit import RateLimiter
+from weather.readings import Reading
+from weather.scheduler import PollScheduler
+from weather.shard import QueuePublisher, ShardMetrics, ShardSupervisor, report_started
+from weather.state import StateStore
 from weather.weathersource import OpenWeatherMapSource, WeatherBitSource, WeatherGovSource
 
+CONFIG_FILE = "config.ini"
 
-def prometheus_temperature(
-    registry: CollectorRegistry,
-    temperature: TemperatureMeasurement,
-    location_name: Optional[str] = None,
-    weather_service: Optional[str] = None,
-) -> CollectorRegistry:
-
-    namespace = "weather"
-    metric = "temperature"
-    desc = "Temperature reading from weather service"
-    labelnames = ["source", "location"]
-
-    gc = Gauge(
-        name=metric,
-        documentation=desc,
-        labelnames=labelnames,
-        unit="celsius",
-        registry=registry,
-        namespace=namespace,
-    )
+# set by SIGHUP, the poll loop reloads [LOCATIONS] before its next cycle
+_reload_requested = threading.Event()
 
-    gc.labels(weather_service, location_name).set(
-        convert_temperature(orig_temperature=temperature, to_unit=TemperatureUnit.CELSIUS).value
-    )
+# service last publishing the readings of each hedged location, keyed by its primary labels
+_hedge_winners: Dict[Tuple[str, str], str] = {}
+_hedge_winners_lock = threading.Lock()
 
-    gf = Gauge(
-        name=metric,
-        documentation=desc,
-        labelnames=labelnames,
-        unit="fahrenheit",
-        registry=registry,
-        namespace=namespace,
-    )
 
-    gf.labels(weather_service, location_name).set(
-        convert_temperature(orig_temperature=temperature, to_unit=TemperatureUnit.FAHRENHEIT).value
-    )
+def register_sources(
+    api_keys: Dict[str, str],
+    partial_parse: bool = False,
+    gridpoints: Optional[GridpointCache] = None,
+    skip_registered: bool = False,
+) -> None:
+    """Register the Weather Sources of the monitor
+
+    Raises:
+        ValueError: If a source is already registered, unless skip_registered keeps it
+    """
+    sources = {
+        "weather.gov": WeatherGovSource(
+            api_key=api_keys.get("weather.gov"),  # type: ignore
+            partial_parse=partial_parse,
+            gridpoints=gridpoints,
+        ),
+        "openweathermap": OpenWeatherMapSource(
+            api_key=api_keys.get("openweathermap"), partial_parse=partial_parse  # type: ignore
+        ),
+        "weatherbit": WeatherBitSource(
+            api_key=api_keys.get("weatherbit"), partial_parse=partial_parse  # type: ignore
+        ),
+    }
 
-    return registry
+    for name, source in sources.items():
+        if skip_registered and weatherfactory.weather_factory_source.get(name) is not None:
+            continue
 
+        weatherfactory.register_source(name, source)
 
-def push_temperature(
-    pushgateway_url: str,
-    temperature: TemperatureMeasurement,
-    location_name: Optional[str] = None,
-    weather_service: Optional[str] = None,
-) -> None:
-    registry = CollectorRegistry()
 
-    if pushgateway_url is None or pushgateway_url == "":
-        raise ValueError("Missing Pushgateway URL")
+def service_settings(config: configparser.ConfigParser, section: str) -> Dict[str, float]:
+    """Per weather service values of a config section, keyed by the service name"""
+    if not config.has_section(section):
+        return {}
 
-    registry = prometheus_temperature(
-        registry,
-        temperature=temperature,
-        location_name=location_name,
-        weather_service=weather_service,
-    )
+    return {
+        service: float(value)
+        for service, value in config.items(section)
+        if service not in config.defaults()
+    }
 
-    push_to_gateway(
-        gateway=pushgateway_url,
-        job="weather",
-        registry=registry,
-        grouping_key={"source": weather_service, "location": location_name},
-    )
 
+def source_settings(config: configparser.ConfigParser, section: str) -> Dict[str, float]:
+    """Per weather service values of a config section, keyed by the Weather Source name"""
+    return {
+        weatherfactory.source(service).name: value
+        for service, value in service_settings(config, section).items()
+    }
 
-def register_sources(
-    api_keys: Dict[str, str],
+
+def poll_lookup(
+    weather_provider: WeatherProviderProtocol,
+    lookup: Lookup,
+    publisher: PublisherProtocol,
+) -> bool:
+    """Run one lookup of the poll plan and record its temperatures for every [LOCATIONS] entry
+    referring to them
+
+    Returns:
+        bool: True when the weather source asked for a retry adjustment of the poll interval
+    """
+    logger = logging.getLogger(__name__)
+
+    weather_source = lookup.source
+    # service and location_code the readings came from, a hedged lookup may be won by a fallback
+    service = lookup.service
+    winning_code: Optional[str] = None
+    services = [lookup.service] + [alternate.service for alternate in lookup.alternates]
+
+    def count_error(index: int, error: BaseException) -> None:
+        metrics.POLL_ERRORS.labels(services[index], type(error).__name__).inc()
+
+    def count_lookup_error(error: BaseException) -> None:
+        # the candidates of a hedged lookup count their own errors, as they fail
+        if not lookup.alternates:
+            count_error(0, error)
+
+    try:
+        if lookup.batch:
+            temperatures = weather_provider.temperatures(
+                weather_source, list(lookup.location_codes)
+            )
+        elif lookup.alternates:
+            location_code = lookup.location_codes[0]
+            winner, temperature = weather_provider.temperature_hedged(
+                [(weather_source, location_code)]
+                + [(alternate.source, alternate.location_code) for alternate in lookup.alternates],
+                on_error=count_error,
+            )
+            if winner > 0:
+                alternate = lookup.alternates[winner - 1]
+                service = alternate.service
+                weather_source = alternate.source
+                winning_code = alternate.location_code
+            temperatures = {location_code: temperature}
+        else:
+            location_code = lookup.location_codes[0]
+            temperatures = {
+                location_code: weather_provider.temperature(weather_source, location_code)
+            }
+    except ConnectionRefusedError as cre:
+        count_lookup_error(cre)
+        logger.warning("get_temperature raised ConnectionRefusedError: %s", cre)
+        return False
+    except ProcessLookupError as ple:
+        count_lookup_error(ple)
+        logger.warning("get_temperature raised ProcessLookupError: %s", ple)
+        return True
+    except Exception as e:
+        # a malformed answer only fails its own lookup, the rest of the cycle goes on
+        count_lookup_error(e)
+        logger.error(
+            "get_temperature of %s %s failed", lookup.service, lookup.location_codes, exc_info=True
+        )
+        return False
+
+    fetched_at = getattr(weather_provider, "fetched_at", None)
+
+    readings: List[Reading] = []
+    for location in lookup.locations:
+        location_name = location.name
+        temperature = temperatures.get(location.location_code)
+
+        if temperature:
+            if lookup.alternates:
+                replace_hedge_winner(publisher, location, service)
+
+            source_code = winning_code or location.location_code
+            reading_fetched_at = (
+                fetched_at(weather_source, source_code) if fetched_at else None
+            ) or time.time()
+            metrics.READING_AGE.labels(service, location_name).set_function(
+                lambda fetched=reading_fetched_at: max(time.time() - fetched, 0.0)
+            )
+
+            logger.debug(
+                'Weather Source: "%s" Location: "%s" Temp: %s',
+                weather_source.name,
+                location_name,
+                temperature,
+            )
+
+            readings.append(Reading.of(temperature, service, location_name, reading_fetched_at))
+        else:
+            metrics.POLL_ERRORS.labels(service, "no_temperature").inc()
+            logger.warning(
+                "no temperature returned - Source: %s | Location: %s",
+                weather_source.name,
+                location_name,
+            )
+
+    if readings:
+        record_readings(publisher, readings)
+
+    return False
+
+
+def remove_series(publisher: PublisherProtocol, labels: Iterable[Tuple[str, str]]) -> None:
+    """Drop the series of (service, location name) labels, where the publisher allows it"""
+    remove = getattr(publisher, "remove", None)
+    for weather_service, location_name in labels:
+        if remove is not None:
+            remove(location_name=location_name, weather_service=weather_service)
+
+        try:
+            metrics.READING_AGE.remove(weather_service, location_name)
+        except KeyError:
+            pass
+
+
+def replace_hedge_winner(
+    publisher: PublisherProtocol, location: PlannedLocation, service: str
 ) -> None:
-    weatherfactory.register_source(
-        "weather.gov", WeatherGovSource(api_key=api_keys.get("weather.gov"))  # type: ignore
-    )
-    weatherfactory.register_source(
-        "openweathermap", OpenWeatherMapSource(api_key=api_keys.get("openweathermap"))  # type: ignore
-    )
-    weatherfactory.register_source(
-        "weatherbit", WeatherBitSource(api_key=api_keys.get("weatherbit"))  # type: ignore
-    )
+    """Record the service publishing a hedged location, dropping the series of the other services
+    of the location when it changed (or on its first reading, for series left by a previous run)"""
+    with _hedge_winners_lock:
+        previous = _hedge_winners.get(location.labels)
+        _hedge_winners[location.labels] = service
+
+    if previous != service:
+        remove_series(
+            publisher, [labels for labels in location.all_labels() if labels[0] != service]
+        )
+
+
+def poll_tasks(
+    weather_provider: WeatherProviderProtocol,
+    lookups: Iterable[Lookup],
+    publisher: PublisherProtocol,
+) -> List[Tuple[str, Callable[[], bool]]]:
+    """Fetch tasks for the lookups of one poll cycle, as (service name, task) pairs"""
+    return [
+        (lookup.service, functools.partial(poll_lookup, weather_provider, lookup, publisher))
+        for lookup in lookups
+    ]
+
+
+def publish_cached(
+    weather_provider: WeatherProviderProtocol,
+    poll_plan: PollPlan,
+    publisher: PublisherProtocol,
+) -> int:
+    """Record and publish the cached readings of the planned locations, without any upstream request
+
+    Lets a restarted monitor publish the readings restored from its state file right away
+
+    Returns:
+        int: number of locations published
+    """
+    cache = getattr(weather_provider, "cache", None)
+    if cache is None:
+        return 0
+
+    readings: List[Reading] = []
+    for location in poll_plan.locations:
+        entry = cache.get(location.source.name, location.location_code)
+        if entry is not None:
+            readings.append(
+                Reading.of(entry.temperature, location.service, location.name, entry.fetched_at)
+            )
+
+    if readings:
+        record_readings(publisher, readings)
+        publisher.publish()
+
+    return len(readings)
+
+
+def request_reload(signum: int, frame: Optional[FrameType]) -> None:
+    """Signal handler asking the poll loop to reload [LOCATIONS] before its next cycle"""
+    _reload_requested.set()
+
+
+def reload_poll_plan(
+    config_path: str,
+    poll_plan: PollPlan,
+    publisher: PublisherProtocol,
+    batch_lookups: bool = False,
+    shard_index: int = 0,
+    shard_count: int = 1,
+) -> PollPlan:
+    """Re-read [LOCATIONS] from the config file, keeping the current plan if it is invalid"""
+    logger = logging.getLogger(__name__)
+
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_path)
+        new_plan = build_poll_plan(
+            config.items("LOCATIONS"), batch_lookups, shard_index, shard_count
+        )
+    except (configparser.Error, ValueError) as e:
+        logger.error("reload of %s failed, keeping the current locations: %s", config_path, e)
+        return poll_plan
+
+    # drop the series of locations no longer configured, where the publisher allows it
+    removed = {labels for l in poll_plan.locations for labels in l.all_labels()} - {
+        labels for l in new_plan.locations for labels in l.all_labels()
+    }
+    remove_series(publisher, removed)
+
+    with _hedge_winners_lock:
+        for labels in removed:
+            _hedge_winners.pop(labels, None)
+
+    logger.info("reloaded %d locations from %s", len(new_plan.locations), config_path)
+
+    return new_plan
 
 
 def poll_weather_services(
@@ -101,76 +325,212 @@ def poll_weather_services(
     api_keys: Dict[str, str],
     pushgateway_url: str,
     poll_interval: int = 15,
+    fetch_workers: int = 1,
+    max_source_concurrency: int = 0,
+    publisher: Optional[PublisherProtocol] = None,
+    batch_lookups: bool = False,
+    config_path: Optional[str] = None,
+    service_intervals: Optional[Dict[str, float]] = None,
+    poll_jitter: float = 0.0,
+    max_backoff: Optional[float] = None,
+    max_cycles: Optional[int] = None,
+    warm_start: bool = False,
+    shard_index: int = 0,
+    shard_count: int = 1,
 ) -> None:
+    """Poll the weather services for the configured locations, forever or for max_cycles cycles
+
+    poll_interval, service_intervals (keyed by service name) and max_backoff are in minutes,
+    poll_jitter in seconds. With warm_start, the readings already cached by the provider are
+    published before the first cycle. With more than one shard only the locations of
+    shard_index are polled.
+    """
     logger = logging.getLogger(__name__)
 
-    register_sources(api_keys)
+    if publisher is None:
+        publisher = LocationPushPublisher(pushgateway_url)
+
+    # configure_provider() registers the sources with their settings, ahead of the poll loop
+    register_sources(api_keys, skip_registered=True)
 
     weather_provider = weatherfactory.provider()
 
-    while True:
-        logger.info("Gathering weather forecasts")
-        # default wait time between weather lookups
-        sleep_minutes = poll_interval
-
-        for l in locations:
-            location_code = None
-
-            # grab the location information Dict config
-            location_info = l[1]
-
-            # location: Dict[str, str] = json.loads(location_info)
-            location = ast.literal_eval(location_info)
-
-            source_name = location["service"]
-            location_code = location["location_code"]
-            location_name = location["name"]
-
-            weather_source = weatherfactory.source(source_name)
-
-            try:
-                temperature = weather_provider.temperature(weather_source, location_code)
-                logmsg = f'Weather Source: "{weather_source.name}" Location: "{location_name}" Temp: {convert_temperature(temperature, TemperatureUnit.FAHRENHEIT)}'
-                logger.debug(logmsg)
-
-                if temperature:
-                    push_temperature(
-                        pushgateway_url=pushgateway_url,
-                        temperature=temperature,
-                        weather_service=source_name,
-                        location_name=location_name,
-                    )
-                else:
-                    logmsg = f"no temperature returned - Source: {weather_source} | Location: {location_name}"
-                    logger.warning(logmsg)
-            except ConnectionRefusedError as cre:
-                logmsg = f"get_temperature raised ConnectionRefusedError: {cre}"
-                logger.warning(logmsg)
-            except ProcessLookupError as ple:
-                logmsg = f"get_temperature raised ProcessLookupError: {ple}"
-                logger.warning(logmsg)
-                # set a retry for the service loop
-                logger.warning("retry attempt adjustment")
-                sleep_minutes = round(poll_interval / 2, 0)
-
-        # wait to call services again
-        logmsg = f"sleeping {sleep_minutes} minutes"
-        logger.info(logmsg)
-        time.sleep(sleep_minutes * 60)
+    # parse and validate the locations once, the cycles only walk the prepared lookups
+    poll_plan = build_poll_plan(locations, batch_lookups, shard_index, shard_count)
 
+    if warm_start:
+        published = publish_cached(weather_provider, poll_plan, publisher)
+        logger.info("published %d cached readings before the first cycle", published)
 
-def main():
+    scheduler = PollScheduler(
+        default_interval=poll_interval * 60,
+        service_intervals={
+            service: minutes * 60 for service, minutes in (service_intervals or {}).items()
+        },
+        jitter=poll_jitter,
+        max_backoff=max_backoff * 60 if max_backoff is not None else None,
+    )
+    scheduler.replace(poll_plan.lookups)
+
+    # the tasks of the poll cycles are keyed by service, the rate limiters by source name
+    rate_limiters = getattr(weather_provider, "rate_limiters", {})
+    fetch_engine = FetchEngine(
+        max_workers=fetch_workers,
+        max_per_source=max_source_concurrency,
+        rate_limiters={
+            service: rate_limiters[source.name]
+            for service, source in weatherfactory.weather_factory_source.items()
+            if source.name in rate_limiters
+        },
+    )
 
+    cycles = 0
+    try:
+        while True:
+            if _reload_requested.is_set():
+                _reload_requested.clear()
+                if config_path is not None:
+                    with profiler.span("reload_config", path=config_path):
+                        poll_plan = reload_poll_plan(
+                            config_path,
+                            poll_plan,
+                            publisher,
+                            batch_lookups,
+                            shard_index,
+                            shard_count,
+                        )
+                    scheduler.replace(poll_plan.lookups)
+
+            due = scheduler.due()
+
+            if due:
+                logger.info("Gathering weather forecasts for %d lookups", len(due))
+
+                with metrics.CYCLE_DURATION.time(), profiler.PROFILER.cycle(lookups=str(len(due))):
+                    retries = fetch_engine.run(poll_tasks(weather_provider, due, publisher))
+
+                    publish_cycle(publisher)
+
+                if any(retries):
+                    # failing services are retried on their own backoff, the rest keep their interval
+                    logger.warning("retry attempt adjustment")
+
+                scheduler.complete(zip(due, retries))
+
+                cycles += 1
+                if max_cycles is not None and cycles >= max_cycles:
+                    return
+
+            # wait until the next lookup is due, or a reload is requested
+            next_due = scheduler.next_due()
+            if next_due is None:
+                logger.info("no locations to poll, waiting for a reload")
+                _reload_requested.wait()
+                continue
+
+            sleep_seconds = max(next_due - scheduler.clock(), 0)
+            logger.info("sleeping %.1f seconds", sleep_seconds)
+            _reload_requested.wait(sleep_seconds)
+    finally:
+        fetch_engine.shutdown()
+
+        # flush what a background publisher still holds
+        close = getattr(publisher, "close", None)
+        if close is not None:
+            close()
+
+
+def host_grouping_key(settings: configparser.SectionProxy) -> Dict[str, str]:
+    """Pushgateway grouping key of this host: hosts owning a shard each push their own groups"""
+    if settings.getint("shard_count", 1) > 1:
+        return {"shard": str(settings.getint("shard_index", 0))}
+
+    return {}
+
+
+def build_publisher(
+    settings: configparser.SectionProxy, monitor_metrics: Any = None
+) -> PublisherProtocol:
+    """Publisher for the configured publish_mode, an exporter serves monitor_metrics (by default
+    metrics.REGISTRY) as the monitor's own metrics"""
+    publish_mode = settings.get("publish_mode", "location")
+    pushgateway_url = settings.get("pushgateway")
+    history_size = settings.getint("history_size", 0)
+
+    grouping_key = host_grouping_key(settings)
+
+    publisher: PublisherProtocol
+    if publish_mode == "location":
+        publisher = LocationPushPublisher(pushgateway_url, grouping_key=grouping_key)
+    elif publish_mode == "batch":
+        publisher = BatchPushPublisher(
+            pushgateway_url,
+            chunks=settings.getint("push_batch_chunks", 1),
+            grouping_key=grouping_key,
+        )
+    elif publish_mode == "exporter":
+        exporter = ExporterPublisher(
+            port=settings.getint("exporter_port", 9877),
+            address=settings.get("exporter_address", "0.0.0.0"),
+            monitor_metrics=monitor_metrics,
+        )
+
+        if history_size > 0:
+            # the history gauges are served next to the readings
+            history = TemperatureHistory(history_size)
+            exporter.registry.register(history.registry)
+            publisher = HistoryPublisher(exporter, history)
+        else:
+            publisher = exporter
+
+        exporter.start()
+        return publisher
+    else:
+        raise ValueError(f'Unknown publish_mode "{publish_mode}"')
+
+    if history_size > 0:
+        publisher = HistoryPublisher(
+            publisher,
+            TemperatureHistory(history_size),
+            pushgateway_url,
+            grouping_key=grouping_key,
+        )
+
+    # push in the background so a slow Pushgateway doesn't hold up the lookups
+    publish_queue_size = settings.getint("publish_queue_size", 10000)
+    if publish_queue_size > 0:
+        publisher = AsyncPublisher(
+            publisher,
+            max_pending=publish_queue_size,
+            flush_interval=settings.getfloat("publish_flush_seconds", 1.0),
+            flush_size=settings.getint("publish_flush_size", 500),
+            max_retry_delay=settings.getfloat("publish_max_retry_seconds", 60.0),
+        )
+
+    return publisher
+
+
+def read_config(config_path: str) -> configparser.ConfigParser:
     config = configparser.ConfigParser()
-    config.read("config.ini")
+    config.read(config_path)
 
     required_sections = ["SETTINGS", "API_KEYS", "LOCATIONS"]
     for section in required_sections:
         if not config.has_section(section):
             raise ValueError(f'Missing config param section "[{section}]"')
 
+    return config
+
+
+def configure_logging(
+    settings: configparser.SectionProxy, worker: Optional[int] = None
+) -> logging.handlers.QueueListener:
+    """Log to the configured file through a queue, written out by a background thread
+
+    A shard worker process logs to a file of its own.
+    """
     # grab and set the log level from the Config
-    log_level_str = config["SETTINGS"].get("log_level")
+    log_level_str = settings.get("log_level")
 
     log_level_info = {
         "DEBUG": logging.DEBUG,
@@ -182,25 +542,325 @@ def main():
 
     log_level = log_level_info.get(log_level_str, logging.WARNING)
 
-    logging.basicConfig(
-        filename="logs/weathermonitor.log",
+    log_format = settings.get("log_format", "text")
+    if log_format not in ("text", "json"):
+        raise ValueError(f"log_format must be text or json, got {log_format}")
+
+    log_file = settings.get("log_file", "logs/weathermonitor.log")
+    if worker is not None:
+        log_file = f"{log_file}.{worker}"
+
+    listener = start_logging(
+        log_file,
         level=log_level,
-        format="%(asctime)s %(levelname)s:%(message)s",
-        datefmt="%Y-%m-%d %I:%M:%S %p",
-        encoding="utf-8",
+        json_lines=log_format == "json",
+        max_bytes=settings.getint("log_max_bytes", 0),
+        backup_count=settings.getint("log_backup_count", 5),
+        queue_size=settings.getint("log_queue_size", 10000),
     )
+    # write out the records still queued when the monitor exits
+    atexit.register(listener.stop)
 
-    gateway_url = config["SETTINGS"].get("pushgateway")
-    poll_interval = config["SETTINGS"].getint("check_interval_minutes")
-    locations = config.items("LOCATIONS")
-    api_keys = config["API_KEYS"]
+    return listener
+
+
+def configure_profiler(settings: configparser.SectionProxy) -> None:
+    """Profile the cycles on SIGUSR1, and right from the start with the profile setting"""
+    sample_interval_ms = settings.getfloat("profile_sample_interval_ms", 5.0)
+
+    profiler.PROFILER.configure(
+        output_dir=settings.get("profile_dir", "profiles"),
+        cycles=settings.getint("profile_cycles", 1),
+        sample_interval=sample_interval_ms / 1000 if sample_interval_ms > 0 else None,
+        slow_calls=settings.getint("profile_slow_calls", 25),
+    )
+
+    if settings.getboolean("profile", False):
+        profiler.PROFILER.request()
+
+
+def check_cache_settings(settings: configparser.SectionProxy) -> None:
+    """Check the settings that only work along with the response cache
+
+    Raises:
+        ValueError: If a setting needing the response cache is set without cache_max_entries
+    """
+    cache_max_entries = settings.getint("cache_max_entries", 0)
+    if settings.get("state_file") and cache_max_entries <= 0:
+        raise ValueError("state_file requires the response cache, set cache_max_entries")
+    if settings.getfloat("max_staleness_seconds", 0.0) > 0 and cache_max_entries <= 0:
+        raise ValueError("max_staleness_seconds requires the response cache, set cache_max_entries")
+
+
+def check_config(config: configparser.ConfigParser) -> None:
+    """Check the config the way the shard workers read it, before any of them is started
+
+    Raises:
+        ValueError: For the first of the settings, per service sections and [LOCATIONS] entries
+            a worker would fail on
+    """
+    settings = config["SETTINGS"]
+    check_cache_settings(settings)
+
+    register_sources(config["API_KEYS"], skip_registered=True)  # type: ignore
+    for section in ("POLL_INTERVALS", "CACHE_TTL", "RATE_LIMITS", "DAILY_BUDGETS"):
+        source_settings(config, section)
+
+    build_poll_plan(
+        config.items("LOCATIONS"),
+        batch_lookups=settings.getboolean("batch_lookups", False),
+        shard_index=settings.getint("shard_index", 0),
+        shard_count=settings.getint("shard_count", 1),
+    )
+
+
+def configure_provider(
+    config: configparser.ConfigParser, worker: Optional[int] = None, workers: int = 1
+) -> bool:
+    """Register the weather sources and the default Weather Provider of the config
+
+    The rate limits and daily budgets are shared out between the shard_count hosts and, on each
+    host, between its workers. A shard worker process (worker out of workers) also gets a state
+    and gridpoint cache file of its own.
+
+    Returns:
+        bool: True when the cache was restored from a state file
+    """
+    settings = config["SETTINGS"]
+
+    # Weather.gov coordinates resolved to their forecast URL, kept across restarts with a file
+    gridpoint_file = settings.get("gridpoint_cache_file")
+    if gridpoint_file and worker is not None:
+        gridpoint_file = f"{gridpoint_file}.{worker}"
+
+    gridpoints = GridpointCache(
+        gridpoint_file or None, ttl=settings.getfloat("gridpoint_cache_days", 7.0) * 86400
+    )
+    # write out the resolutions still waiting for the gridpoint writer
+    atexit.register(gridpoints.close)
+
+    register_sources(
+        config["API_KEYS"],  # type: ignore
+        partial_parse=settings.getboolean("partial_parse", False),
+        gridpoints=gridpoints,
+    )
+
+    check_cache_settings(settings)
+
+    cache = None
+    cache_max_entries = settings.getint("cache_max_entries", 0)
+    state_file = settings.get("state_file")
+    if state_file and worker is not None:
+        state_file = f"{state_file}.{worker}"
+
+    if cache_max_entries > 0:
+        store = None
+        if state_file:
+            store = StateStore(state_file)
+            # write out the updates still waiting for the state writer
+            atexit.register(store.close)
+
+        cache = ResponseCache(
+            max_entries=cache_max_entries,
+            default_ttl=settings.getfloat("cache_ttl_seconds", 0.0),
+            ttls=source_settings(config, "CACHE_TTL"),
+            store=store,
+        )
+        # readings and validators of the previous run, only expired entries are refetched
+        cache.restore()
+
+    # every host runs the same config, the limits are those of the API keys they all share
+    shares = settings.getint("shard_count", 1) * workers
+    rate_limits = source_settings(config, "RATE_LIMITS")
+    daily_budgets = source_settings(config, "DAILY_BUDGETS")
+    rate_limiters = {
+        source_name: RateLimiter(
+            rate_per_minute=rate_limits[source_name] / shares
+            if source_name in rate_limits
+            else None,
+            daily_budget=max(int(daily_budgets[source_name] // shares), 1)
+            if source_name in daily_budgets
+            else None,
+        )
+        for source_name in {**rate_limits, **daily_budgets}
+    }
+
+    circuit_breakers = {}
+    breaker_failure_threshold = settings.getint("breaker_failure_threshold", 0)
+    if breaker_failure_threshold > 0:
+        circuit_breakers = {
+            source.name: CircuitBreaker(
+                failure_threshold=breaker_failure_threshold,
+                cooldown=settings.getfloat("breaker_cooldown_seconds", 60.0),
+                half_open_probes=settings.getint("breaker_half_open_probes", 1),
+            )
+            for source in weatherfactory.weather_factory_source.values()
+        }
+
+    # shared keep-alive HTTP sessions used for every weather lookup
+    weatherfactory.register_provider(
+        "default",
+        WeatherProvider(
+            pool_size=settings.getint("http_pool_size", 10),
+            connect_timeout=settings.getfloat("http_connect_timeout_seconds", 5.0),
+            read_timeout=settings.getfloat("http_read_timeout_seconds", 30.0),
+            cache=cache,
+            rate_limiters=rate_limiters,
+            circuit_breakers=circuit_breakers,
+            max_staleness=settings.getfloat("max_staleness_seconds", 0.0),
+            hedge_percentile=settings.getfloat("hedge_percentile", 0.95),
+            hedge_delay=settings.getfloat("hedge_delay_seconds", 1.0),
+            # every concurrent lookup may run its primary and a hedge at once
+            hedge_workers=settings.getint(
+                "hedge_workers", max(settings.getint("fetch_workers", 1) * 2, 2)
+            ),
+        ),
+    )
+
+    return bool(state_file)
+
+
+def run_poll_loop(
+    config: configparser.ConfigParser,
+    config_path: str,
+    publisher: PublisherProtocol,
+    warm_start: bool = False,
+    shard_index: int = 0,
+    shard_count: int = 1,
+) -> None:
+    settings = config["SETTINGS"]
 
-    # start the weather monitoring poll service
     poll_weather_services(
-        api_keys=api_keys,  # type: ignore
-        locations=locations,
-        pushgateway_url=gateway_url,
-        poll_interval=poll_interval,
+        api_keys=config["API_KEYS"],  # type: ignore
+        locations=config.items("LOCATIONS"),
+        pushgateway_url=settings.get("pushgateway"),
+        poll_interval=settings.getint("check_interval_minutes"),
+        fetch_workers=settings.getint("fetch_workers", 1),
+        max_source_concurrency=settings.getint("max_source_concurrency", 0),
+        publisher=publisher,
+        batch_lookups=settings.getboolean("batch_lookups", False),
+        config_path=config_path,
+        service_intervals=service_settings(config, "POLL_INTERVALS"),
+        poll_jitter=settings.getfloat("poll_jitter_seconds", 0.0),
+        max_backoff=settings.getfloat("max_backoff_minutes", None),
+        warm_start=warm_start,
+        shard_index=shard_index,
+        shard_count=shard_count,
+    )
+
+
+def run_shard_worker(config_path: str, worker: int, queue: Any) -> None:
+    """Entry point of a shard worker process: polls its share of this host's locations and hands
+    the readings to the supervisor through queue"""
+    config = read_config(config_path)
+    settings = config["SETTINGS"]
+    configure_logging(settings, worker=worker)
+    try:
+        _run_shard_worker(config, config_path, worker, queue)
+    except Exception:
+        # to the log, the supervisor only sees the exit code
+        logging.getLogger(__name__).exception("shard worker %d failed", worker)
+        raise
+
+
+def _run_shard_worker(
+    config: configparser.ConfigParser, config_path: str, worker: int, queue: Any
+) -> None:
+    settings = config["SETTINGS"]
+    configure_profiler(settings)
+
+    workers = settings.getint("shard_workers", 1)
+    host_shard_index = settings.getint("shard_index", 0)
+    host_shard_count = settings.getint("shard_count", 1)
+
+    warm_start = configure_provider(config, worker=worker, workers=workers)
+
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, request_reload)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profiler.PROFILER.handle_signal)
+    # the supervisor only passes signals on from now on
+    report_started(queue, worker)
+
+    # a host owning shard i of n runs the shards i * workers to (i + 1) * workers - 1
+    shard_index = host_shard_index * workers + worker
+    # an exporter serves the workers' metrics from the supervisor, they are pushed otherwise
+    exporter = settings.get("publish_mode", "location") == "exporter"
+    publisher = QueuePublisher(
+        queue,
+        shard_index,
+        None if exporter else settings.get("pushgateway"),
+        forward_metrics=exporter,
+        # the supervisor pushes the host's group, each worker its own group within it
+        grouping_key={**host_grouping_key(settings), "worker": str(worker)},
+    )
+
+    run_poll_loop(
+        config,
+        config_path,
+        publisher,
+        warm_start=warm_start,
+        shard_index=shard_index,
+        shard_count=host_shard_count * workers,
+    )
+
+
+def main():
+
+    config = read_config(CONFIG_FILE)
+    settings = config["SETTINGS"]
+    configure_logging(settings)
+    configure_profiler(settings)
+
+    shard_workers = settings.getint("shard_workers", 1)
+    # with shard workers, the monitor metrics are those the workers forward along with our own
+    shard_metrics = ShardMetrics() if shard_workers > 1 else None
+    publisher = build_publisher(settings, monitor_metrics=shard_metrics)
+
+    # reload [LOCATIONS] on SIGHUP without restarting
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, request_reload)
+
+    if shard_workers > 1:
+        # a config every worker would fail on stops the monitor here, not in a restart loop
+        try:
+            check_config(config)
+        except ValueError as e:
+            logging.getLogger(__name__).critical("invalid config %s: %s", CONFIG_FILE, e)
+            raise
+
+        # the workers poll, this process only publishes what they read
+        supervisor = ShardSupervisor(
+            publisher,
+            functools.partial(run_shard_worker, CONFIG_FILE),
+            shard_workers,
+            shard_metrics=shard_metrics,
+        )
+
+        def profile_shards(signum: int, frame: Optional[FrameType]) -> None:
+            # the workers profile their cycles, this process the publishing of their readings
+            profiler.PROFILER.request(profiler.PROFILER.cycles * shard_workers)
+            supervisor.signal_workers(signum)
+
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, profile_shards)
+        supervisor.run(reload=_reload_requested)
+        return
+
+    warm_start = configure_provider(config)
+
+    # profile the next cycles on SIGUSR1 (kill -USR1 <pid>)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profiler.PROFILER.handle_signal)
+
+    # start the weather monitoring poll service
+    run_poll_loop(
+        config,
+        CONFIG_FILE,
+        publisher,
+        warm_start=warm_start,
+        shard_index=settings.getint("shard_index", 0),
+        shard_count=settings.getint("shard_count", 1),
     )
 
 